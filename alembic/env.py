@@ -14,7 +14,7 @@ load_dotenv()
 
 # Importamos el Base y los modelos
 from app.core.db import Base
-from app.models import Invoice, Receipt  # agregá aquí más modelos si los vas creando
+from app.models import Invoice, Receipt, ReceiptJob, LndCursor  # agregá aquí más modelos si los vas creando
 
 # Configuración de Alembic
 config = context.config
@@ -0,0 +1,38 @@
+"""hot path indexes
+
+Revision ID: 3d9e2b7c41a5
+Revises: f00b6bbea260
+Create Date: 2026-10-18 12:20:05.611902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9e2b7c41a5'
+down_revision: Union[str, None] = 'f00b6bbea260'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_invoices_tenant_id_payment_hash', 'invoices', ['tenant_id', 'payment_hash'], unique=False)
+    # Falla si ya hay invoices con más de un recibo: hay que depurarlos antes
+    op.create_index('uq_receipts_invoice_id', 'receipts', ['invoice_id'], unique=True)
+    op.create_index(
+        'ix_api_keys_key_hash_active', 'api_keys', ['key_hash'], unique=False,
+        postgresql_where=sa.text('is_active'),
+        postgresql_include=['tenant_id', 'expires_at'],
+        sqlite_where=sa.text('is_active'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_api_keys_key_hash_active', table_name='api_keys')
+    op.drop_index('uq_receipts_invoice_id', table_name='receipts')
+    op.drop_index('ix_invoices_tenant_id_payment_hash', table_name='invoices')
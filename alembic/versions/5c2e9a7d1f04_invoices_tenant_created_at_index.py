@@ -0,0 +1,28 @@
+"""invoices tenant created_at index
+
+Revision ID: 5c2e9a7d1f04
+Revises: 8f4b1e6a2d93
+Create Date: 2026-10-18 13:40:12.408265
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2e9a7d1f04'
+down_revision: Union[str, None] = '8f4b1e6a2d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_invoices_tenant_id_created_at_id', 'invoices', ['tenant_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_invoices_tenant_id_created_at_id', table_name='invoices')
@@ -0,0 +1,28 @@
+"""receipt signed payload
+
+Revision ID: 8f4b1e6a2d93
+Revises: 3d9e2b7c41a5
+Create Date: 2026-10-18 13:05:41.270318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f4b1e6a2d93'
+down_revision: Union[str, None] = '3d9e2b7c41a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('receipts', sa.Column('signed_payload', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('receipts', 'signed_payload')
@@ -0,0 +1,32 @@
+"""idempotency pending records
+
+Revision ID: b7d4f0c9e215
+Revises: 4e8a2c6b9d31
+Create Date: 2026-10-18 19:41:06.208377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d4f0c9e215'
+down_revision: Union[str, None] = '4e8a2c6b9d31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Una key se reserva (sin respuesta todavía) antes de hacer el trabajo
+    op.alter_column('idempotency_records', 'status_code', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('idempotency_records', 'response_body', existing_type=sa.Text(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM idempotency_records WHERE status_code IS NULL")
+    op.alter_column('idempotency_records', 'response_body', existing_type=sa.Text(), nullable=False)
+    op.alter_column('idempotency_records', 'status_code', existing_type=sa.Integer(), nullable=False)
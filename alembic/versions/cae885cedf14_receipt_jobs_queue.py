@@ -0,0 +1,43 @@
+"""receipt jobs queue
+
+Revision ID: cae885cedf14
+Revises: 7a1abb918f48
+Create Date: 2026-10-18 10:12:31.402215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cae885cedf14'
+down_revision: Union[str, None] = '7a1abb918f48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('receipts', sa.Column('status', sa.String(), server_default='ready', nullable=False))
+    op.create_table('receipt_jobs',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('receipt_id', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['receipt_id'], ['receipts.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('receipt_id')
+    )
+    op.create_index('ix_receipt_jobs_status_created_at', 'receipt_jobs', ['status', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_receipt_jobs_status_created_at', table_name='receipt_jobs')
+    op.drop_table('receipt_jobs')
+    op.drop_column('receipts', 'status')
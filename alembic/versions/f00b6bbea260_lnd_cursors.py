@@ -0,0 +1,33 @@
+"""lnd cursors
+
+Revision ID: f00b6bbea260
+Revises: cae885cedf14
+Create Date: 2026-10-18 11:02:47.118530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f00b6bbea260'
+down_revision: Union[str, None] = 'cae885cedf14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('lnd_cursors',
+    sa.Column('node', sa.String(), nullable=False),
+    sa.Column('settle_index', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('node')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('lnd_cursors')
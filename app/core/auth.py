@@ -1,35 +1,150 @@
 # app/core/auth.py
 
-from fastapi import Request, HTTPException
+import hmac
+import os
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+from fastapi import Header, Request, HTTPException
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from app.core.db import get_db
-from app.models import APIKey
+from sqlalchemy import select, true, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.cache import MISSING, TTLCache
+from app.core.db import AsyncSessionLocal
+from app.core.metrics import current_plan, observe_stage, track_cache
+from app.models import APIKey, Tenant
+
+# Token de administración: rutas /admin y cabecera X-Profile (vacío = nadie es admin)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Caché en memoria de API keys: evita una consulta a la DB por request.
+# Las keys desconocidas se cachean también (caché negativa) con un TTL menor.
+# La caché es por proceso: revocar una key sólo la invalida en el proceso que
+# atiende la revocación, así que el TTL es la ventana de revocación en el
+# resto de workers. Por eso se acota a API_KEY_CACHE_MAX_TTL.
+API_KEY_CACHE_MAX_TTL = 300.0
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+API_KEY_CACHE_TTL = min(float(os.getenv("API_KEY_CACHE_TTL", "60")), API_KEY_CACHE_MAX_TTL)
+API_KEY_NEGATIVE_TTL = float(os.getenv("API_KEY_NEGATIVE_TTL", "10"))
+
+
+class CachedAPIKey(NamedTuple):
+    tenant_id: str
+    is_active: bool
+    expires_at: Optional[datetime]
+    plan: str  # plan del tenant: fija su límite de peticiones
+
+    def is_valid(self) -> bool:
+        if not self.is_active:
+            return False
+        return self.expires_at is None or self.expires_at > datetime.utcnow()
+
+
+# Rutas que no requieren API key (/downloads valida su propia firma)
+PUBLIC_PATHS = ("/docs", "/openapi.json", "/downloads/")
+# Rutas que en vez de API key de tenant piden ADMIN_TOKEN (require_admin)
+ADMIN_PATHS = ("/admin/", "/metrics")
+
+api_key_cache = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
+track_cache("api_keys", api_key_cache)
+
+
+async def _load_api_key(key: str) -> Optional[CachedAPIKey]:
+    """
+    Consulta la API key y el plan de su tenant en la DB (sólo en un miss de
+    la caché). Sólo busca keys activas para aprovechar el índice parcial
+    ix_api_keys_key_hash_active; una key desactivada se trata igual que una
+    desconocida.
+    """
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(APIKey.tenant_id, APIKey.expires_at, Tenant.plan)
+            .join(Tenant, Tenant.id == APIKey.tenant_id)
+            .where(APIKey.key_hash == key, APIKey.is_active == true())
+        )).first()
+    if not row:
+        return None
+    return CachedAPIKey(row.tenant_id, True, row.expires_at, row.plan)
+
+
+async def resolve_api_key(key: str) -> Optional[CachedAPIKey]:
+    """Resuelve una API key usando la caché y, si no está, la base de datos."""
+    entry = api_key_cache.get(key)
+    if entry is not MISSING:
+        return entry
+    entry = await _load_api_key(key)
+    api_key_cache.set(key, entry, ttl=None if entry else API_KEY_NEGATIVE_TTL)
+    return entry
+
+
+def invalidate_api_key(key: str) -> None:
+    """Elimina una API key de la caché (p. ej. tras revocarla o crearla)."""
+    api_key_cache.invalidate(key)
+
+
+async def revoke_api_key(db: AsyncSession, key: str) -> bool:
+    """Desactiva una API key en la DB y la invalida en la caché."""
+    result = await db.execute(
+        update(APIKey).where(APIKey.key_hash == key).values(is_active=False)
+    )
+    await db.commit()
+    invalidate_api_key(key)
+    return bool(result.rowcount)
+
+
+def is_admin(token: Optional[str]) -> bool:
+    """Compara en tiempo constante con ADMIN_TOKEN (sin token configurado, nadie es admin)."""
+    return bool(ADMIN_TOKEN and token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(
+    x_admin_token: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+) -> None:
+    """
+    Dependencia de ADMIN_PATHS: ADMIN_TOKEN en X-Admin-Token o como
+    `Authorization: Bearer` (lo que envía Prometheus con `authorization` en
+    su scrape_config).
+    """
+    scheme, _, credentials = (authorization or "").partition(" ")
+    bearer = credentials.strip() if scheme.lower() == "bearer" else None
+    if not (is_admin(x_admin_token) or is_admin(bearer)):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 
 async def verify_api_key(request: Request, call_next):
-    # Rutas públicas
-    if request.url.path.startswith("/docs") or request.url.path.startswith("/openapi.json"):
+    # Rutas públicas y de administración (éstas las protege require_admin)
+    if request.url.path.startswith(PUBLIC_PATHS + ADMIN_PATHS):
         return await call_next(request)
 
     key = request.headers.get("x-api-key")
     if not key:
         return JSONResponse(status_code=401, content={"error": "Missing API Key"})
 
-    # Obtener sesión de DB
-    db: Session = next(get_db())
-    api_key = (
-        db.query(APIKey)
-          .filter(APIKey.key_hash == key, APIKey.is_active.is_(True))
-          .first()
-    )
-    db.close()
-
-    if not api_key:
+    start = time.perf_counter()
+    api_key = await resolve_api_key(key)
+    if not api_key or not api_key.is_valid():
+        observe_stage("auth", time.perf_counter() - start, plan="unauthenticated")
         return JSONResponse(status_code=401, content={"error": "Invalid API Key"})
+    # El plan etiqueta todas las métricas de esta request
+    current_plan.set(api_key.plan)
+    observe_stage("auth", time.perf_counter() - start)
+
+    # Límite por plan (limitador de esta app, creado en su lifespan): se rechaza antes de tocar la DB o LND
+    decision = await request.app.state.rate_limiter.hit(api_key.tenant_id, api_key.plan)
+    if decision and not decision.allowed:
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Rate limit exceeded"},
+            headers=decision.headers(),
+        )
 
     # inyectamos tenant_id en request.state para los endpoints
     request.state.tenant_id = api_key.tenant_id
-    return await call_next(request)
+    response = await call_next(request)
+    if decision:
+        response.headers.update(decision.headers())
+    return response
 
 
 def get_current_tenant(request: Request) -> str:
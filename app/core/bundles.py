@@ -0,0 +1,264 @@
+# app/core/bundles.py
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Optional
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.db import AsyncSessionLocal
+from app.core.pdf_generator import render_statement
+from app.core.render_pool import RenderPool, RenderQueueFull
+from app.core.storage import CHUNK_SIZE, get_receipt_store, is_legacy_path
+from app.models import BundleJob, Invoice, Receipt
+
+logger = logging.getLogger(__name__)
+
+# Hasta este nº de recibos el bundle se genera en la propia petición
+BUNDLE_SYNC_MAX_ITEMS = int(os.getenv("BUNDLE_SYNC_MAX_ITEMS", "50"))
+# Máximo de recibos por bundle
+BUNDLE_MAX_ITEMS = int(os.getenv("BUNDLE_MAX_ITEMS", "10000"))
+# Un bundle "running" sin actualizar en este tiempo se considera huérfano
+BUNDLE_JOB_TIMEOUT = float(os.getenv("BUNDLE_JOB_TIMEOUT", "1800"))
+
+
+# --- Selección de recibos ---
+
+async def load_bundle_items(
+    db: AsyncSession,
+    tenant_id: str,
+    receipt_ids: Optional[list[str]],
+    date_from: Optional[datetime],
+    date_to: Optional[datetime],
+) -> list[tuple[Receipt, Invoice]]:
+    """
+    Recibos generados del tenant (por ids y/o por fecha de la invoice, `to`
+    exclusivo), en orden cronológico. Trae uno de más que BUNDLE_MAX_ITEMS
+    para que el llamador detecte el exceso.
+    """
+    stmt = (
+        select(Receipt, Invoice)
+        .join(Invoice, Invoice.id == Receipt.invoice_id)
+        .where(Invoice.tenant_id == tenant_id, Receipt.status == "ready")
+    )
+    if receipt_ids is not None:
+        stmt = stmt.where(Receipt.id.in_(receipt_ids))
+    if date_from:
+        stmt = stmt.where(Invoice.created_at >= date_from)
+    if date_to:
+        stmt = stmt.where(Invoice.created_at < date_to)
+    stmt = stmt.order_by(Invoice.created_at, Invoice.id).limit(BUNDLE_MAX_ITEMS + 1)
+    return [(row.Receipt, row.Invoice) for row in await db.execute(stmt)]
+
+
+# --- PDF combinado ---
+
+def statement_data(items: list[tuple[Receipt, Invoice]], date_from: Optional[datetime],
+                   date_to: Optional[datetime]) -> dict:
+    """Datos planos (serializables) de la plantilla statement.html."""
+    return {
+        "desde": date_from.date().isoformat() if date_from else None,
+        "hasta": date_to.date().isoformat() if date_to else None,
+        "total_msat": sum(invoice.amount_msat for _, invoice in items),
+        "recibos": [
+            {
+                "invoice_id": invoice.id,
+                "fecha": invoice.created_at.strftime("%Y-%m-%d %H:%M") if invoice.created_at else "",
+                "cliente": invoice.customer_name or "N/A",
+                "monto_msat": invoice.amount_msat,
+                "descripcion": invoice.description,
+                "payment_hash": invoice.payment_hash,
+                "firma": receipt.signature,
+            }
+            for receipt, invoice in items
+        ],
+    }
+
+
+# --- ZIP en streaming ---
+
+class _ZipSink:
+    """
+    Destino de zipfile sin seek ni tell: zipfile escribe entonces los tamaños
+    y CRC en descriptores tras cada fichero, y el ZIP se puede emitir según
+    se escribe sin tenerlo entero en memoria.
+    """
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def zip_entries(items: list[tuple[Receipt, Invoice]]) -> list[tuple[str, str, datetime]]:
+    return [
+        (f"{receipt.id}.pdf", receipt.pdf_url, receipt.generated_at or invoice.created_at or datetime.utcnow())
+        for receipt, invoice in items
+    ]
+
+
+def _receipt_chunks(pdf_url: str) -> Iterator[bytes]:
+    # Recibos antiguos: pdf_url es una ruta del host
+    if is_legacy_path(pdf_url):
+        with open(pdf_url, "rb") as f:
+            yield from iter(lambda: f.read(CHUNK_SIZE), b"")
+        return
+    yield from get_receipt_store().stream(pdf_url)
+
+
+def zip_chunks(entries: list[tuple[str, str, datetime]]) -> Iterator[bytes]:
+    """
+    ZIP de los PDFs ya generados, leídos del almacenamiento en trozos.
+    Iterador síncrono: StreamingResponse lo consume en el threadpool.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for name, pdf_url, generated_at in entries:
+            info = zipfile.ZipInfo(name, date_time=generated_at.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with zf.open(info, "w") as dest:
+                for chunk in _receipt_chunks(pdf_url):
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def write_zip(entries: list[tuple[str, str, datetime]]) -> str:
+    """Escribe el ZIP en un temporal y lo guarda en el almacenamiento. Devuelve su clave."""
+    fd, tmp = tempfile.mkstemp(suffix=".zip")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in zip_chunks(entries):
+                f.write(chunk)
+        return get_receipt_store().put_file(Path(tmp), ".zip")
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+async def build_bundle(pool: RenderPool, fmt: str, items: list[tuple[Receipt, Invoice]],
+                       date_from: Optional[datetime], date_to: Optional[datetime]) -> str:
+    """Genera el bundle y lo guarda en el almacenamiento. Devuelve su clave."""
+    if fmt == "zip":
+        return await run_in_threadpool(write_zip, zip_entries(items))
+    return await pool.run(render_statement, statement_data(items, date_from, date_to))
+
+
+# --- Bundles en segundo plano ---
+
+class BundleRunner:
+    """
+    Genera los bundles grandes en tareas asyncio. El estado vive en
+    `bundle_jobs`, así que los pendientes (o huérfanos tras una caída) se
+    retoman al arrancar.
+    """
+
+    def __init__(self, pool: RenderPool, timeout: float = BUNDLE_JOB_TIMEOUT):
+        self.pool = pool
+        self.timeout = timeout
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, bundle_id: str) -> None:
+        task = asyncio.create_task(self._run(bundle_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _claimable(self):
+        stale = datetime.utcnow() - timedelta(seconds=self.timeout)
+        return or_(
+            BundleJob.status == "pending",
+            and_(BundleJob.status == "running", BundleJob.updated_at < stale),
+        )
+
+    async def resume(self) -> None:
+        async with AsyncSessionLocal() as db:
+            ids = (await db.execute(
+                select(BundleJob.id).where(self._claimable()).order_by(BundleJob.created_at)
+            )).scalars().all()
+            await db.commit()
+        for bundle_id in ids:
+            self.submit(bundle_id)
+        if ids:
+            logger.info(f"{len(ids)} bundles pendientes retomados")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _claim(self, bundle_id: str) -> Optional[BundleJob]:
+        # SKIP LOCKED: si otro proceso ya lo está reclamando, no se espera
+        async with AsyncSessionLocal() as db:
+            job = (await db.execute(
+                select(BundleJob)
+                .where(BundleJob.id == bundle_id, self._claimable())
+                .with_for_update(skip_locked=True)
+            )).scalars().first()
+            if job:
+                job.status = "running"
+            await db.commit()
+            return job
+
+    async def _finish(self, bundle_id: str, **values) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(BundleJob)
+                .where(BundleJob.id == bundle_id)
+                .values(updated_at=datetime.utcnow(), **values)
+            )
+            await db.commit()
+
+    async def _run(self, bundle_id: str) -> None:
+        job = await self._claim(bundle_id)
+        if not job:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                items = await load_bundle_items(
+                    db, job.tenant_id,
+                    json.loads(job.receipt_ids) if job.receipt_ids else None,
+                    job.date_from, job.date_to,
+                )
+                await db.commit()
+            while True:
+                try:
+                    key = await build_bundle(self.pool, job.format, items, job.date_from, job.date_to)
+                    break
+                except RenderQueueFull as exc:
+                    # Backpressure del render pool: se reintenta más tarde
+                    await asyncio.sleep(exc.retry_after)
+        except asyncio.CancelledError:
+            # Queda en "running" y se retoma al caducar BUNDLE_JOB_TIMEOUT
+            raise
+        except Exception as exc:
+            logger.exception(f"Error generando el bundle {bundle_id}")
+            await self._finish(bundle_id, status="failed", error=repr(exc))
+            return
+        await self._finish(bundle_id, status="ready", result_key=key, item_count=len(items))
+        logger.info(f"✔ Bundle {bundle_id} listo: {len(items)} recibos ({job.format})")
+
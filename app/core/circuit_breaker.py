@@ -0,0 +1,92 @@
+# app/core/circuit_breaker.py
+
+import time
+from typing import Callable, Optional
+
+
+class CircuitOpen(Exception):
+    """El circuito está abierto: la llamada se rechaza sin intentarla."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito {name} abierto")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico para un backend remoto:
+      - closed: las llamadas pasan; `failure_threshold` fallos seguidos lo abren.
+      - open: se rechazan al instante (CircuitOpen) durante `reset_timeout` segundos.
+      - half_open: pasado ese tiempo se dejan pasar `half_open_max` sondas; si
+        una va bien se cierra, si falla se vuelve a abrir.
+    Pensado para el event loop (sin locks): todas las transiciones son síncronas.
+    Uso: before_call(), y después record_success(), record_failure() o release().
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0,
+                 half_open_max: int = 1, on_change: Optional[Callable[[str], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.on_change = on_change
+        self.clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state: str) -> None:
+        if state == self._state:
+            return
+        self._state = state
+        self._probes = 0
+        if state == self.OPEN:
+            self._opened_at = self.clock()
+        elif state == self.CLOSED:
+            self._failures = 0
+        if self.on_change:
+            self.on_change(state)
+
+    def retry_after(self) -> float:
+        """Segundos hasta la próxima sonda (0 si el circuito admite llamadas)."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(self.reset_timeout - (self.clock() - self._opened_at), 0.0)
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and self._probes < self.half_open_max:
+            self._probes += 1
+            return
+        # Abierto, o semiabierto con todas las sondas ya en vuelo
+        raise CircuitOpen(self.name, max(self.retry_after(), 1.0))
+
+    def release(self) -> None:
+        """La llamada se canceló sin veredicto: libera su sonda."""
+        if self._state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        if self._state == self.HALF_OPEN:
+            self._set_state(self.OPEN)
+            return
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._set_state(self.OPEN)
@@ -0,0 +1,56 @@
+# app/core/export.py
+
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator
+
+# Bytes acumulados antes de emitir un trozo de la respuesta
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+
+async def ndjson_lines(rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Una línea JSON por fila, agrupadas en trozos de ~EXPORT_FLUSH_BYTES."""
+    buffer = bytearray()
+    async for row in rows:
+        buffer += json.dumps(row, ensure_ascii=False, default=str).encode()
+        buffer += b"\n"
+        if len(buffer) >= EXPORT_FLUSH_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def csv_lines(rows: AsyncIterator[dict], columns: list[str]) -> AsyncIterator[bytes]:
+    """CSV con cabecera, agrupado en trozos de ~EXPORT_FLUSH_BYTES."""
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    async for row in rows:
+        writer.writerow(row)
+        if text.tell() >= EXPORT_FLUSH_BYTES:
+            yield text.getvalue().encode()
+            text.seek(0)
+            text.truncate()
+    if text.tell():
+        yield text.getvalue().encode()
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Comprime en gzip (wbits=31) trozo a trozo, sin acumular la respuesta."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "x-gzip"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
@@ -0,0 +1,123 @@
+# app/core/idempotency.py
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app.core.db import AsyncSessionLocal
+from app.models import IdempotencyRecord
+
+# Tiempo durante el que se guarda la respuesta de cada Idempotency-Key (segundos)
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# Vigencia de una reserva sin respuesta: si el proceso muere a mitad de la
+# petición, pasado este tiempo otra petición puede retomar la key
+IDEMPOTENCY_PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "60"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    status_code: Optional[int]  # None: la petición original sigue en curso
+    body: Optional[str]  # JSON de la respuesta
+
+    @property
+    def pending(self) -> bool:
+        return self.status_code is None
+
+
+def request_fingerprint(*parts) -> str:
+    """sha256 de la petición en JSON canónico, para detectar keys reutilizadas."""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _key_filter(tenant_id: str, key: str):
+    return (IdempotencyRecord.tenant_id == tenant_id, IdempotencyRecord.idempotency_key == key)
+
+
+async def reserve_key(tenant_id: str, key: str, request_hash: str) -> Optional[StoredResponse]:
+    """
+    Reserva la key con un registro sin respuesta antes de hacer el trabajo, de
+    modo que dos peticiones simultáneas (en cualquier réplica) no la ejecuten
+    las dos. Devuelve None si la reserva es nuestra; si no, el registro que ya
+    existe: una respuesta guardada o una reserva aún en curso (`pending`).
+    """
+    now = datetime.utcnow()
+    values = {
+        "request_hash": request_hash,
+        "status_code": None,
+        "response_body": None,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=IDEMPOTENCY_PENDING_TTL),
+    }
+    while True:
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert(IdempotencyRecord).values(tenant_id=tenant_id, idempotency_key=key, **values))
+                await db.commit()
+                return None
+            except IntegrityError:
+                await db.rollback()
+            # Ya existe: una respuesta caducada o una reserva huérfana se retoman
+            result = await db.execute(
+                update(IdempotencyRecord)
+                .where(*_key_filter(tenant_id, key), IdempotencyRecord.expires_at <= now)
+                .values(**values)
+            )
+            await db.commit()
+            if result.rowcount:
+                return None
+            record = await db.get(IdempotencyRecord, (tenant_id, key))
+            await db.commit()
+        # Si se liberó entre medias, se vuelve a intentar la reserva
+        if record is not None:
+            return StoredResponse(record.request_hash, record.status_code, record.response_body)
+
+
+async def save_response(tenant_id: str, key: str, request_hash: str, status_code: int, body: str) -> None:
+    """Completa nuestra reserva con la respuesta, que se conserva IDEMPOTENCY_TTL segundos."""
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(IdempotencyRecord)
+            .where(
+                *_key_filter(tenant_id, key),
+                IdempotencyRecord.request_hash == request_hash,
+                IdempotencyRecord.status_code.is_(None),
+            )
+            .values(
+                status_code=status_code,
+                response_body=body,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL),
+            )
+        )
+        await db.commit()
+
+
+async def release_key(tenant_id: str, key: str, request_hash: str) -> None:
+    """
+    Libera nuestra reserva si la petición falló (sólo se guardan las respuestas
+    correctas): el cliente puede reintentar con la misma key.
+    """
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(IdempotencyRecord).where(
+                *_key_filter(tenant_id, key),
+                IdempotencyRecord.request_hash == request_hash,
+                IdempotencyRecord.status_code.is_(None),
+            )
+        )
+        await db.commit()
+
+
+async def purge_expired() -> int:
+    """Borra los registros caducados. Devuelve cuántos."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(delete(IdempotencyRecord).where(IdempotencyRecord.expires_at <= datetime.utcnow()))
+        await db.commit()
+        return result.rowcount
@@ -0,0 +1,177 @@
+# app/core/metrics.py
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Plan del tenant de la request en curso (lo fija el middleware de auth). Las
+# tareas creadas durante la request lo heredan; el trabajo en segundo plano
+# (cola de recibos, bundles) queda como "background".
+current_plan: ContextVar[str] = ContextVar("current_plan", default="background")
+
+# --- Pool de conexiones de la base de datos ---
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "lightpen_db_pool_checkout_seconds",
+    "Tiempo esperando una conexión libre del pool",
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_SIZE = Gauge("lightpen_db_pool_size", "Conexiones permanentes configuradas en el pool")
+DB_POOL_CHECKED_OUT = Gauge("lightpen_db_pool_checked_out", "Conexiones del pool en uso")
+DB_POOL_OVERFLOW = Gauge("lightpen_db_pool_overflow", "Conexiones abiertas por encima de pool_size")
+DB_POOL_SATURATION = Gauge(
+    "lightpen_db_pool_saturation",
+    "Conexiones en uso / capacidad máxima (pool_size + max_overflow)",
+)
+
+
+def track_pool(pool, max_overflow: int) -> None:
+    """Expone el estado de un QueuePool como gauges (se leen en cada scrape)."""
+    capacity = pool.size() + max(max_overflow, 0)
+    DB_POOL_SIZE.set_function(pool.size)
+    DB_POOL_CHECKED_OUT.set_function(pool.checkedout)
+    DB_POOL_OVERFLOW.set_function(lambda: max(pool.overflow(), 0))
+    DB_POOL_SATURATION.set_function(lambda: pool.checkedout() / capacity if capacity else 0)
+
+
+# --- Etapas del pipeline de recibos ---
+#
+# auth            resolver la API key (caché o DB)
+# db_query        lecturas de la DB en el camino de la request
+# lnd_check       verificar la liquidación (caché del watcher o LookupInvoice)
+# template_render render de la plantilla Jinja (en el proceso de render)
+# pdf_write       WeasyPrint: HTML -> PDF (en el proceso de render)
+# storage_put     guardar el PDF en el almacenamiento de recibos
+# commit          transacción de escritura (INSERTs + COMMIT)
+
+STAGE_SECONDS = Histogram(
+    "lightpen_stage_seconds",
+    "Duración de cada etapa del pipeline de recibos",
+    ["stage", "plan"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def observe_stage(name: str, seconds: float, plan: Optional[str] = None) -> None:
+    STAGE_SECONDS.labels(name, plan or current_plan.get()).observe(seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Mide el bloque como la etapa `name` (vale también alrededor de awaits)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+# --- Render pool ---
+
+RENDER_POOL_PENDING = Gauge(
+    "lightpen_render_pool_pending",
+    "Trabajos de render en vuelo (ejecutándose o en cola)",
+)
+RENDER_POOL_CAPACITY = Gauge(
+    "lightpen_render_pool_capacity",
+    "Trabajos de render admitidos antes de responder 503 (workers + cola)",
+)
+RENDER_INFLIGHT = Gauge(
+    "lightpen_render_inflight",
+    "Trabajos de render en vuelo por plan",
+    ["plan"],
+)
+RENDER_REJECTED = Counter(
+    "lightpen_render_rejected_total",
+    "Trabajos rechazados por la cola de render llena (backpressure)",
+    ["plan"],
+)
+
+
+def track_render_pool(pool) -> None:
+    RENDER_POOL_PENDING.set_function(lambda: pool.pending)
+    RENDER_POOL_CAPACITY.set_function(lambda: pool.capacity)
+
+
+# --- LND ---
+
+LND_ERRORS = Counter(
+    "lightpen_lnd_errors_total",
+    "Errores en llamadas a LND por tipo (LndUnavailable, InvoiceNotFound, LndError)",
+    ["method", "error", "plan"],
+)
+LND_RETRIES_TOTAL = Counter(
+    "lightpen_lnd_retries_total",
+    "Reintentos de llamadas a LND tras un error transitorio",
+    ["method"],
+)
+LND_HEDGES = Counter(
+    "lightpen_lnd_hedged_total",
+    "Consultas duplicadas al nodo secundario, por nodo cuya respuesta se usó (none: ninguno)",
+    ["winner"],
+)
+LND_CIRCUIT_STATE = Gauge(
+    "lightpen_lnd_circuit_state",
+    "Estado del circuit breaker de cada nodo LND (0 cerrado, 1 semiabierto, 2 abierto)",
+    ["node"],
+)
+
+
+# --- Cachés en memoria (TTLCache) ---
+
+
+class CacheCollector:
+    """Publica TTLCache.stats() de las cachés registradas en cada scrape."""
+
+    def __init__(self):
+        self._caches = {}
+
+    def register(self, name: str, cache) -> None:
+        self._caches[name] = cache
+
+    def collect(self):
+        size = GaugeMetricFamily("lightpen_cache_size", "Entradas en la caché", labels=["cache"])
+        maxsize = GaugeMetricFamily("lightpen_cache_maxsize", "Capacidad de la caché", labels=["cache"])
+        hits = CounterMetricFamily("lightpen_cache_hits", "Aciertos de la caché", labels=["cache"])
+        misses = CounterMetricFamily("lightpen_cache_misses", "Fallos de la caché (ausente o caducada)", labels=["cache"])
+        evictions = CounterMetricFamily("lightpen_cache_evictions", "Entradas expulsadas por LRU", labels=["cache"])
+        for name, cache in self._caches.items():
+            stats = cache.stats()
+            size.add_metric([name], stats["size"])
+            maxsize.add_metric([name], stats["maxsize"])
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            evictions.add_metric([name], stats["evictions"])
+        return [size, maxsize, hits, misses, evictions]
+
+
+_cache_collector = CacheCollector()
+REGISTRY.register(_cache_collector)
+
+
+def track_cache(name: str, cache) -> None:
+    _cache_collector.register(name, cache)
+
+
+# --- Arranque ---
+
+STARTUP_SECONDS = Gauge(
+    "lightpen_startup_seconds",
+    "Duración de cada paso del arranque del proceso (import, init_db, render_pool...) y el total",
+    ["step"],
+)
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
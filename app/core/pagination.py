@@ -0,0 +1,82 @@
+# app/core/pagination.py
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional
+
+from sqlalchemy import Select, tuple_
+
+from app.core.db import AsyncSessionLocal
+
+
+class InvalidCursor(ValueError):
+    """El cursor de paginación no es un token emitido por la API."""
+
+
+def encode_cursor(created_at: datetime, row_id: str) -> str:
+    """Token opaco con la clave (created_at, id) de la última fila de la página."""
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(token)
+
+
+def keyset_page(stmt: Select, order_by: list, after: Optional[tuple], limit: int) -> Select:
+    """
+    Página de `limit` filas tras la clave `after`. Pide una fila de más para
+    saber si hay página siguiente sin un COUNT.
+    """
+    if after is not None:
+        stmt = stmt.where(keyset_after(order_by, after))
+    return stmt.order_by(*order_by).limit(limit + 1)
+
+
+def split_page(rows: list, limit: int, key: Callable[[object], tuple]) -> tuple[list, Optional[str]]:
+    """Separa la fila de más de `keyset_page` y calcula el cursor siguiente."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def keyset_after(columns: list, values: tuple):
+    """Condición `(col1, col2, ...) > (v1, v2, ...)` para paginar por clave."""
+    return tuple_(*columns) > tuple_(*values)
+
+
+async def keyset_stream(
+    stmt: Select,
+    order_by: list,
+    key: Callable[[object], tuple],
+    page_size: int,
+    yield_per: int,
+) -> AsyncIterator:
+    """
+    Recorre `stmt` entero en páginas de `page_size` filas ordenadas por
+    `order_by` (keyset: cada página empieza tras la última clave vista, sin
+    OFFSET). Cada página se lee con un cursor de servidor (`yield_per`) en su
+    propia sesión, así que la memoria y el tiempo de cada conexión en uso
+    quedan acotados aunque el resultado total sea enorme.
+    """
+    last = None
+    while True:
+        page = stmt if last is None else stmt.where(keyset_after(order_by, last))
+        page = page.order_by(*order_by).limit(page_size).execution_options(yield_per=yield_per)
+        count = 0
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(page)
+            async for row in result:
+                count += 1
+                last = key(row)
+                yield row
+        if count < page_size:
+            return
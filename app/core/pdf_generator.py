@@ -1,52 +1,172 @@
 # app/core/pdf_generator.py
 
-import uuid
+import threading
+import time
 from pathlib import Path
+from typing import NamedTuple, Optional
 from jinja2 import Environment, FileSystemLoader, select_autoescape
-from weasyprint import HTML
+from app.core.signing import get_receipt_signer
+from app.core.storage import get_receipt_store
 from app.models import Invoice
 
 # Definir ruta absoluta a la carpeta raíz del proyecto
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
-# Carpeta donde se guardan los recibos PDF
-PDF_STORAGE_DIR = BASE_DIR / "generated_receipts"
-PDF_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
 # Inicializar Jinja2 para cargar plantillas desde la carpeta `templates`
 TEMPLATES_DIR = BASE_DIR / "templates"
 # Asegúrate de crear la carpeta `templates/` y un archivo `receipt.html`
-env = Environment(
-    loader=FileSystemLoader(str(TEMPLATES_DIR)),
-    autoescape=select_autoescape(["html", "xml"])
-)
+_env: Optional[Environment] = None
 
 
-def generate_pdf(invoice: Invoice) -> tuple[str, str]:
+def template_env() -> Environment:
+    """Entorno Jinja2, creado en el primer render."""
+    global _env
+    if _env is None:
+        # auto_reload desactivado: el ReceiptRenderer decide cuándo recargar (por mtime)
+        _env = Environment(
+            loader=FileSystemLoader(str(TEMPLATES_DIR)),
+            autoescape=select_autoescape(["html", "xml"]),
+            auto_reload=False
+        )
+    return _env
+
+
+class ReceiptRenderer:
     """
-    Genera un PDF real usando WeasyPrint a partir de una plantilla HTML.
-    Devuelve:
-      - La ruta ABSOLUTA al fichero PDF
-      - Una firma simulada (uuid corto)
+    Motor de render de recibos con todo lo costoso precalculado:
+      - la plantilla Jinja compilada,
+      - la hoja de estilos parseada como `CSS` de WeasyPrint,
+      - la configuración de fuentes.
+    Sólo se recarga si cambia el mtime de la plantilla o de la hoja de estilos.
+    WeasyPrint (y con él Pango y las fuentes) se importa en la primera carga,
+    no al importar el módulo: la API arranca sin pagar ese coste.
     """
-    # Datos para la plantilla
-    data = {
+
+    def __init__(self, template_name: str = "receipt.html", stylesheet_name: str = "receipt.css"):
+        self.template_path = TEMPLATES_DIR / template_name
+        self.stylesheet_path = TEMPLATES_DIR / stylesheet_name
+        self._template = None
+        self._css = None
+        self._font_config = None
+        self._mtimes = None
+        self._lock = threading.Lock()
+
+    def _current_mtimes(self) -> tuple[float, float]:
+        return self.template_path.stat().st_mtime, self.stylesheet_path.stat().st_mtime
+
+    def _ensure_loaded(self) -> None:
+        mtimes = self._current_mtimes()
+        if mtimes == self._mtimes:
+            return
+        with self._lock:
+            if mtimes == self._mtimes:
+                return
+            from weasyprint import CSS
+            from weasyprint.text.fonts import FontConfiguration
+            env = template_env()
+            if env.cache is not None:
+                env.cache.clear()
+            font_config = FontConfiguration()
+            self._template = env.get_template(self.template_path.name)
+            self._css = CSS(filename=str(self.stylesheet_path), font_config=font_config)
+            self._font_config = font_config
+            self._mtimes = mtimes
+
+    def render_html(self, data: dict) -> str:
+        self._ensure_loaded()
+        return self._template.render(**data)
+
+    def write_pdf(self, html_content: str, target=None):
+        """Escribe el PDF en `target` (o devuelve los bytes si es None)."""
+        from weasyprint import HTML
+        return HTML(string=html_content, base_url=str(TEMPLATES_DIR)).write_pdf(
+            target=target,
+            stylesheets=[self._css],
+            font_config=self._font_config
+        )
+
+    def warmup(self) -> None:
+        """Carga plantilla, CSS y fuentes y hace un render en frío descartable."""
+        self._ensure_loaded()
+        self.write_pdf(self.render_html({
+            "invoice_id": "warmup",
+            "cliente": "warmup",
+            "monto_msat": 0,
+            "descripcion": "warmup",
+            "payment_hash": "0" * 64,
+            "firma": "warmup"
+        }))
+
+
+renderer = ReceiptRenderer()
+# Extractos: todos los recibos de un bundle en un único documento multipágina
+statement_renderer = ReceiptRenderer("statement.html")
+
+
+class RenderedReceipt(NamedTuple):
+    pdf_url: str         # clave en el almacenamiento de recibos
+    signature: str       # firma Ed25519 (base64url) de signed_payload
+    signed_payload: str  # JSON canónico firmado
+    timings: Optional[dict] = None  # segundos por etapa, medidos en el proceso de render
+
+
+def receipt_data(invoice: Invoice) -> dict:
+    """
+    Extrae de la invoice los datos que necesita la plantilla y firma el recibo.
+    Devuelve un dict plano (serializable) para poder enviarlo a otro proceso;
+    la firma se hace aquí para que sólo el proceso de la API tenga la clave.
+    """
+    signer = get_receipt_signer()
+    payload = signer.payload(
+        invoice_id=invoice.id,
+        amount_msat=invoice.amount_msat,
+        payment_hash=invoice.payment_hash,
+        tenant_id=invoice.tenant_id,
+    )
+    return {
         "invoice_id": invoice.id,
         "cliente": invoice.customer_name or "N/A",
         "monto_msat": invoice.amount_msat,
         "descripcion": invoice.description,
         "payment_hash": invoice.payment_hash,
-        "firma": str(uuid.uuid4())[:16]
+        "firma": signer.sign(payload),
+        "signed_payload": payload
     }
 
-    # Cargar y renderizar la plantilla
-    template = env.get_template("receipt.html")
-    html_content = template.render(**data)
 
-    # Generar nombre de archivo y ruta
-    filename = f"{invoice.id}.pdf"
-    pdf_path = PDF_STORAGE_DIR / filename
+def render_receipt(data: dict) -> RenderedReceipt:
+    """
+    Renderiza la plantilla, genera el PDF con WeasyPrint y lo guarda en el
+    almacenamiento de recibos. Es la parte costosa en CPU; se ejecuta en los
+    procesos del render pool.
+    """
+    start = time.perf_counter()
+    html_content = renderer.render_html(data)
+    rendered = time.perf_counter()
+    pdf_bytes = renderer.write_pdf(html_content)
+    written = time.perf_counter()
+    key = get_receipt_store().put(pdf_bytes)
+    timings = {
+        "template_render": rendered - start,
+        "pdf_write": written - rendered,
+        "storage_put": time.perf_counter() - written,
+    }
+    return RenderedReceipt(key, data["firma"], data["signed_payload"], timings)
 
-    # Usar WeasyPrint para escribir el PDF
-    HTML(string=html_content).write_pdf(target=str(pdf_path))
 
-    return str(pdf_path), data["firma"]
+def generate_pdf(invoice: Invoice) -> RenderedReceipt:
+    """
+    Genera un PDF real usando WeasyPrint a partir de una plantilla HTML.
+    Devuelve la clave del PDF en el almacenamiento de recibos (`ab/cd/<sha256>.pdf`),
+    la firma Ed25519 y el payload firmado.
+    """
+    return render_receipt(receipt_data(invoice))
+
+
+def render_statement(data: dict) -> str:
+    """
+    Renderiza un extracto (portada + una página por recibo) en una sola
+    pasada de WeasyPrint y lo guarda. Devuelve la clave del PDF.
+    """
+    html_content = statement_renderer.render_html(data)
+    return get_receipt_store().put(statement_renderer.write_pdf(html_content))
@@ -0,0 +1,193 @@
+# app/core/profiling.py
+
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+from app.core.auth import ADMIN_TOKEN, is_admin
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Fracción de requests que se perfilan al azar (0 = sólo las que pidan X-Profile)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# "auto" (pyinstrument si está instalado, si no cProfile), "pyinstrument" o "cprofile"
+PROFILER = os.getenv("PROFILER", "auto").lower()
+# Intervalo de muestreo de pyinstrument, en segundos
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(BASE_DIR / "generated_profiles")))
+# Perfiles guardados como máximo; se borran los más antiguos
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "200"))
+
+# Extensión de cada formato: speedscope.app abre los dos
+PROFILE_SUFFIXES = {".speedscope.json": "application/json", ".prof": "application/octet-stream"}
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class _PyinstrumentSession:
+    """Muestreo de pyinstrument sólo del contexto async de la request."""
+
+    suffix = ".speedscope.json"
+
+    def __init__(self, interval: float):
+        from pyinstrument import Profiler
+        self._profiler = Profiler(interval=interval, async_mode="enabled")
+
+    def start(self) -> None:
+        self._profiler.start()
+
+    def stop(self) -> None:
+        self._profiler.stop()
+
+    def dump(self) -> bytes:
+        from pyinstrument.renderers import SpeedscopeRenderer
+        return self._profiler.output(renderer=SpeedscopeRenderer()).encode()
+
+
+class _CProfileSession:
+    """
+    cProfile (determinista, más caro). Perfila el hilo entero: si hay otras
+    requests en vuelo en el event loop, su tiempo aparece también.
+    """
+
+    suffix = ".prof"
+
+    def __init__(self, interval: float):
+        self._profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        self._profiler.enable()
+
+    def stop(self) -> None:
+        self._profiler.disable()
+
+    def dump(self) -> bytes:
+        import marshal
+        self._profiler.create_stats()
+        return marshal.dumps(self._profiler.stats)
+
+
+def _session_class(name: str):
+    if name in ("auto", "pyinstrument"):
+        try:
+            import pyinstrument  # noqa: F401
+            return _PyinstrumentSession
+        except ImportError:
+            if name == "pyinstrument":
+                raise RuntimeError("PROFILER=pyinstrument necesita pyinstrument (pip install pyinstrument)")
+    elif name != "cprofile":
+        raise RuntimeError(f"PROFILER desconocido: {name}")
+    return _CProfileSession
+
+
+class RequestProfiler:
+    """
+    Perfila requests sueltas en producción: una fracción al azar o las que
+    traigan `X-Profile: <ADMIN_TOKEN>`. Cada perfil se guarda en `directory`
+    con el id de la request y se sirve desde /admin/profiles.
+    """
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, admin_token: str = ADMIN_TOKEN,
+                 profiler: str = PROFILER, directory: Path = PROFILE_DIR,
+                 max_stored: int = PROFILE_MAX_STORED, interval: float = PROFILE_INTERVAL):
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self.directory = Path(directory)
+        self.max_stored = max_stored
+        self.interval = interval
+        self._session_class = _session_class(profiler) if self.enabled else None
+        # cProfile no admite dos perfiles a la vez en el mismo hilo
+        self._busy = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or bool(self.admin_token)
+
+    def wants(self, request: Request) -> bool:
+        header = request.headers.get("x-profile")
+        if header is not None:
+            return is_admin(header)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def path(self, request_id: str) -> Optional[Path]:
+        """Fichero del perfil `request_id`, o None si no existe."""
+        if not _REQUEST_ID.match(request_id):
+            return None
+        for suffix in PROFILE_SUFFIXES:
+            path = self.directory / f"{request_id}{suffix}"
+            if path.exists():
+                return path
+        return None
+
+    def list(self) -> list[dict]:
+        """Perfiles guardados, del más reciente al más antiguo."""
+        if not self.directory.exists():
+            return []
+        profiles = []
+        for path in self.directory.iterdir():
+            suffix = next((s for s in PROFILE_SUFFIXES if path.name.endswith(s)), None)
+            if suffix is None:
+                continue
+            stat = path.stat()
+            profiles.append({
+                "request_id": path.name[: -len(suffix)],
+                "format": "speedscope" if suffix == ".speedscope.json" else "pstats",
+                "size": stat.st_size,
+                "created_at": stat.st_mtime,
+            })
+        return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+    def _save(self, request_id: str, suffix: str, data: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{request_id}{suffix}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, self.directory / f"{request_id}{suffix}")
+        # Retención: sólo los `max_stored` más recientes
+        for profile in self.list()[self.max_stored:]:
+            path = self.path(profile["request_id"])
+            if path is not None:
+                path.unlink(missing_ok=True)
+
+    async def __call__(self, request: Request, call_next):
+        if not self.wants(request):
+            return await call_next(request)
+        if self._session_class is _CProfileSession:
+            if self._busy:
+                return await call_next(request)
+            self._busy = True
+
+        request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+        if not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        session = self._session_class(self.interval)
+        start = time.perf_counter()
+        session.start()
+        try:
+            # En respuestas en streaming sólo se perfila hasta que empieza el cuerpo
+            response = await call_next(request)
+        finally:
+            session.stop()
+            self._busy = False
+        elapsed = time.perf_counter() - start
+
+        try:
+            await run_in_threadpool(self._save, request_id, session.suffix, session.dump())
+        except Exception:
+            logger.exception(f"No se pudo guardar el perfil de {request_id}")
+            return response
+        logger.info(f"Perfil {request_id} guardado ({request.method} {request.url.path}, {elapsed * 1000:.0f} ms)")
+        response.headers["X-Profile-Id"] = request_id
+        return response
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,185 @@
+# app/core/rate_limit.py
+
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Limitador por tenant (token bucket), aplicado en el middleware de auth
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Backend del estado de los buckets: "memory" (por proceso) o "redis" (compartido)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Ventana de los límites, en segundos: el bucket admite `limit` peticiones de golpe
+# y se rellena a razón de limit/window por segundo
+RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
+# Buckets recordados por el backend en memoria
+RATE_LIMIT_MEMORY_SIZE = int(os.getenv("RATE_LIMIT_MEMORY_SIZE", "100000"))
+
+
+class PlanLimit(NamedTuple):
+    limit: int   # peticiones por ventana (0 = sin límite)
+    window: int  # segundos
+
+    @property
+    def rate(self) -> float:
+        return self.limit / self.window
+
+
+# Límites por plan (Tenant.plan); un plan desconocido usa los de "free"
+PLAN_LIMITS = {
+    "free": PlanLimit(int(os.getenv("RATE_LIMIT_FREE", "60")), RATE_LIMIT_WINDOW),
+    "monthly": PlanLimit(int(os.getenv("RATE_LIMIT_MONTHLY", "600")), RATE_LIMIT_WINDOW),
+    "yearly": PlanLimit(int(os.getenv("RATE_LIMIT_YEARLY", "1200")), RATE_LIMIT_WINDOW),
+}
+
+
+class RateDecision(NamedTuple):
+    allowed: bool
+    limit: int
+    window: int
+    remaining: int
+    reset: int        # segundos hasta que el bucket vuelve a estar lleno
+    retry_after: int  # segundos hasta que hay un token (0 si se admite)
+
+    def headers(self) -> dict:
+        """Cabeceras RateLimit (draft IETF httpapi-ratelimit-headers)."""
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset),
+            "RateLimit-Policy": f"{self.limit};w={self.window}",
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+def _decision(allowed: bool, tokens: float, plan_limit: PlanLimit, cost: int) -> RateDecision:
+    return RateDecision(
+        allowed=allowed,
+        limit=plan_limit.limit,
+        window=plan_limit.window,
+        remaining=max(int(tokens), 0),
+        reset=math.ceil((plan_limit.limit - tokens) / plan_limit.rate),
+        retry_after=0 if allowed else max(math.ceil((cost - tokens) / plan_limit.rate), 1),
+    )
+
+
+class MemoryBucketStore:
+    """
+    Buckets en memoria del proceso (LRU acotada). Con varios workers cada uno
+    aplica el límite por su cuenta; para un límite global, usar Redis.
+    """
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MEMORY_SIZE):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, capacity: int, rate: float, cost: int) -> tuple[bool, float]:
+        """Consume `cost` tokens si hay. Devuelve (admitida, tokens restantes)."""
+        # Sin awaits: en el event loop la operación es atómica
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+# Token bucket atómico en el servidor, con su reloj (TIME) para que todas las
+# réplicas de la API compartan la misma referencia. Los floats se devuelven
+# como texto: Redis trunca los números de Lua a enteros.
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketStore:
+    """
+    Buckets en Redis (o compatible: Valkey, KeyDB, fakeredis en pruebas),
+    compartidos por todos los procesos. Se puede inyectar el cliente.
+    """
+
+    def __init__(self, client=None, url: str = REDIS_URL, prefix: str = "ratelimit:"):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis necesita redis (pip install redis)")
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_TOKEN_BUCKET_LUA)
+
+    async def take(self, key: str, capacity: int, rate: float, cost: int) -> tuple[bool, float]:
+        allowed, tokens = await self._script(keys=[self.prefix + key], args=[capacity, rate, cost])
+        return bool(allowed), float(tokens)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class RateLimiter:
+    """Token bucket por tenant con la capacidad y el ritmo de su plan."""
+
+    def __init__(self, store, limits: dict = PLAN_LIMITS, enabled: bool = RATE_LIMIT_ENABLED):
+        self.store = store
+        self.limits = limits
+        self.enabled = enabled
+
+    def plan_limit(self, plan: Optional[str]) -> PlanLimit:
+        return self.limits.get(plan) or self.limits["free"]
+
+    async def hit(self, tenant_id: str, plan: Optional[str], cost: int = 1) -> Optional[RateDecision]:
+        """
+        Consume `cost` tokens del bucket del tenant. None si no hay límite que
+        aplicar (desactivado, plan ilimitado o backend caído: se deja pasar).
+        """
+        plan_limit = self.plan_limit(plan)
+        if not self.enabled or plan_limit.limit <= 0:
+            return None
+        try:
+            allowed, tokens = await self.store.take(tenant_id, plan_limit.limit, plan_limit.rate, cost)
+        except Exception as exc:
+            # Un fallo del backend no debe tumbar la API
+            logger.warning(f"Rate limiter no disponible, se deja pasar la petición: {exc!r}")
+            return None
+        return _decision(allowed, tokens, plan_limit, cost)
+
+    async def close(self) -> None:
+        if hasattr(self.store, "close"):
+            await self.store.close()
+
+
+def build_limiter(backend: str = RATE_LIMIT_BACKEND) -> RateLimiter:
+    if backend == "memory":
+        return RateLimiter(MemoryBucketStore())
+    if backend == "redis":
+        return RateLimiter(RedisBucketStore())
+    raise RuntimeError(f"RATE_LIMIT_BACKEND desconocido: {backend}")
@@ -0,0 +1,243 @@
+# app/core/receipt_queue.py
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import AsyncSessionLocal
+from app.core.pdf_generator import receipt_data, render_receipt
+from app.core.render_pool import RenderPool, RenderQueueFull
+from app.models import Invoice, Receipt, ReceiptJob, gen_id
+
+logger = logging.getLogger(__name__)
+
+# Nº de tareas que drenan la cola en cada proceso de la API
+RECEIPT_WORKERS = int(os.getenv("RECEIPT_WORKERS", "1"))
+# Trabajos que reclama cada tarea en una sola transacción
+RECEIPT_WORKER_BATCH = int(os.getenv("RECEIPT_WORKER_BATCH", "16"))
+# Segundos entre sondeos cuando la cola está vacía
+RECEIPT_WORKER_INTERVAL = float(os.getenv("RECEIPT_WORKER_INTERVAL", "1.0"))
+# Reintentos antes de marcar el recibo como fallido
+RECEIPT_JOB_MAX_ATTEMPTS = int(os.getenv("RECEIPT_JOB_MAX_ATTEMPTS", "3"))
+# Un trabajo "running" sin actualizar en este tiempo se considera huérfano
+RECEIPT_JOB_TIMEOUT = float(os.getenv("RECEIPT_JOB_TIMEOUT", "300"))
+# Modo push: generar el recibo en cuanto LND notifica la liquidación
+RECEIPT_PUSH_ENABLED = os.getenv("RECEIPT_PUSH_ENABLED", "false").lower() in ("1", "true", "yes")
+
+
+def enqueue_receipt(db: AsyncSession, invoice: Invoice) -> Receipt:
+    """
+    Crea un Receipt en estado `pending` y su trabajo en la cola.
+    No hace commit: el llamador lo confirma junto con el resto de la transacción.
+    """
+    receipt = Receipt(id=gen_id(), invoice_id=invoice.id, status="pending")
+    db.add(receipt)
+    db.add(ReceiptJob(receipt_id=receipt.id))
+    return receipt
+
+
+async def requeue_failed_receipt(db: AsyncSession, receipt: Receipt) -> None:
+    """
+    Devuelve a la cola un recibo `failed` (agotó sus reintentos): vuelve a
+    `pending` y su trabajo empieza de cero. El índice único de
+    receipts.invoice_id impide crear otro recibo, así que se reutiliza éste.
+    No hace commit.
+    """
+    receipt.status = "pending"
+    job = (await db.execute(
+        select(ReceiptJob).where(ReceiptJob.receipt_id == receipt.id).with_for_update()
+    )).scalars().first()
+    if job is None:
+        # Recibo síncrono fallido sin trabajo en la cola
+        db.add(ReceiptJob(receipt_id=receipt.id))
+        return
+    job.status = "pending"
+    job.attempts = 0
+    job.last_error = None
+
+
+async def mark_paid_and_enqueue(payment_hash: str) -> Optional[str]:
+    """
+    Si hay una invoice pre-registrada (`pending`) con ese hash, la marca `paid`
+    y encola su recibo en la misma transacción. Devuelve el id del recibo encolado.
+    """
+    async with AsyncSessionLocal() as db:
+        invoice = (await db.execute(
+            select(Invoice)
+            .where(Invoice.payment_hash == payment_hash, Invoice.status == "pending")
+            .with_for_update()
+        )).scalars().first()
+        if not invoice:
+            await db.commit()
+            return None
+        invoice.status = "paid"
+        receipt = enqueue_receipt(db, invoice)
+        await db.commit()
+        return receipt.id
+
+
+async def claim_batch(limit: int) -> list[tuple[str, str, dict]]:
+    """
+    Reclama hasta `limit` trabajos pendientes (o huérfanos) y los marca `running`.
+    Con Postgres usa SKIP LOCKED, de modo que varias tareas/procesos no se pisan.
+    Devuelve tuplas (job_id, receipt_id, datos de la plantilla).
+    """
+    stale = datetime.utcnow() - timedelta(seconds=RECEIPT_JOB_TIMEOUT)
+    async with AsyncSessionLocal() as db:
+        jobs = (await db.execute(
+            select(ReceiptJob)
+            .where(or_(
+                ReceiptJob.status == "pending",
+                and_(ReceiptJob.status == "running", ReceiptJob.updated_at < stale),
+            ))
+            .order_by(ReceiptJob.created_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )).scalars().all()
+        if not jobs:
+            await db.commit()
+            return []
+
+        rows = (await db.execute(
+            select(Receipt.id, Invoice)
+            .join(Invoice, Invoice.id == Receipt.invoice_id)
+            .where(Receipt.id.in_([job.receipt_id for job in jobs]))
+        )).all()
+        invoices = {receipt_id: invoice for receipt_id, invoice in rows}
+
+        claimed = []
+        for job in jobs:
+            job.status = "running"
+            job.attempts += 1
+            claimed.append((job.id, job.receipt_id, receipt_data(invoices[job.receipt_id])))
+        await db.commit()
+        return claimed
+
+
+async def finish_batch(results: list[tuple[str, str, object]]) -> None:
+    """
+    Persiste el resultado de un lote: (job_id, receipt_id, RenderedReceipt | excepción).
+    """
+    async with AsyncSessionLocal() as db:
+        jobs = {
+            job.id: job
+            for job in (await db.execute(
+                select(ReceiptJob).where(ReceiptJob.id.in_([r[0] for r in results]))
+            )).scalars()
+        }
+        receipts = {
+            receipt.id: receipt
+            for receipt in (await db.execute(
+                select(Receipt).where(Receipt.id.in_([r[1] for r in results]))
+            )).scalars()
+        }
+        for job_id, receipt_id, outcome in results:
+            job, receipt = jobs[job_id], receipts[receipt_id]
+            if isinstance(outcome, RenderQueueFull):
+                # No es un fallo del recibo: se devuelve a la cola sin consumir intento
+                job.status = "pending"
+                job.attempts -= 1
+            elif isinstance(outcome, BaseException):
+                job.last_error = repr(outcome)
+                if job.attempts >= RECEIPT_JOB_MAX_ATTEMPTS:
+                    job.status = "failed"
+                    receipt.status = "failed"
+                    logger.error(f"Recibo {receipt_id} fallido tras {job.attempts} intentos: {outcome!r}")
+                else:
+                    job.status = "pending"
+            else:
+                receipt.pdf_url = outcome.pdf_url
+                receipt.signature = outcome.signature
+                receipt.signed_payload = outcome.signed_payload
+                receipt.status = "ready"
+                receipt.generated_at = datetime.utcnow()
+                job.status = "done"
+        await db.commit()
+
+
+class ReceiptWorker:
+    """
+    Tareas asyncio que drenan la cola `receipt_jobs` por lotes y renderizan
+    los PDFs en el render pool.
+    """
+
+    def __init__(
+        self,
+        pool: RenderPool,
+        workers: int = RECEIPT_WORKERS,
+        batch_size: int = RECEIPT_WORKER_BATCH,
+        interval: float = RECEIPT_WORKER_INTERVAL,
+    ):
+        self.pool = pool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.interval = interval
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        if self._tasks or self.workers <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        logger.info(f"Receipt worker arrancado con {self.workers} tareas")
+
+    def wake(self) -> None:
+        """
+        Avisa a las tareas de que hay trabajo nuevo sin esperar al próximo sondeo.
+        Se puede llamar también desde otro thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def push_on_settlement(self, payment_hash: str, settlement=None) -> None:
+        """Listener del SettlementWatcher para el modo push."""
+        receipt_id = await mark_paid_and_enqueue(payment_hash)
+        if receipt_id:
+            logger.info(f"Liquidación de {payment_hash}: receipt {receipt_id} encolado (push)")
+            self.wake()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error drenando la cola de recibos")
+                processed = 0
+            if processed:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> int:
+        """Procesa un lote de la cola. Devuelve el nº de trabajos resueltos."""
+        batch = await claim_batch(self.batch_size)
+        if not batch:
+            return 0
+        outcomes = await asyncio.gather(
+            *[self.pool.run(render_receipt, data) for _, _, data in batch],
+            return_exceptions=True,
+        )
+        await finish_batch(
+            [(job_id, receipt_id, outcome) for (job_id, receipt_id, _), outcome in zip(batch, outcomes)]
+        )
+        # Los devueltos a la cola por backpressure no cuentan: así la tarea espera
+        return sum(not isinstance(outcome, RenderQueueFull) for outcome in outcomes)
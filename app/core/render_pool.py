@@ -0,0 +1,229 @@
+# app/core/render_pool.py
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.metrics import RENDER_INFLIGHT, RENDER_REJECTED, current_plan, observe_stage
+from app.core.pdf_generator import RenderedReceipt, receipt_data, render_receipt, renderer
+from app.models import Invoice
+
+logger = logging.getLogger(__name__)
+
+# Nº de procesos de render (0 = renderizar en el threadpool del propio proceso)
+RENDER_POOL_WORKERS = int(os.getenv("RENDER_POOL_WORKERS", str(os.cpu_count() or 1)))
+# Trabajos que pueden esperar en cola además de los que ya se están renderizando
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "32"))
+# Segundos sugeridos al cliente (Retry-After) cuando la cola está llena
+RENDER_RETRY_AFTER = int(os.getenv("RENDER_RETRY_AFTER", "2"))
+# "spawn" evita heredar hilos/canales gRPC del proceso padre al hacer fork
+RENDER_POOL_START_METHOD = os.getenv("RENDER_POOL_START_METHOD", "spawn")
+
+
+class RenderQueueFull(Exception):
+    """La cola de render está llena; el cliente debe reintentar más tarde."""
+
+    def __init__(self, retry_after: int = RENDER_RETRY_AFTER):
+        super().__init__("Cola de render llena")
+        self.retry_after = retry_after
+
+
+def _init_worker():
+    """
+    Inicializador de cada proceso: compila la plantilla, parsea el CSS y hace un
+    render de prueba para que las fuentes queden cargadas antes del primer recibo.
+    """
+    renderer.warmup()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class RenderPool:
+    """
+    Pool acotado de procesos pre-calentados para generar PDFs.
+    Si hay más trabajos en vuelo que `workers + queue_size`, lanza RenderQueueFull.
+    Si un proceso muere, el pool se recrea en un hilo aparte; mientras tanto
+    los trabajos nuevos reciben RenderQueueFull (503 con Retry-After).
+    """
+
+    def __init__(
+        self,
+        workers: int = RENDER_POOL_WORKERS,
+        queue_size: int = RENDER_QUEUE_SIZE,
+        retry_after: int = RENDER_RETRY_AFTER,
+    ):
+        self.workers = workers
+        self.capacity = max(workers, 1) + queue_size
+        self.retry_after = retry_after
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._started = False
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self) -> None:
+        """Arranca los procesos y espera a que todos terminen su warmup."""
+        if self._executor is not None:
+            return
+        if self.workers <= 0:
+            # Sin pool: el render ocurre en este proceso, así que lo calentamos aquí
+            renderer.warmup()
+            return
+        executor = self._spawn()
+        with self._lock:
+            self._executor = executor
+            self._started = True
+        logger.info(f"Render pool listo con {self.workers} procesos")
+
+    def _spawn(self) -> ProcessPoolExecutor:
+        """Crea un executor y bloquea hasta que todos sus procesos han hecho el warmup."""
+        ctx = multiprocessing.get_context(RENDER_POOL_START_METHOD)
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+        )
+        try:
+            for future in [executor.submit(_ping) for _ in range(self.workers)]:
+                future.result()
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        return executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._started = False
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._pending >= self.capacity:
+                RENDER_REJECTED.labels(current_plan.get()).inc()
+                raise RenderQueueFull(self.retry_after)
+            self._pending += 1
+
+    def _release(self, _future=None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _current_executor(self) -> ProcessPoolExecutor:
+        executor = self._executor
+        if executor is not None:
+            return executor
+        if not self._started:
+            raise RuntimeError("El render pool no está arrancado")
+        # Se está recreando tras una caída: backpressure en vez de renderizar
+        # en este proceso sin calentar
+        RENDER_REJECTED.labels(current_plan.get()).inc()
+        raise RenderQueueFull(self.retry_after)
+
+    def submit(self, fn, *args) -> Future:
+        """Encola `fn(*args)` en el pool de procesos (requiere start())."""
+        return self._submit(fn, *args)[1]
+
+    def _submit(self, fn, *args) -> tuple[ProcessPoolExecutor, Future]:
+        # Devuelve también el executor usado: si se rompe, sólo se recrea si sigue siendo el actual
+        executor = self._current_executor()
+        self._acquire()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._restart(executor)
+            raise
+        future.add_done_callback(self._release)
+        return executor, future
+
+    async def run(self, fn, *args):
+        """Ejecuta `fn(*args)` en el pool y espera el resultado sin bloquear el event loop."""
+        inflight = RENDER_INFLIGHT.labels(current_plan.get())
+        inflight.inc()
+        try:
+            result = await self._run(fn, *args)
+        finally:
+            inflight.dec()
+        # Las etapas se miden en el proceso de render; se registran aquí
+        if isinstance(result, RenderedReceipt) and result.timings:
+            for name, seconds in result.timings.items():
+                observe_stage(name, seconds)
+        return result
+
+    async def _run(self, fn, *args):
+        if self.workers <= 0:
+            self._acquire()
+            try:
+                return await run_in_threadpool(fn, *args)
+            finally:
+                self._release()
+        executor, future = self._submit(fn, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    async def map(self, fn, items: list) -> list:
+        """
+        Ejecuta `fn(item)` para cada item en paralelo, con como mucho un trabajo
+        por proceso en vuelo. Devuelve, en orden, el resultado o la excepción.
+        """
+        limit = asyncio.Semaphore(max(self.workers, 1))
+
+        async def _one(item):
+            async with limit:
+                return await self.run(fn, item)
+
+        return await asyncio.gather(*[_one(item) for item in items], return_exceptions=True)
+
+    async def render(self, invoice: Invoice) -> RenderedReceipt:
+        return await self.run(render_receipt, receipt_data(invoice))
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Descarta `broken` y recrea el pool en un hilo aparte (el warmup tarda
+        segundos y no puede bloquear el event loop). Varios trabajos fallan a la
+        vez con el mismo executor roto: sólo el primero lo recrea.
+        """
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+        logger.error("Render pool roto; recreando procesos")
+        broken.shutdown(wait=False, cancel_futures=True)
+        threading.Thread(target=self._rebuild, name="render-pool-restart", daemon=True).start()
+
+    def _rebuild(self) -> None:
+        while True:
+            try:
+                executor = self._spawn()
+            except Exception:
+                logger.exception(f"No se pudo recrear el render pool; reintento en {self.retry_after}s")
+                time.sleep(self.retry_after)
+                if not self._started:
+                    return
+                continue
+            with self._lock:
+                if self._started and self._executor is None:
+                    self._executor, executor = executor, None
+            if executor is not None:
+                # Se llamó a shutdown() durante el warmup
+                executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                logger.info(f"Render pool recreado con {self.workers} procesos")
+            return
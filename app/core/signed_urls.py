@@ -0,0 +1,64 @@
+# app/core/signed_urls.py
+
+import base64
+import hashlib
+import hmac
+import os
+import time
+from typing import NamedTuple, Optional
+
+from app.core.storage import is_legacy_path
+
+# Secreto HMAC de las URLs de descarga. Sin él, receipt_url sigue siendo la clave
+# de almacenamiento y las descargas pasan por GET /receipts/{id}
+DOWNLOAD_URL_SECRET = os.getenv("DOWNLOAD_URL_SECRET", "")
+# Validez de cada URL firmada, en segundos
+DOWNLOAD_URL_TTL = int(os.getenv("DOWNLOAD_URL_TTL", "3600"))
+# Prefijo opcional (p. ej. el host de la CDN); por defecto, rutas relativas
+DOWNLOAD_URL_BASE = os.getenv("DOWNLOAD_URL_BASE", "").rstrip("/")
+DOWNLOAD_PATH = "/downloads"
+
+
+class DownloadGrant(NamedTuple):
+    key: str
+    tenant_id: str
+    receipt_id: str
+    expires: int
+
+
+def signing_enabled() -> bool:
+    return bool(DOWNLOAD_URL_SECRET)
+
+
+def _signature(key: str, tenant_id: str, receipt_id: str, expires: int) -> str:
+    message = f"{key}\n{tenant_id}\n{receipt_id}\n{expires}".encode()
+    digest = hmac.new(DOWNLOAD_URL_SECRET.encode(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def sign_download_url(key: str, tenant_id: str, receipt_id: str, ttl: int = DOWNLOAD_URL_TTL) -> str:
+    expires = int(time.time()) + ttl
+    sig = _signature(key, tenant_id, receipt_id, expires)
+    return (
+        f"{DOWNLOAD_URL_BASE}{DOWNLOAD_PATH}/{key}"
+        f"?tenant={tenant_id}&rid={receipt_id}&exp={expires}&sig={sig}"
+    )
+
+
+def verify_download(key: str, tenant_id: str, receipt_id: str, expires: int, sig: str) -> Optional[DownloadGrant]:
+    """Comprueba firma y caducidad sólo con CPU. Devuelve None si no es válida."""
+    if not signing_enabled() or expires < time.time():
+        return None
+    if not hmac.compare_digest(_signature(key, tenant_id, receipt_id, expires), sig):
+        return None
+    return DownloadGrant(key, tenant_id, receipt_id, expires)
+
+
+def public_receipt_url(pdf_url: Optional[str], tenant_id: str, receipt_id: str) -> Optional[str]:
+    """
+    Valor de `receipt_url` en las respuestas: una URL de descarga firmada si
+    hay secreto configurado, o la clave de almacenamiento tal cual.
+    """
+    if not pdf_url or not signing_enabled() or is_legacy_path(pdf_url):
+        return pdf_url
+    return sign_download_url(pdf_url, tenant_id, receipt_id)
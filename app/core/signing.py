@@ -0,0 +1,144 @@
+# app/core/signing.py
+
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional, Union
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+
+logger = logging.getLogger(__name__)
+
+# Clave privada Ed25519 en PEM (PKCS#8). Se carga una sola vez por proceso.
+RECEIPT_SIGNING_KEY_PATH = os.getenv("RECEIPT_SIGNING_KEY_PATH")
+# Sólo desarrollo: sin RECEIPT_SIGNING_KEY_PATH, cada proceso genera su propia
+# clave. Con varios workers o tras reiniciar, las firmas ya emitidas no verifican.
+RECEIPT_SIGNING_EPHEMERAL = os.getenv("RECEIPT_SIGNING_EPHEMERAL", "false").lower() in ("1", "true", "yes")
+# Pares (payload, firma) que se verifican juntos en cada tarea del threadpool
+RECEIPT_VERIFY_CHUNK = int(os.getenv("RECEIPT_VERIFY_CHUNK", "500"))
+
+PAYLOAD_VERSION = 1
+
+
+def canonical_payload(fields: dict) -> str:
+    """JSON canónico: claves ordenadas, sin espacios, UTF-8 sin escapar."""
+    return json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def key_id(public_key: Ed25519PublicKey) -> str:
+    raw = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+class ReceiptSigner:
+    """Firma Ed25519 de recibos con la clave cargada en memoria."""
+
+    def __init__(self, private_key: Ed25519PrivateKey):
+        self._private_key = private_key
+        self.public_key = private_key.public_key()
+        self.kid = key_id(self.public_key)
+        self.public_bytes = self.public_key.public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+
+    @classmethod
+    def from_env(cls) -> "ReceiptSigner":
+        if RECEIPT_SIGNING_KEY_PATH:
+            with open(RECEIPT_SIGNING_KEY_PATH, "rb") as f:
+                key = serialization.load_pem_private_key(f.read(), password=None)
+            if not isinstance(key, Ed25519PrivateKey):
+                raise RuntimeError(f"{RECEIPT_SIGNING_KEY_PATH} no es una clave Ed25519")
+            return cls(key)
+        if not RECEIPT_SIGNING_EPHEMERAL:
+            # signed_payload se guarda para siempre: firmar con una clave que no
+            # sobrevive al proceso rompería la verificación de esos recibos
+            raise RuntimeError(
+                "RECEIPT_SIGNING_KEY_PATH no definida (en desarrollo, RECEIPT_SIGNING_EPHEMERAL=true "
+                "usa una clave efímera por proceso)"
+            )
+        logger.warning(
+            "RECEIPT_SIGNING_EPHEMERAL: clave Ed25519 efímera; las firmas no verifican "
+            "en otros workers ni tras reiniciar"
+        )
+        return cls(Ed25519PrivateKey.generate())
+
+    def payload(self, invoice_id: str, amount_msat: int, payment_hash: str, tenant_id: str,
+                issued_at: Optional[int] = None) -> str:
+        return canonical_payload({
+            "v": PAYLOAD_VERSION,
+            "kid": self.kid,
+            "invoice_id": invoice_id,
+            "amount_msat": amount_msat,
+            "payment_hash": payment_hash,
+            "tenant_id": tenant_id,
+            "issued_at": int(time.time()) if issued_at is None else issued_at,
+        })
+
+    def sign(self, payload: str) -> str:
+        return _b64(self._private_key.sign(payload.encode()))
+
+    def public_key_pem(self) -> str:
+        return self.public_key.public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+
+
+def verify_chunk(args: tuple[bytes, list[tuple[str, str]]]) -> list[Optional[str]]:
+    """
+    Verifica un bloque de pares (payload, firma) con la clave pública dada.
+    Devuelve, en orden, None si la firma es válida o el motivo del fallo.
+    """
+    public_bytes, pairs = args
+    public_key = Ed25519PublicKey.from_public_bytes(public_bytes)
+    kid = key_id(public_key)
+    errors = []
+    for payload, signature in pairs:
+        try:
+            if json.loads(payload).get("kid") != kid:
+                errors.append("unknown_key")
+                continue
+            public_key.verify(_unb64(signature), payload.encode())
+            errors.append(None)
+        except InvalidSignature:
+            errors.append("bad_signature")
+        except (ValueError, binascii.Error, AttributeError):
+            errors.append("malformed")
+    return errors
+
+
+def payload_text(payload: Union[str, dict]) -> str:
+    """Acepta el payload tal cual se firmó (texto) o como objeto JSON."""
+    return payload if isinstance(payload, str) else canonical_payload(payload)
+
+
+_receipt_signer: Optional[ReceiptSigner] = None
+_signer_lock = threading.Lock()
+
+
+def get_receipt_signer() -> ReceiptSigner:
+    """
+    Firmante del proceso: la clave se lee en el primer uso. El lifespan lo
+    llama al arrancar (una clave ausente impide arrancar); los procesos del
+    render pool nunca lo usan, así que no llegan a cargar la clave.
+    """
+    global _receipt_signer
+    if _receipt_signer is None:
+        with _signer_lock:
+            if _receipt_signer is None:
+                _receipt_signer = ReceiptSigner.from_env()
+    return _receipt_signer
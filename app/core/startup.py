@@ -0,0 +1,49 @@
+# app/core/startup.py
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from app.core.metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Presupuesto de arranque de cada proceso (import + lifespan), en segundos (0 = sin límite)
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "5"))
+
+
+class StartupTimer:
+    """Mide los pasos del arranque y avisa si su suma supera el presupuesto."""
+
+    def __init__(self, budget: float = STARTUP_BUDGET):
+        self.budget = budget
+        self.steps: dict[str, float] = {}
+
+    def mark(self, name: str, seconds: float) -> None:
+        self.steps[name] = seconds
+        STARTUP_SECONDS.labels(name).set(seconds)
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - start)
+
+    @property
+    def total(self) -> float:
+        return sum(self.steps.values())
+
+    def over_budget(self) -> bool:
+        return self.budget > 0 and self.total > self.budget
+
+    def finish(self) -> float:
+        total = self.total
+        STARTUP_SECONDS.labels("total").set(total)
+        detail = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.steps.items())
+        if self.over_budget():
+            logger.warning(f"Arranque en {total:.2f}s, por encima del presupuesto de {self.budget:.2f}s ({detail})")
+        else:
+            logger.info(f"Arranque en {total:.2f}s ({detail})")
+        return total
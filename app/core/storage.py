@@ -0,0 +1,361 @@
+# app/core/storage.py
+
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import re
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Driver de almacenamiento de recibos: "local" o "s3"
+RECEIPT_STORE = os.getenv("RECEIPT_STORE", "local").lower()
+# Raíz del driver local (puede ser un volumen compartido entre nodos)
+RECEIPT_STORE_DIR = Path(os.getenv("RECEIPT_STORE_DIR", str(BASE_DIR / "generated_receipts")))
+# Driver S3 (AWS o compatible: MinIO, Ceph...)
+S3_BUCKET = os.getenv("S3_BUCKET", "receipts")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # p. ej. http://localhost:9000 con MinIO
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+
+# Tamaño de los trozos al leer un recibo en streaming
+CHUNK_SIZE = 64 * 1024
+
+MEDIA_TYPES = {".pdf": "application/pdf", ".zip": "application/zip"}
+
+CONTENT_KEY_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z]+$")
+
+
+class ReceiptNotStored(Exception):
+    """La clave no existe en el almacenamiento de recibos."""
+
+
+class InvalidRange(Exception):
+    """El rango pedido no se puede satisfacer (HTTP 416)."""
+
+    def __init__(self, size: Optional[int] = None):
+        super().__init__("Rango no satisfacible")
+        self.size = size
+
+
+class StoredObject(NamedTuple):
+    chunks: Iterator[bytes]
+    length: int                   # bytes que se van a enviar
+    content_range: Optional[str]  # "bytes a-b/total" si la respuesta es parcial
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Interpreta una cabecera Range de un solo tramo ("bytes=a-b", "bytes=a-",
+    "bytes=-n") y devuelve (inicio, fin) inclusivos. None si no es un rango
+    simple que se pueda aplicar (se responde el fichero completo).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise InvalidRange(size)
+    return start, min(end, size - 1)
+
+
+def content_key(data: bytes, suffix: str = ".pdf") -> str:
+    """
+    Clave direccionada por contenido: `ab/cd/<sha256><suffix>`.
+    Los dos primeros niveles reparten los ficheros en 65.536 directorios.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{suffix}"
+
+
+def file_content_key(path: Path, suffix: str) -> str:
+    """Como content_key, pero leyendo el fichero en trozos."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{suffix}"
+
+
+def media_type(key: str) -> str:
+    return MEDIA_TYPES.get(Path(key).suffix, "application/octet-stream")
+
+
+def key_digest(key: str) -> str:
+    """sha256 del contenido a partir de su clave."""
+    return key.rsplit("/", 1)[-1].split(".", 1)[0]
+
+
+def is_legacy_path(pdf_url: str) -> bool:
+    """Los recibos antiguos guardaban la ruta del PDF en el host en vez de una clave."""
+    return not CONTENT_KEY_RE.match(pdf_url)
+
+
+class ReceiptStore(ABC):
+    """
+    Interfaz de los drivers de almacenamiento de recibos. Un driver incompleto
+    falla al instanciarse, no a mitad de una request.
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """Guarda el contenido (idempotente) y devuelve su clave."""
+
+    @abstractmethod
+    def put_file(self, path: Path, suffix: str) -> str:
+        """
+        Guarda un fichero ya escrito en disco (p. ej. un ZIP grande) sin
+        cargarlo en memoria. El fichero de origen se consume.
+        """
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """True si la clave está guardada."""
+
+    @abstractmethod
+    def open(self, key: str, byte_range: Optional[str] = None, chunk_size: int = CHUNK_SIZE) -> StoredObject:
+        """
+        Abre el contenido para leerlo en trozos (ReceiptNotStored si no existe).
+        Admite una cabecera Range de un solo tramo (InvalidRange si no es satisfacible).
+        """
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        return self.open(key, chunk_size=chunk_size).chunks
+
+    def get(self, key: str) -> bytes:
+        return b"".join(self.stream(key))
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Ruta en disco si el driver es local (permite servir con sendfile)."""
+        return None
+
+
+class LocalReceiptStore(ReceiptStore):
+    """
+    Sistema de ficheros local, con la clave como ruta relativa a `root`.
+    Escritura atómica: fichero temporal en el mismo directorio, fsync y rename.
+    """
+
+    def __init__(self, root: Path = RECEIPT_STORE_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Clave fuera del almacenamiento: {key}")
+        return path
+
+    def put(self, data: bytes) -> str:
+        key = content_key(data)
+        path = self._path(key)
+        if path.exists():
+            return key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._fsync_dir(path.parent)
+        return key
+
+    def put_file(self, path: Path, suffix: str) -> str:
+        key = file_content_key(path, suffix)
+        dest = self._path(key)
+        if dest.exists():
+            os.unlink(path)
+            return key
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+        try:
+            os.replace(path, dest)
+        except OSError:
+            # Otro sistema de ficheros: copia a un temporal junto al destino y rename
+            fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=".", suffix=".tmp")
+            os.close(fd)
+            try:
+                shutil.copyfile(path, tmp)
+                os.replace(tmp, dest)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            os.unlink(path)
+        self._fsync_dir(dest.parent)
+        return key
+
+    @staticmethod
+    def _fsync_dir(directory: Path) -> None:
+        # fsync del directorio para que el rename sobreviva a un corte de luz
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def open(self, key: str, byte_range: Optional[str] = None, chunk_size: int = CHUNK_SIZE) -> StoredObject:
+        # Se abre ya (no al iterar) para detectar la ausencia antes de responder
+        try:
+            f = open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise ReceiptNotStored(key)
+        size = os.fstat(f.fileno()).st_size
+        try:
+            span = parse_range(byte_range, size) if byte_range else None
+        except InvalidRange:
+            f.close()
+            raise
+        if span is None:
+            return StoredObject(self._read_chunks(f, chunk_size), size, None)
+        start, end = span
+        f.seek(start)
+        return StoredObject(
+            self._read_chunks(f, chunk_size, end - start + 1),
+            end - start + 1,
+            f"bytes {start}-{end}/{size}",
+        )
+
+    @staticmethod
+    def _read_chunks(f, chunk_size: int, remaining: Optional[int] = None) -> Iterator[bytes]:
+        with f:
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+
+class S3ReceiptStore(ReceiptStore):
+    """
+    Bucket S3 o compatible (MinIO con `endpoint_url`). Un PUT en S3 ya es
+    atómico: el objeto no es visible hasta que se ha subido entero.
+    """
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        prefix: str = S3_PREFIX,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        region: str = S3_REGION,
+    ):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("RECEIPT_STORE=s3 necesita boto3 (pip install boto3)")
+        self._client_error = ClientError
+        # Credenciales por la cadena habitual de boto3 (AWS_ACCESS_KEY_ID, perfil, rol...)
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _missing(self, exc) -> bool:
+        return exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, data: bytes) -> str:
+        key = content_key(data)
+        if self.exists(key):
+            return key
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=data,
+            ContentType=media_type(key),
+        )
+        return key
+
+    def put_file(self, path: Path, suffix: str) -> str:
+        key = file_content_key(path, suffix)
+        try:
+            if not self.exists(key):
+                # upload_file sube en multipart a partir de cierto tamaño, leyendo en trozos
+                self.client.upload_file(
+                    str(path), self.bucket, self._key(key),
+                    ExtraArgs={"ContentType": media_type(key)},
+                )
+        finally:
+            os.unlink(path)
+        return key
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self._client_error as exc:
+            if self._missing(exc):
+                return False
+            raise
+
+    def open(self, key: str, byte_range: Optional[str] = None, chunk_size: int = CHUNK_SIZE) -> StoredObject:
+        # S3 sólo admite un tramo por petición; con varios se sirve el objeto entero
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if byte_range and "," not in byte_range:
+            params["Range"] = byte_range
+        try:
+            obj = self.client.get_object(**params)
+        except self._client_error as exc:
+            if self._missing(exc):
+                raise ReceiptNotStored(key)
+            if exc.response.get("Error", {}).get("Code") == "InvalidRange":
+                size = exc.response.get("Error", {}).get("ActualObjectSize")
+                raise InvalidRange(int(size) if size else None)
+            raise
+        return StoredObject(
+            obj["Body"].iter_chunks(chunk_size),
+            obj["ContentLength"],
+            obj.get("ContentRange"),
+        )
+
+
+def build_store(kind: str = RECEIPT_STORE) -> ReceiptStore:
+    if kind == "local":
+        return LocalReceiptStore()
+    if kind == "s3":
+        return S3ReceiptStore()
+    raise RuntimeError(f"RECEIPT_STORE desconocido: {kind}")
+
+
+_receipt_store: Optional[ReceiptStore] = None
+_store_lock = threading.Lock()
+
+
+def get_receipt_store() -> ReceiptStore:
+    """Almacenamiento de recibos del proceso, creado en el primer uso (mkdir o cliente de boto3)."""
+    global _receipt_store
+    if _receipt_store is None:
+        with _store_lock:
+            if _receipt_store is None:
+                _receipt_store = build_store()
+    return _receipt_store
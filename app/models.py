@@ -2,7 +2,8 @@
 
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Boolean, ForeignKey, Text, Index, text
+from sqlalchemy.orm import relationship
 from app.core.db import Base
 
 def gen_id():
@@ -27,6 +28,16 @@ class APIKey(Base):
     expires_at = Column(DateTime)
     is_active  = Column(Boolean,  default=True)
 
+    __table_args__ = (
+        # Lookup del middleware de auth: sólo keys activas, resuelto con un index-only scan
+        Index(
+            "ix_api_keys_key_hash_active", "key_hash",
+            postgresql_where=text("is_active"),
+            postgresql_include=["tenant_id", "expires_at"],
+            sqlite_where=text("is_active"),
+        ),
+    )
+
 class Invoice(Base):
     __tablename__ = "invoices"
     id            = Column(String,   primary_key=True, default=gen_id)
@@ -38,10 +49,86 @@ class Invoice(Base):
     status        = Column(String,   default="pending")  # paid, expired
     created_at    = Column(DateTime, default=datetime.utcnow)
 
+    # Sin carga perezosa: los listados la piden explícitamente (selectinload / contains_eager)
+    receipt = relationship("Receipt", uselist=False, back_populates="invoice", lazy="raise")
+
+    __table_args__ = (
+        Index("ix_invoices_tenant_id_payment_hash", "tenant_id", "payment_hash"),
+        # Export y listados por tenant: keyset sobre (created_at, id)
+        Index("ix_invoices_tenant_id_created_at_id", "tenant_id", "created_at", "id"),
+    )
+
 class Receipt(Base):
     __tablename__ = "receipts"
     id           = Column(String,   primary_key=True, default=gen_id)
     invoice_id   = Column(String,   ForeignKey("invoices.id"), nullable=False)
     pdf_url      = Column(String)
-    signature    = Column(String)
+    signature    = Column(String)   # Ed25519 (base64url) de signed_payload
+    signed_payload = Column(Text)   # JSON canónico firmado (invoice, importe, hash, tenant, fecha)
+    status       = Column(String,   nullable=False, default="ready", server_default="ready")  # pending, ready, failed
     generated_at = Column(DateTime, default=datetime.utcnow)
+
+    invoice = relationship("Invoice", back_populates="receipt", lazy="raise")
+
+    __table_args__ = (
+        # Un único recibo por invoice; también sirve al JOIN receipts -> invoices
+        Index("uq_receipts_invoice_id", "invoice_id", unique=True),
+    )
+
+class ReceiptJob(Base):
+    """Cola durable de recibos pendientes de generar (modo asíncrono)."""
+    __tablename__ = "receipt_jobs"
+    id         = Column(String,   primary_key=True, default=gen_id)
+    receipt_id = Column(String,   ForeignKey("receipts.id"), nullable=False, unique=True)
+    status     = Column(String,   nullable=False, default="pending")  # pending, running, done, failed
+    attempts   = Column(Integer,  nullable=False, default=0)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_receipt_jobs_status_created_at", "status", "created_at"),
+    )
+
+class BundleJob(Base):
+    """Bundle de recibos (PDF combinado o ZIP) generado en segundo plano."""
+    __tablename__ = "bundle_jobs"
+    id          = Column(String,   primary_key=True, default=gen_id)
+    tenant_id   = Column(String,   ForeignKey("tenants.id"), nullable=False)
+    format      = Column(String,   nullable=False)  # pdf, zip
+    receipt_ids = Column(Text)     # JSON con los ids pedidos, o NULL si es por fechas
+    date_from   = Column(DateTime)
+    date_to     = Column(DateTime)
+    status      = Column(String,   nullable=False, default="pending")  # pending, running, ready, failed
+    item_count  = Column(Integer,  nullable=False, default=0)
+    result_key  = Column(String)   # clave en el almacenamiento de recibos
+    error       = Column(Text)
+    created_at  = Column(DateTime, default=datetime.utcnow)
+    updated_at  = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_bundle_jobs_status_created_at", "status", "created_at"),
+    )
+
+class IdempotencyRecord(Base):
+    """Respuesta guardada de un POST con cabecera Idempotency-Key."""
+    __tablename__ = "idempotency_records"
+    tenant_id       = Column(String,   ForeignKey("tenants.id"), primary_key=True)
+    idempotency_key = Column(String,   primary_key=True)
+    request_hash    = Column(String,   nullable=False)  # sha256 del payload: la key no se puede reutilizar con otro
+    status_code     = Column(Integer)  # NULL: reservada, la petición original sigue en curso
+    response_body   = Column(Text)
+    created_at      = Column(DateTime, default=datetime.utcnow)
+    expires_at      = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Purga de registros caducados
+        Index("ix_idempotency_records_expires_at", "expires_at"),
+    )
+
+class LndCursor(Base):
+    """Último settle_index procesado del stream SubscribeInvoices de cada nodo."""
+    __tablename__ = "lnd_cursors"
+    node         = Column(String,     primary_key=True)
+    settle_index = Column(BigInteger, nullable=False, default=0)
+    updated_at   = Column(DateTime,   default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,30 @@
+# app/routes/admin.py
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from app.core.auth import require_admin
+from app.core.profiling import PROFILE_SUFFIXES, request_profiler
+
+router = APIRouter()
+
+
+@router.get("/profiles", tags=["Admin"], dependencies=[Depends(require_admin)])
+def list_profiles():
+    """Perfiles de requests guardados, del más reciente al más antiguo."""
+    return {"profiles": request_profiler.list()}
+
+
+@router.get("/profiles/{request_id}", response_class=FileResponse, tags=["Admin"],
+            dependencies=[Depends(require_admin)])
+def get_profile(request_id: str):
+    """
+    Perfil de una request (cabecera X-Profile-Id de su respuesta): JSON de
+    speedscope con pyinstrument o pstats con cProfile. Ambos se abren en
+    https://www.speedscope.app.
+    """
+    path = request_profiler.path(request_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    suffix = next(s for s in PROFILE_SUFFIXES if path.name.endswith(s))
+    return FileResponse(path, media_type=PROFILE_SUFFIXES[suffix], filename=path.name)
+
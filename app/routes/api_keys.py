@@ -0,0 +1,22 @@
+# app/routes/api_keys.py
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.schemas import APIKeyRevokeRequest, APIKeyRevokeResponse
+from app.core.auth import API_KEY_CACHE_TTL, require_admin, revoke_api_key
+from app.core.db import get_async_db
+
+router = APIRouter()
+
+
+@router.post("/revoke", response_model=APIKeyRevokeResponse, tags=["Admin"],
+             dependencies=[Depends(require_admin)])
+async def revoke_key(body: APIKeyRevokeRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Desactiva una API key. Este proceso deja de aceptarla al instante; los
+    demás workers, cuando caduque su entrada en caché (API_KEY_CACHE_TTL).
+    """
+    revoked = await revoke_api_key(db, body.api_key)
+    if not revoked:
+        raise HTTPException(status_code=404, detail="API key not found")
+    return APIKeyRevokeResponse(revoked=True, revocation_window=API_KEY_CACHE_TTL)
@@ -0,0 +1,34 @@
+# app/routes/downloads.py
+
+import time
+from pathlib import Path
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse
+from app.core.signed_urls import verify_download
+from app.core.storage import is_legacy_path, key_digest
+from app.routes.receipts import receipt_file_response
+
+router = APIRouter()
+
+
+@router.get("/{key:path}", response_class=FileResponse, tags=["Receipts"])
+async def download_receipt(
+    key: str,
+    request: Request,
+    tenant: str = Query(...),
+    rid: str = Query(...),
+    exp: int = Query(...),
+    sig: str = Query(...)
+):
+    """
+    Descarga de un recibo con una URL firmada (receipt_url). No pasa por la
+    API key ni por la DB: la firma HMAC y la caducidad se validan en CPU.
+    """
+    if is_legacy_path(key) or not verify_download(key, tenant, rid, exp, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired download link")
+
+    # Cacheable por la CDN hasta que caduca el enlace
+    max_age = max(exp - int(time.time()), 0)
+    return await receipt_file_response(
+        request, key, f"{rid}{Path(key).suffix}", f'"{key_digest(key)}"', f"public, max-age={max_age}, immutable"
+    )
@@ -1,115 +1,750 @@
+import asyncio
 import logging
-from fastapi import APIRouter, Depends, HTTPException, Request
+import os
+from datetime import datetime
+from typing import AsyncIterator, Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select, insert, select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
-from app.schemas import InvoiceCreate, InvoiceResponse
-from app.models import Invoice, Receipt
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from starlette.datastructures import State
+from app.schemas import (
+    InvoiceBatchCreate,
+    InvoiceBatchItemResult,
+    InvoiceBatchResponse,
+    InvoiceCreate,
+    InvoiceListItem,
+    InvoicePage,
+    InvoiceResponse,
+    ReceiptSummary,
+)
+from app.models import Invoice, Receipt, gen_id
 from app.core.auth import get_current_tenant
-from app.core.pdf_generator import generate_pdf
-from app.core.db import get_db
-from app.services.lnd_grpc import LndGrpcClient
+from app.core.pdf_generator import RenderedReceipt, receipt_data, render_receipt
+from app.core.receipt_queue import ReceiptWorker, enqueue_receipt, requeue_failed_receipt
+from app.core.signed_urls import public_receipt_url
+from app.core.export import accepts_gzip, csv_lines, gzip_stream, ndjson_lines
+from app.core.pagination import InvalidCursor, decode_cursor, keyset_page, keyset_stream, split_page
+from app.core.cache import SingleFlight
+from app.core.db import AsyncSessionLocal, get_async_db
+from app.core.metrics import stage
+from app.core.idempotency import (
+    IDEMPOTENCY_KEY_MAX_LENGTH, release_key, request_fingerprint, reserve_key, save_response,
+)
+from app.services.lnd_grpc import LndError
 
 # Configuramos logging
 t_logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 router = APIRouter()
-lnd = LndGrpcClient()
+
+# Máximo de items aceptados por POST /invoices/batch
+INVOICE_BATCH_MAX_ITEMS = int(os.getenv("INVOICE_BATCH_MAX_ITEMS", "500"))
+# GET /invoices/export: filas por página keyset y por fetch del cursor de servidor
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "500"))
+
+# GET /invoices y GET /receipts: tamaño de página por defecto y máximo
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", "50"))
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", "200"))
+
+# Altas de invoice en vuelo por (tenant, payment_hash, async_receipt)
+invoice_flights = SingleFlight()
+# Peticiones con Idempotency-Key reservada por este proceso, por
+# (tenant, key, request_hash): un duplicado simultáneo espera a la original
+idempotent_requests = SingleFlight()
+
+EXPORT_COLUMNS = [
+    "invoice_id", "payment_hash", "amount_msat", "description", "customer_name",
+    "status", "created_at", "receipt_id", "receipt_status", "receipt_url",
+    "signature", "generated_at",
+]
+
+
+# --- Acceso a DB ---
+#
+# Cada request hace como mucho dos transacciones: la lectura inicial (una sola
+# consulta con JOIN) y la escritura final, en la que invoice y receipt se
+# insertan juntos con INSERT ... RETURNING y un único commit.
+
+async def _find_existing(db: AsyncSession, payment_hash: str, tenant_id: str) -> tuple[Optional[Invoice], Optional[Receipt]]:
+    # Invoice y su recibo (si existe) en una sola consulta
+    with stage("db_query"):
+        row = (await db.execute(
+            select(Invoice, Receipt)
+            .outerjoin(Receipt, Receipt.invoice_id == Invoice.id)
+            .where(
+                Invoice.payment_hash == payment_hash,
+                Invoice.tenant_id == tenant_id
+            )
+        )).first()
+    if not row:
+        return None, None
+    return row.Invoice, row.Receipt
+
+
+def _new_invoice(payload: InvoiceCreate, tenant_id: str, status: str) -> Invoice:
+    """Invoice aún sin persistir, con el id ya asignado (lo necesita el PDF)."""
+    return Invoice(
+        id=gen_id(),
+        tenant_id=tenant_id,
+        payment_hash=payload.payment_hash,
+        amount_msat=payload.amount_msat,
+        description=payload.description,
+        customer_name=payload.customer_name,
+        status=status
+    )
+
+
+def _invoice_row(invoice: Invoice) -> dict:
+    return {
+        "id": invoice.id,
+        "tenant_id": invoice.tenant_id,
+        "payment_hash": invoice.payment_hash,
+        "amount_msat": invoice.amount_msat,
+        "description": invoice.description,
+        "customer_name": invoice.customer_name,
+        "status": invoice.status
+    }
+
+
+async def _insert_invoice(db: AsyncSession, invoice: Invoice) -> Invoice:
+    """INSERT ... RETURNING de la invoice, sin commit (409 si el hash ya existe)."""
+    try:
+        return await db.scalar(insert(Invoice).values(_invoice_row(invoice)).returning(Invoice))
+    except IntegrityError:
+        await db.rollback()
+        t_logger.error(f"Violación de clave única: {invoice.payment_hash}")
+        raise HTTPException(status_code=409, detail="Invoice ya existe")
+
+
+async def _insert_receipt(db: AsyncSession, invoice: Invoice, rendered: RenderedReceipt) -> Receipt:
+    """INSERT ... RETURNING del receipt (id y fechas los devuelve el propio INSERT), sin commit."""
+    return await db.scalar(
+        insert(Receipt)
+        .values(
+            invoice_id=invoice.id,
+            pdf_url=rendered.pdf_url,
+            signature=rendered.signature,
+            signed_payload=rendered.signed_payload
+        )
+        .returning(Receipt)
+    )
+
+
+async def _register_invoice(db: AsyncSession, payload: InvoiceCreate, tenant_id: str) -> tuple[Invoice, bool]:
+    """Crea la invoice en estado `pending` (o devuelve la existente). Devuelve (invoice, creada)."""
+    existing, _ = await _find_existing(db, payload.payment_hash, tenant_id)
+    if existing:
+        return existing, False
+    invoice = await _insert_invoice(db, _new_invoice(payload, tenant_id, "pending"))
+    await db.commit()
+    return invoice, True
+
 
 @router.post("/", response_model=InvoiceResponse, tags=["Invoices"])
-def create_invoice(
+async def create_invoice(
     payload: InvoiceCreate,
     request: Request,
-    db: Session = Depends(get_db),
+    response: Response,
+    async_receipt: bool = Query(False, description="Encolar el recibo y responder 202 sin esperar al PDF"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
     tenant_id: str = Depends(get_current_tenant)
 ):
+    """
+    Registra una invoice pagada y genera su recibo.
+    Con `Idempotency-Key`, la key se reserva antes de empezar, la primera
+    respuesta correcta se guarda y los reintentos con la misma key la reciben
+    tal cual, sin consultar LND ni renderizar (422 si el payload difiere).
+    Un duplicado simultáneo espera a la petición original si la reserva es de
+    este proceso, y recibe 409 si la tiene otra réplica.
+    Las peticiones simultáneas para el mismo payment_hash del tenant comparten
+    una única ejecución (single-flight).
+    """
     t_logger.info(f"→ create_invoice payload recibido: {payload}")
+    state = request.app.state
+
+    def flight():
+        return invoice_flights.do(
+            (tenant_id, payload.payment_hash, async_receipt),
+            lambda: _create_invoice_once(payload, async_receipt, tenant_id, state)
+        )
+
+    if not idempotency_key:
+        status_code, result = await flight()
+        response.status_code = status_code
+        return result
+
+    request_hash = request_fingerprint(payload.model_dump(), async_receipt)
+    reservation = (tenant_id, idempotency_key, request_hash)
+    # Se reserva la key antes de hacer el trabajo
+    stored = await reserve_key(tenant_id, idempotency_key, request_hash)
+    if stored and stored.request_hash == request_hash and stored.pending and reservation not in idempotent_requests:
+        # La original puede ser de este proceso y haber terminado entre medias: se relee
+        stored = await reserve_key(tenant_id, idempotency_key, request_hash)
+    if stored and stored.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key ya usada con otro payload")
+    if stored and stored.pending and reservation not in idempotent_requests:
+        raise HTTPException(
+            status_code=409,
+            detail="Hay una petición en curso con esta Idempotency-Key",
+            headers={"Retry-After": "1"},
+        )
+    if stored and not stored.pending:
+        t_logger.info(f"↩ Respuesta guardada para Idempotency-Key {idempotency_key}")
+        response.status_code = stored.status_code
+        response.headers["Idempotent-Replayed"] = "true"
+        return await _replayed_response(stored.body, tenant_id)
 
-    # 1) Comprobamos si ya existe invoice para este payment_hash + tenant
-    existing = (
-        db.query(Invoice)
-          .filter(
-              Invoice.payment_hash == payload.payment_hash,
-              Invoice.tenant_id == tenant_id
-          )
-          .first()
+    if stored:
+        t_logger.info(f"⇉ Esperando a la petición en curso con Idempotency-Key {idempotency_key}")
+        response.headers["Idempotent-Replayed"] = "true"
+    # Nuestra reserva, o la de una petición en curso en este proceso a la que nos unimos
+    status_code, result = await idempotent_requests.do(
+        reservation,
+        lambda: _run_reserved(tenant_id, idempotency_key, request_hash, flight)
     )
+    response.status_code = status_code
+    return result
+
+
+async def _run_reserved(tenant_id: str, key: str, request_hash: str, flight) -> tuple[int, InvoiceResponse]:
+    """
+    Ejecuta la petición con la Idempotency-Key ya reservada: guarda la respuesta
+    correcta o libera la reserva si falla. Corre en su propia tarea, así que
+    aunque el cliente se desconecte la respuesta llega a guardarse.
+    """
+    try:
+        status_code, result = await flight()
+    except BaseException:
+        try:
+            await asyncio.shield(release_key(tenant_id, key, request_hash))
+        except Exception:
+            # La reserva caduca sola en IDEMPOTENCY_PENDING_TTL
+            t_logger.exception(f"No se pudo liberar la Idempotency-Key {key}")
+        raise
+    # receipt_url no se guarda: una URL firmada caduca (DOWNLOAD_URL_TTL) mucho
+    # antes que el registro (IDEMPOTENCY_TTL)
+    await save_response(tenant_id, key, request_hash, status_code, result.model_dump_json(exclude={"receipt_url"}))
+    return status_code, result
+
+
+async def _replayed_response(body: str, tenant_id: str) -> InvoiceResponse:
+    """
+    Respuesta guardada, con receipt_url firmada de nuevo a partir de la clave del
+    recibo. Un recibo que estaba pendiente se repite sin URL, como la original.
+    """
+    result = InvoiceResponse.model_validate_json(body)
+    if result.receipt_id and result.receipt_status == "ready":
+        async with AsyncSessionLocal() as db:
+            pdf_url = await db.scalar(select(Receipt.pdf_url).where(Receipt.id == result.receipt_id))
+        result.receipt_url = public_receipt_url(pdf_url, tenant_id, result.receipt_id)
+    return result
+
+
+async def _create_invoice_once(payload: InvoiceCreate, async_receipt: bool, tenant_id: str,
+                               state: State) -> tuple[int, InvoiceResponse]:
+    # Sesión propia: la ejecución es compartida y no pertenece a ninguna request
+    async with AsyncSessionLocal() as db:
+        return await _create_invoice(db, payload, async_receipt, tenant_id, state)
+
+
+async def _create_invoice(db: AsyncSession, payload: InvoiceCreate, async_receipt: bool,
+                          tenant_id: str, state: State) -> tuple[int, InvoiceResponse]:
+    """
+    Alta de la invoice y su recibo. Devuelve (status HTTP, respuesta).
+    `state` es el de la app: render pool, watcher de liquidaciones y worker de recibos.
+    """
+    # 1) Comprobamos si ya existe invoice (y recibo) para este payment_hash + tenant
+    existing, receipt = await _find_existing(db, payload.payment_hash, tenant_id)
+    # Cerramos la transacción de lectura: la conexión vuelve al pool mientras
+    # esperamos a LND o al render
+    await db.commit()
     if existing:
         t_logger.info(f"↪ Invoice existente encontrada: {existing.id}")
-        # Verificar si ya existe un recibo asociado
-        receipt = (
-            db.query(Receipt)
-              .filter(Receipt.invoice_id == existing.id)
-              .first()
-        )
+        # Invoice pre-registrada que aún no consta como pagada: la verificamos ahora
+        # (el cambio de estado se persiste en el mismo commit que el recibo)
+        if existing.status != "paid":
+            if not await state.settlement_watcher.is_settled(payload.payment_hash):
+                t_logger.warning(f"Pago no confirmado para hash {payload.payment_hash}")
+                raise HTTPException(status_code=400, detail="Pago no confirmado")
+            existing.status = "paid"
+        if receipt and receipt.status == "failed":
+            # Agotó sus reintentos: se vuelve a encolar en vez de devolverlo fallido para siempre
+            return 202, await _requeue_receipt_response(db, existing, receipt, state.receipt_worker)
         if receipt:
-            return InvoiceResponse(
+            await db.commit()
+            return 200, InvoiceResponse(
                 invoice_id=existing.id,
                 status=existing.status,
                 receipt_id=receipt.id,
-                receipt_url=receipt.pdf_url
+                receipt_url=public_receipt_url(receipt.pdf_url, tenant_id, receipt.id),
+                receipt_status=receipt.status
             )
-        # Si no hay recibo, generar ahora
-        t_logger.info(f"⚙ Generando recibo para invoice existente {existing.id}")
-        pdf_url, signature = generate_pdf(existing)
-        receipt = Receipt(
-            invoice_id=existing.id,
-            pdf_url=pdf_url,
-            signature=signature
-        )
-        db.add(receipt)
-        db.commit()
-        db.refresh(receipt)
-        return InvoiceResponse(
+        try:
+            if async_receipt:
+                return 202, await _enqueue_receipt_response(db, existing, state.receipt_worker)
+            # Si no hay recibo, generar ahora
+            t_logger.info(f"⚙ Generando recibo para invoice existente {existing.id}")
+            rendered = await state.render_pool.render(existing)
+            with stage("commit"):
+                receipt = await _insert_receipt(db, existing, rendered)
+                await db.commit()
+        except IntegrityError:
+            # Otra petición creó el recibo a la vez (índice único en receipts.invoice_id)
+            await db.rollback()
+            return 200, await _concurrent_receipt_response(db, payload.payment_hash, tenant_id)
+        return 200, InvoiceResponse(
             invoice_id=existing.id,
             status=existing.status,
             receipt_id=receipt.id,
-            receipt_url=pdf_url
+            receipt_url=public_receipt_url(receipt.pdf_url, tenant_id, receipt.id),
+            receipt_status=receipt.status
         )
 
-    # 2) Verificamos en LND que el pago esté confirmado usando gRPC
-    if not lnd.check_payment(payload.payment_hash):
+    # 2) Verificamos que el pago esté confirmado (mapa de liquidaciones o LND vía gRPC)
+    if not await state.settlement_watcher.is_settled(payload.payment_hash):
         t_logger.warning(f"Pago no confirmado para hash {payload.payment_hash}")
         raise HTTPException(status_code=400, detail="Pago no confirmado")
 
-    # 3) Creamos la nueva invoice
-    invoice = Invoice(
-        tenant_id=tenant_id,
-        payment_hash=payload.payment_hash,
-        amount_msat=payload.amount_msat,
-        description=payload.description,
-        customer_name=payload.customer_name,
-        status="paid"
+    invoice = _new_invoice(payload, tenant_id, "paid")
+
+    # 3) En modo asíncrono la invoice se inserta junto con su recibo encolado
+    #    y respondemos 202 sin esperar al PDF
+    if async_receipt:
+        invoice = await _insert_invoice(db, invoice)
+        t_logger.info(f"✔ Invoice creada con id {invoice.id}")
+        return 202, await _enqueue_receipt_response(db, invoice, state.receipt_worker)
+
+    # 4) Generamos el PDF y la firma antes de abrir la transacción de escritura
+    rendered = await state.render_pool.render(invoice)
+    t_logger.info(f"✓ PDF generado en {rendered.pdf_url}, firma={rendered.signature}")
+
+    # 5) Guardamos invoice y receipt en una sola transacción
+    with stage("commit"):
+        invoice = await _insert_invoice(db, invoice)
+        receipt = await _insert_receipt(db, invoice, rendered)
+        await db.commit()
+    t_logger.info(f"✔ Invoice {invoice.id} y receipt {receipt.id} creados")
+
+    # 6) Devolvemos la respuesta final
+    return 200, InvoiceResponse(
+        invoice_id=invoice.id,
+        status=invoice.status,
+        receipt_id=receipt.id,
+        receipt_url=public_receipt_url(receipt.pdf_url, tenant_id, receipt.id),
+        receipt_status=receipt.status
     )
-    db.add(invoice)
-    try:
-        db.commit()
-    except IntegrityError:
-        db.rollback()
-        t_logger.error(f"Violación de clave única: {payload.payment_hash}")
-        raise HTTPException(status_code=409, detail="Invoice ya existe")
-    db.refresh(invoice)
-    t_logger.info(f"✔ Invoice creada con id {invoice.id}")
 
-    # 4) Generamos el PDF y la firma
-    pdf_url, signature = generate_pdf(invoice)
-    t_logger.info(f"✓ PDF generado en {pdf_url}, firma={signature}")
 
-    # 5) Guardamos el receipt
-    receipt = Receipt(
+async def _concurrent_receipt_response(db: AsyncSession, payment_hash: str, tenant_id: str) -> InvoiceResponse:
+    """Devuelve el recibo que creó una petición concurrente para la misma invoice."""
+    existing, receipt = await _find_existing(db, payment_hash, tenant_id)
+    t_logger.info(f"↪ Recibo creado concurrentemente para invoice {existing.id}")
+    return InvoiceResponse(
+        invoice_id=existing.id,
+        status=existing.status,
+        receipt_id=receipt.id,
+        receipt_url=public_receipt_url(receipt.pdf_url, tenant_id, receipt.id),
+        receipt_status=receipt.status
+    )
+
+
+@router.post("/register", response_model=InvoiceResponse, status_code=201, tags=["Invoices"])
+async def register_invoice(
+    payload: InvoiceCreate,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    """
+    Pre-registra una invoice todavía no pagada (`pending`). Con el modo push
+    activo, el recibo se genera en cuanto LND notifica la liquidación, y el
+    POST /invoices posterior sólo lee de la DB.
+    """
+    invoice, created = await _register_invoice(db, payload, tenant_id)
+    if not created:
+        response.status_code = 200
+    t_logger.info(f"📝 Invoice {invoice.id} registrada en estado {invoice.status}")
+    return InvoiceResponse(invoice_id=invoice.id, status=invoice.status)
+
+
+async def _enqueue_receipt_response(db: AsyncSession, invoice: Invoice, worker: ReceiptWorker) -> InvoiceResponse:
+    """Encola la generación del recibo (con commit) y devuelve la respuesta (pending, para un 202)."""
+    receipt = enqueue_receipt(db, invoice)
+    await db.commit()
+    worker.wake()
+    t_logger.info(f"⏳ Receipt {receipt.id} encolado para invoice {invoice.id}")
+    return InvoiceResponse(
         invoice_id=invoice.id,
-        pdf_url=pdf_url,
-        signature=signature
+        status=invoice.status,
+        receipt_id=receipt.id,
+        receipt_url=None,
+        receipt_status="pending"
     )
-    db.add(receipt)
-    db.commit()
-    db.refresh(receipt)
-    t_logger.info(f"✔ Receipt creado con id {receipt.id}")
 
-    # 6) Devolvemos la respuesta final
+
+async def _requeue_receipt_response(db: AsyncSession, invoice: Invoice, receipt: Receipt,
+                                    worker: ReceiptWorker) -> InvoiceResponse:
+    """Reencola un recibo fallido (con commit) y devuelve la respuesta (pending, para un 202)."""
+    await requeue_failed_receipt(db, receipt)
+    await db.commit()
+    worker.wake()
+    t_logger.info(f"↻ Receipt fallido {receipt.id} reencolado para invoice {invoice.id}")
     return InvoiceResponse(
         invoice_id=invoice.id,
         status=invoice.status,
         receipt_id=receipt.id,
-        receipt_url=pdf_url
+        receipt_url=None,
+        receipt_status="pending"
+    )
+
+
+async def _find_existing_batch(db: AsyncSession, payment_hashes: list[str]) -> dict[str, tuple[Invoice, Optional[Receipt]]]:
+    # Una sola consulta para todas las invoices (y recibos) ya existentes
+    with stage("db_query"):
+        rows = (await db.execute(
+            select(Invoice, Receipt)
+            .outerjoin(Receipt, Receipt.invoice_id == Invoice.id)
+            .where(Invoice.payment_hash.in_(payment_hashes))
+        )).all()
+    return {invoice.payment_hash: (invoice, receipt) for invoice, receipt in rows}
+
+
+async def _insert_batch(db: AsyncSession, invoices: list[Invoice], receipt_rows: list[dict]) -> None:
+    try:
+        with stage("commit"):
+            if invoices:
+                await db.execute(insert(Invoice), [_invoice_row(inv) for inv in invoices])
+            if receipt_rows:
+                await db.execute(insert(Receipt), receipt_rows)
+            await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        t_logger.error("Violación de clave única insertando el batch")
+        raise HTTPException(status_code=409, detail="Algunas invoices se crearon concurrentemente; reintente")
+
+
+@router.post("/batch", response_model=InvoiceBatchResponse, tags=["Invoices"])
+async def create_invoices_batch(
+    payload: InvoiceBatchCreate,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    """
+    Registra muchas invoices pagadas de una vez:
+      - deduplica contra la DB con una sola consulta IN,
+      - verifica en LND en paralelo,
+      - renderiza los PDFs en paralelo en el render pool,
+      - inserta invoices y receipts en bloque en una única transacción.
+    Devuelve un resultado por item, en el mismo orden.
+    """
+    items = payload.items
+    if len(items) > INVOICE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {INVOICE_BATCH_MAX_ITEMS} items por batch"
+        )
+    t_logger.info(f"→ create_invoices_batch con {len(items)} items")
+    state = request.app.state
+
+    results: list[InvoiceBatchItemResult] = []
+    unique: dict[str, InvoiceCreate] = {}
+    for item in items:
+        if item.payment_hash in unique:
+            results.append(InvoiceBatchItemResult(payment_hash=item.payment_hash, result="duplicate"))
+        else:
+            unique[item.payment_hash] = item
+            results.append(None)
+
+    # 1) Deduplicamos contra la DB
+    existing = await _find_existing_batch(db, list(unique))
+    await db.commit()
+
+    outcomes: dict[str, InvoiceBatchItemResult] = {}
+    to_render: list[Invoice] = []
+    new_invoices: list[Invoice] = []
+    unpaid_existing: list[str] = []
+    failed_receipts: list[Receipt] = []
+    for payment_hash, (invoice, receipt) in existing.items():
+        if invoice.tenant_id != tenant_id:
+            outcomes[payment_hash] = InvoiceBatchItemResult(
+                payment_hash=payment_hash, result="conflict", detail="Invoice ya existe"
+            )
+        elif receipt:
+            if receipt.status == "failed":
+                # Se reencola en la transacción de _insert_batch
+                failed_receipts.append(receipt)
+            outcomes[payment_hash] = InvoiceBatchItemResult(
+                payment_hash=payment_hash,
+                result="existing",
+                invoice_id=invoice.id,
+                status=invoice.status,
+                receipt_id=receipt.id,
+                receipt_url=public_receipt_url(receipt.pdf_url, tenant_id, receipt.id),
+                receipt_status="pending" if receipt.status == "failed" else receipt.status
+            )
+        elif invoice.status != "paid":
+            # Pre-registrada y sin liquidación conocida: se verifica como las nuevas
+            unpaid_existing.append(payment_hash)
+        else:
+            to_render.append(invoice)
+
+    # 2) Verificamos en LND, en paralelo, sólo los hashes nuevos o aún no pagados
+    #    (el cliente limita cuántas RPCs hay en vuelo a la vez)
+    pending = [h for h in unique if h not in existing] + unpaid_existing
+    checks = await asyncio.gather(*[state.settlement_watcher.is_settled(h) for h in pending], return_exceptions=True)
+    settled = dict(zip(pending, checks))
+
+    for payment_hash in pending:
+        if isinstance(settled[payment_hash], LndError):
+            outcomes[payment_hash] = InvoiceBatchItemResult(
+                payment_hash=payment_hash, result="error", detail=f"Error consultando LND: {settled[payment_hash]}"
+            )
+            continue
+        if isinstance(settled[payment_hash], BaseException):
+            raise settled[payment_hash]
+        if not settled[payment_hash]:
+            outcomes[payment_hash] = InvoiceBatchItemResult(
+                payment_hash=payment_hash, result="not_paid", detail="Pago no confirmado"
+            )
+            continue
+        if payment_hash in existing:
+            # El commit de _insert_batch persiste el cambio de estado
+            invoice = existing[payment_hash][0]
+            invoice.status = "paid"
+            to_render.append(invoice)
+            continue
+        invoice = _new_invoice(unique[payment_hash], tenant_id, "paid")
+        new_invoices.append(invoice)
+        to_render.append(invoice)
+
+    # 3) Renderizamos todos los PDFs en paralelo
+    rendered = await state.render_pool.map(render_receipt, [receipt_data(inv) for inv in to_render])
+
+    # 4) Insertamos invoices y receipts en bloque, en una sola transacción
+    receipt_rows = []
+    for invoice, outcome in zip(to_render, rendered):
+        if isinstance(outcome, BaseException):
+            t_logger.error(f"Error generando PDF para {invoice.payment_hash}: {outcome!r}")
+            outcomes[invoice.payment_hash] = InvoiceBatchItemResult(
+                payment_hash=invoice.payment_hash,
+                result="error",
+                invoice_id=invoice.id,
+                status=invoice.status,
+                detail="No se pudo generar el recibo"
+            )
+            continue
+        receipt_row = {
+            "id": gen_id(),
+            "invoice_id": invoice.id,
+            "pdf_url": outcome.pdf_url,
+            "signature": outcome.signature,
+            "signed_payload": outcome.signed_payload,
+            "status": "ready"
+        }
+        receipt_rows.append(receipt_row)
+        outcomes[invoice.payment_hash] = InvoiceBatchItemResult(
+            payment_hash=invoice.payment_hash,
+            result="existing" if invoice.payment_hash in existing else "created",
+            invoice_id=invoice.id,
+            status=invoice.status,
+            receipt_id=receipt_row["id"],
+            receipt_url=public_receipt_url(outcome.pdf_url, tenant_id, receipt_row["id"]),
+            receipt_status="ready"
+        )
+
+    for receipt in failed_receipts:
+        await requeue_failed_receipt(db, receipt)
+    await _insert_batch(db, new_invoices, receipt_rows)
+    if failed_receipts:
+        state.receipt_worker.wake()
+
+    t_logger.info(f"✔ Batch procesado: {len(new_invoices)} invoices y {len(receipt_rows)} receipts nuevos")
+    return InvoiceBatchResponse(results=[
+        result or outcomes[item.payment_hash]
+        for item, result in zip(items, results)
+    ])
+
+
+# --- Listado ---
+
+def parse_cursor(cursor: Optional[str]) -> Optional[tuple[datetime, str]]:
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def apply_invoice_filters(
+    stmt: Select,
+    min_amount_msat: Optional[int] = None,
+    max_amount_msat: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> Select:
+    """Filtros por importe y fecha de creación de la invoice (`to` exclusivo)."""
+    if min_amount_msat is not None:
+        stmt = stmt.where(Invoice.amount_msat >= min_amount_msat)
+    if max_amount_msat is not None:
+        stmt = stmt.where(Invoice.amount_msat <= max_amount_msat)
+    if date_from:
+        stmt = stmt.where(Invoice.created_at >= date_from)
+    if date_to:
+        stmt = stmt.where(Invoice.created_at < date_to)
+    return stmt
+
+
+def invoice_page_stmt(
+    tenant_id: str,
+    after: Optional[tuple[datetime, str]],
+    limit: int,
+    status: Optional[str] = None,
+    **filters,
+) -> Select:
+    """
+    Página de invoices del tenant en orden (created_at, id), con su recibo
+    cargado en una segunda consulta IN (selectinload): dos consultas por
+    página sea cual sea su tamaño, y el mismo coste en la página 1 que en la 10.000.
+    """
+    stmt = (
+        select(Invoice)
+        .where(Invoice.tenant_id == tenant_id)
+        .options(selectinload(Invoice.receipt))
+    )
+    if status:
+        stmt = stmt.where(Invoice.status == status)
+    stmt = apply_invoice_filters(stmt, **filters)
+    return keyset_page(stmt, [Invoice.created_at, Invoice.id], after, limit)
+
+
+def _receipt_summary(receipt: Optional[Receipt], tenant_id: str) -> Optional[ReceiptSummary]:
+    if not receipt:
+        return None
+    return ReceiptSummary(
+        receipt_id=receipt.id,
+        status=receipt.status,
+        receipt_url=public_receipt_url(receipt.pdf_url, tenant_id, receipt.id),
+        signature=receipt.signature,
+        generated_at=receipt.generated_at
     )
+
+
+@router.get("/", response_model=InvoicePage, tags=["Invoices"])
+async def list_invoices(
+    cursor: Optional[str] = None,
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    status: Optional[str] = None,
+    min_amount_msat: Optional[int] = Query(None, ge=0),
+    max_amount_msat: Optional[int] = Query(None, ge=0),
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_async_db),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    """
+    Lista las invoices del tenant, de la más antigua a la más reciente.
+    Paginación por cursor: `next_cursor` se pasa tal cual en `cursor` para
+    pedir la página siguiente (los filtros deben repetirse).
+    """
+    stmt = invoice_page_stmt(
+        tenant_id, parse_cursor(cursor), limit,
+        status=status,
+        min_amount_msat=min_amount_msat,
+        max_amount_msat=max_amount_msat,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    invoices = list((await db.execute(stmt)).scalars())
+    invoices, next_cursor = split_page(invoices, limit, key=lambda inv: (inv.created_at, inv.id))
+    return InvoicePage(
+        items=[
+            InvoiceListItem(
+                invoice_id=inv.id,
+                payment_hash=inv.payment_hash,
+                amount_msat=inv.amount_msat,
+                description=inv.description,
+                customer_name=inv.customer_name,
+                status=inv.status,
+                created_at=inv.created_at,
+                receipt=_receipt_summary(inv.receipt, tenant_id)
+            )
+            for inv in invoices
+        ],
+        next_cursor=next_cursor
+    )
+
+
+# --- Export ---
+
+def _export_row(invoice: Invoice, receipt: Optional[Receipt]) -> dict:
+    return {
+        "invoice_id": invoice.id,
+        "payment_hash": invoice.payment_hash,
+        "amount_msat": invoice.amount_msat,
+        "description": invoice.description,
+        "customer_name": invoice.customer_name,
+        "status": invoice.status,
+        "created_at": invoice.created_at.isoformat() if invoice.created_at else None,
+        "receipt_id": receipt.id if receipt else None,
+        "receipt_status": receipt.status if receipt else None,
+        "receipt_url": public_receipt_url(receipt.pdf_url, invoice.tenant_id, receipt.id) if receipt else None,
+        "signature": receipt.signature if receipt else None,
+        "generated_at": receipt.generated_at.isoformat() if receipt and receipt.generated_at else None,
+    }
+
+
+async def _export_rows(tenant_id: str, date_from: Optional[datetime], date_to: Optional[datetime]) -> AsyncIterator[dict]:
+    stmt = (
+        select(Invoice, Receipt)
+        .outerjoin(Receipt, Receipt.invoice_id == Invoice.id)
+        .where(Invoice.tenant_id == tenant_id)
+    )
+    stmt = apply_invoice_filters(stmt, date_from=date_from, date_to=date_to)
+    rows = keyset_stream(
+        stmt,
+        order_by=[Invoice.created_at, Invoice.id],
+        key=lambda row: (row.Invoice.created_at, row.Invoice.id),
+        page_size=EXPORT_PAGE_SIZE,
+        yield_per=EXPORT_YIELD_PER,
+    )
+    async for row in rows:
+        yield _export_row(row.Invoice, row.Receipt)
+
+
+@router.get("/export", tags=["Invoices"])
+async def export_invoices(
+    request: Request,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    """
+    Exporta las invoices del tenant (con su recibo, si lo tienen) en NDJSON o
+    CSV, ordenadas por (created_at, id). `from` es inclusivo y `to` exclusivo.
+    Se envía en streaming: las filas se leen por páginas keyset con un cursor
+    de servidor, así que la memoria no depende del tamaño del tenant. Con
+    `Accept-Encoding: gzip` la respuesta se comprime sobre la marcha.
+    """
+    t_logger.info(f"→ export_invoices tenant={tenant_id} from={date_from} to={date_to} format={format}")
+    rows = _export_rows(tenant_id, date_from, date_to)
+    if format == "csv":
+        body, media_type = csv_lines(rows, EXPORT_COLUMNS), "text/csv; charset=utf-8"
+    else:
+        body, media_type = ndjson_lines(rows), "application/x-ndjson"
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="invoices.{format}"',
+        "Vary": "Accept-Encoding",
+    }
+    if accepts_gzip(request.headers.get("accept-encoding", "")):
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
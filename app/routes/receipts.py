@@ -1,36 +1,396 @@
 # app/routes/receipts.py
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from fastapi.responses import FileResponse
+import asyncio
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from app.core.auth import get_current_tenant
-from app.core.db import get_db
-from app.models import Receipt, Invoice
+from app.core.bundles import (
+    BUNDLE_MAX_ITEMS,
+    BUNDLE_SYNC_MAX_ITEMS,
+    build_bundle,
+    load_bundle_items,
+    zip_chunks,
+    zip_entries,
+)
+from app.core.db import get_async_db
+from app.core.pagination import keyset_page, split_page
+from app.core.signed_urls import public_receipt_url, sign_download_url, signing_enabled
+from app.core.signing import RECEIPT_VERIFY_CHUNK, get_receipt_signer, payload_text, verify_chunk
+from app.core.storage import (
+    InvalidRange, ReceiptNotStored, get_receipt_store, is_legacy_path, key_digest, media_type,
+)
+from app.models import BundleJob, Receipt, Invoice, gen_id
+from app.routes.invoices import LIST_DEFAULT_LIMIT, LIST_MAX_LIMIT, apply_invoice_filters, parse_cursor
+from app.schemas import (
+    BundleStatusResponse,
+    PublicKeyResponse,
+    ReceiptBundleRequest,
+    ReceiptListItem,
+    ReceiptPage,
+    ReceiptStatusResponse,
+    ReceiptVerifyRequest,
+    ReceiptVerifyResponse,
+    ReceiptVerifyResult,
+)
 
 router = APIRouter()
 
+# Un recibo generado no cambia nunca: se puede cachear indefinidamente
+RECEIPT_CACHE_CONTROL = os.getenv("RECEIPT_CACHE_CONTROL", "private, max-age=31536000, immutable")
+# Máximo de pares (payload, firma) por POST /receipts/verify
+RECEIPT_VERIFY_MAX_ITEMS = int(os.getenv("RECEIPT_VERIFY_MAX_ITEMS", "10000"))
+
+
+async def _get_tenant_receipt(db: AsyncSession, receipt_id: str, tenant_id: str) -> Receipt:
+    # Buscamos el recibo asegurando que el invoice asociado pertenece al tenant
+    receipt = (await db.execute(
+        select(Receipt)
+        .join(Invoice, Invoice.id == Receipt.invoice_id)
+        .where(Receipt.id == receipt_id,
+               Invoice.tenant_id == tenant_id)
+    )).scalars().first()
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return receipt
+
+
+def _receipt_etag(receipt: Receipt) -> str:
+    """ETag fuerte: el hash del contenido (o la firma en recibos antiguos)."""
+    if is_legacy_path(receipt.pdf_url):
+        return f'"{receipt.id}-{receipt.signature}"'
+    return f'"{key_digest(receipt.pdf_url)}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def receipt_page_stmt(
+    tenant_id: str,
+    after: Optional[tuple[datetime, str]],
+    limit: int,
+    status: Optional[str] = None,
+    **filters,
+) -> Select:
+    """
+    Página de recibos del tenant en el orden de sus invoices (created_at, id),
+    que es la clave del índice por tenant. La invoice se carga en la misma
+    consulta (JOIN + contains_eager).
+    """
+    stmt = (
+        select(Receipt)
+        .join(Receipt.invoice)
+        .options(contains_eager(Receipt.invoice))
+        .where(Invoice.tenant_id == tenant_id)
+    )
+    if status:
+        stmt = stmt.where(Receipt.status == status)
+    stmt = apply_invoice_filters(stmt, **filters)
+    return keyset_page(stmt, [Invoice.created_at, Invoice.id], after, limit)
+
+
+# Las rutas fijas van antes que /{receipt_id} para que no las capture
+
+@router.get("/", response_model=ReceiptPage, tags=["Receipts"])
+async def list_receipts(
+    cursor: Optional[str] = None,
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    status: Optional[str] = None,
+    min_amount_msat: Optional[int] = Query(None, ge=0),
+    max_amount_msat: Optional[int] = Query(None, ge=0),
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_async_db),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    """
+    Lista los recibos del tenant en el orden de sus invoices (created_at, id).
+    Filtros de importe y fecha sobre la invoice; `status` es el del recibo.
+    """
+    stmt = receipt_page_stmt(
+        tenant_id, parse_cursor(cursor), limit,
+        status=status,
+        min_amount_msat=min_amount_msat,
+        max_amount_msat=max_amount_msat,
+        date_from=date_from,
+        date_to=date_to,
+    )
+
+    receipts = list((await db.execute(stmt)).scalars())
+    receipts, next_cursor = split_page(receipts, limit, key=lambda r: (r.invoice.created_at, r.invoice.id))
+    return ReceiptPage(
+        items=[
+            ReceiptListItem(
+                receipt_id=r.id,
+                status=r.status,
+                receipt_url=public_receipt_url(r.pdf_url, tenant_id, r.id),
+                signature=r.signature,
+                generated_at=r.generated_at,
+                invoice_id=r.invoice.id,
+                payment_hash=r.invoice.payment_hash,
+                amount_msat=r.invoice.amount_msat,
+                invoice_created_at=r.invoice.created_at
+            )
+            for r in receipts
+        ],
+        next_cursor=next_cursor
+    )
+
+
+def _bundle_status(job: BundleJob) -> BundleStatusResponse:
+    status_url = f"/receipts/bundles/{job.id}"
+    download_url = None
+    if job.status == "ready":
+        download_url = (
+            sign_download_url(job.result_key, job.tenant_id, job.id)
+            if signing_enabled() else f"{status_url}/file"
+        )
+    return BundleStatusResponse(
+        bundle_id=job.id,
+        status=job.status,
+        format=job.format,
+        item_count=job.item_count,
+        status_url=status_url,
+        download_url=download_url,
+        error=job.error
+    )
+
+
+async def _get_tenant_bundle(db: AsyncSession, bundle_id: str, tenant_id: str) -> BundleJob:
+    job = (await db.execute(
+        select(BundleJob).where(BundleJob.id == bundle_id, BundleJob.tenant_id == tenant_id)
+    )).scalars().first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Bundle not found")
+    return job
+
+
+@router.post("/bundle", tags=["Receipts"])
+async def create_bundle(
+    payload: ReceiptBundleRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    """
+    Agrupa recibos del tenant (por ids o por rango de fechas) en un único PDF
+    (extracto multipágina renderizado en una sola pasada) o en un ZIP con los
+    PDFs ya generados.
+      - Hasta BUNDLE_SYNC_MAX_ITEMS recibos: se devuelve el fichero directamente
+        (el ZIP en streaming, sin cargar los PDFs en memoria).
+      - Más: se genera en segundo plano y se responde 202 con la URL de estado.
+    """
+    items = await load_bundle_items(db, tenant_id, payload.receipt_ids, payload.date_from, payload.date_to)
+    await db.commit()
+    if not items:
+        raise HTTPException(status_code=404, detail="No hay recibos generados para esa selección")
+    if len(items) > BUNDLE_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BUNDLE_MAX_ITEMS} recibos por bundle")
+
+    if len(items) <= BUNDLE_SYNC_MAX_ITEMS:
+        if payload.format == "zip":
+            return StreamingResponse(
+                zip_chunks(zip_entries(items)),
+                media_type="application/zip",
+                headers={"Content-Disposition": 'attachment; filename="receipts.zip"'}
+            )
+        key = await build_bundle(request.app.state.render_pool, "pdf", items, payload.date_from, payload.date_to)
+        return await receipt_file_response(
+            request, key, "statement.pdf", f'"{key_digest(key)}"', RECEIPT_CACHE_CONTROL
+        )
+
+    job = BundleJob(
+        id=gen_id(),
+        tenant_id=tenant_id,
+        format=payload.format,
+        receipt_ids=json.dumps(payload.receipt_ids) if payload.receipt_ids is not None else None,
+        date_from=payload.date_from,
+        date_to=payload.date_to,
+        status="pending",
+        item_count=len(items)
+    )
+    db.add(job)
+    await db.commit()
+    request.app.state.bundle_runner.submit(job.id)
+    status = _bundle_status(job)
+    return JSONResponse(
+        status_code=202,
+        content=status.model_dump(mode="json"),
+        headers={"Location": status.status_url}
+    )
+
+
+@router.get("/bundles/{bundle_id}", response_model=BundleStatusResponse, tags=["Receipts"])
+async def get_bundle_status(
+    bundle_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    """Estado de un bundle en segundo plano y, cuando está listo, su URL de descarga."""
+    return _bundle_status(await _get_tenant_bundle(db, bundle_id, tenant_id))
+
+
+@router.get("/bundles/{bundle_id}/file", response_class=FileResponse, tags=["Receipts"])
+async def get_bundle_file(
+    bundle_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    job = await _get_tenant_bundle(db, bundle_id, tenant_id)
+    if job.status != "ready":
+        return JSONResponse(
+            status_code=409 if job.status == "failed" else 202,
+            content=_bundle_status(job).model_dump(mode="json"),
+        )
+    return await receipt_file_response(
+        request, job.result_key, f"{job.id}{'.zip' if job.format == 'zip' else '.pdf'}",
+        f'"{key_digest(job.result_key)}"', RECEIPT_CACHE_CONTROL
+    )
+
+
+@router.get("/public-key", response_model=PublicKeyResponse, tags=["Receipts"])
+def get_public_key():
+    """Clave pública Ed25519 con la que se firman los recibos."""
+    signer = get_receipt_signer()
+    return PublicKeyResponse(
+        algorithm="Ed25519",
+        kid=signer.kid,
+        public_key=base64.urlsafe_b64encode(signer.public_bytes).rstrip(b"=").decode(),
+        pem=signer.public_key_pem()
+    )
+
+
+@router.post("/verify", response_model=ReceiptVerifyResponse, tags=["Receipts"])
+async def verify_receipts(payload: ReceiptVerifyRequest):
+    """
+    Verifica en bloque pares (payload firmado, firma). Los pares se reparten en
+    trozos de RECEIPT_VERIFY_CHUNK que se verifican en paralelo en el
+    threadpool: verificar Ed25519 es barato y `cryptography` suelta el GIL, así
+    que no compite con los PDFs por la capacidad del render pool.
+    Devuelve un resultado por par, en el mismo orden.
+    """
+    items = payload.items
+    if len(items) > RECEIPT_VERIFY_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {RECEIPT_VERIFY_MAX_ITEMS} firmas por petición"
+        )
+    pairs = [(payload_text(item.payload), item.signature) for item in items]
+    chunks = [
+        (get_receipt_signer().public_bytes, pairs[i:i + RECEIPT_VERIFY_CHUNK])
+        for i in range(0, len(pairs), RECEIPT_VERIFY_CHUNK)
+    ]
+    outcomes = await asyncio.gather(*[run_in_threadpool(verify_chunk, chunk) for chunk in chunks])
+
+    results = [
+        ReceiptVerifyResult(valid=error is None, error=error)
+        for chunk in outcomes for error in chunk
+    ]
+    valid = sum(result.valid for result in results)
+    return ReceiptVerifyResponse(valid=valid, invalid=len(results) - valid, results=results)
+
+
+@router.get("/{receipt_id}/status", response_model=ReceiptStatusResponse, tags=["Receipts"])
+async def get_receipt_status(
+    receipt_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    tenant_id: str = Depends(get_current_tenant)
+):
+    """
+    Estado de generación de un recibo: pending, ready o failed, con su firma
+    y el payload firmado una vez generado.
+    """
+    receipt = await _get_tenant_receipt(db, receipt_id, tenant_id)
+    return ReceiptStatusResponse(
+        receipt_id=receipt.id,
+        status=receipt.status,
+        signature=receipt.signature,
+        signed_payload=receipt.signed_payload
+    )
+
+
 @router.get("/{receipt_id}", response_class=FileResponse, tags=["Receipts"])
-def get_receipt(
+async def get_receipt(
     receipt_id: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     tenant_id: str = Depends(get_current_tenant)
 ):
     """
     Devuelve el PDF de un recibo sólo si pertenece al tenant autenticado.
+    Si el recibo aún se está generando responde 202 con su estado (409 si falló;
+    repetir el POST /invoices de su payment_hash lo vuelve a encolar).
     """
-    # Buscamos el recibo asegurando que el invoice asociado pertenece al tenant
-    receipt = (
-        db.query(Receipt)
-          .join(Invoice, Invoice.id == Receipt.invoice_id)
-          .filter(Receipt.id == receipt_id,
-                  Invoice.tenant_id == tenant_id)
-          .first()
+    receipt = await _get_tenant_receipt(db, receipt_id, tenant_id)
+    if receipt.status != "ready":
+        return JSONResponse(
+            status_code=202 if receipt.status == "pending" else 409,
+            content={"receipt_id": receipt.id, "status": receipt.status},
+        )
+
+    return await receipt_file_response(
+        request, receipt.pdf_url, f"{receipt.id}.pdf", _receipt_etag(receipt), RECEIPT_CACHE_CONTROL
     )
-    if not receipt:
-        raise HTTPException(status_code=404, detail="Receipt not found")
 
-    return FileResponse(
-        path=receipt.pdf_url,
-        media_type="application/pdf",
-        filename=f"{receipt.id}.pdf"
+
+async def receipt_file_response(request: Request, pdf_url: str, filename: str, etag: str, cache_control: str):
+    """
+    Respuesta con el PDF de un recibo (o un bundle), sea cual sea el almacenamiento.
+    La usan GET /receipts/{id}, los bundles y las descargas firmadas de /downloads.
+    """
+    # Revalidación: si el cliente ya tiene esta versión no se toca el almacenamiento
+    cache_headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    # Recibos antiguos: pdf_url es una ruta del host
+    # (FileResponse ya resuelve Range e If-Range)
+    if is_legacy_path(pdf_url):
+        return FileResponse(path=pdf_url, media_type="application/pdf", filename=filename, headers=cache_headers)
+
+    # Driver local: se sirve el fichero directamente
+    path = get_receipt_store().local_path(pdf_url)
+    if path is not None:
+        return FileResponse(path=path, media_type=media_type(pdf_url), filename=filename, headers=cache_headers)
+
+    # Driver remoto (S3/MinIO): se retransmite el objeto (o el tramo pedido) en trozos
+    byte_range = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        byte_range = None
+    try:
+        obj = await run_in_threadpool(get_receipt_store().open, pdf_url, byte_range)
+    except ReceiptNotStored:
+        raise HTTPException(status_code=404, detail="Receipt file not found")
+    except InvalidRange as exc:
+        headers = {"Content-Range": f"bytes */{exc.size}"} if exc.size is not None else None
+        return Response(status_code=416, headers=headers)
+
+    headers = {
+        **cache_headers,
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(obj.length),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+    if obj.content_range:
+        headers["Content-Range"] = obj.content_range
+    return StreamingResponse(
+        obj.chunks,
+        status_code=206 if obj.content_range else 200,
+        media_type=media_type(pdf_url),
+        headers=headers
     )
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Literal, Optional, Union
 from datetime import datetime
 
 class InvoiceCreate(BaseModel):
@@ -13,3 +13,110 @@ class InvoiceResponse(BaseModel):
     status: str
     receipt_id: Optional[str] = None
     receipt_url: Optional[str] = None
+    receipt_status: Optional[str] = None  # pending, ready, failed
+
+class InvoiceBatchCreate(BaseModel):
+    items: list[InvoiceCreate] = Field(..., min_length=1)
+
+class InvoiceBatchItemResult(BaseModel):
+    payment_hash: str
+    result: str  # created, existing, not_paid, duplicate, conflict, error
+    invoice_id: Optional[str] = None
+    status: Optional[str] = None
+    receipt_id: Optional[str] = None
+    receipt_url: Optional[str] = None
+    receipt_status: Optional[str] = None
+    detail: Optional[str] = None
+
+class InvoiceBatchResponse(BaseModel):
+    results: list[InvoiceBatchItemResult]
+
+class ReceiptStatusResponse(BaseModel):
+    receipt_id: str
+    status: str  # pending, ready, failed
+    signature: Optional[str] = None
+    signed_payload: Optional[str] = None
+
+class ReceiptVerifyItem(BaseModel):
+    payload: Union[str, dict]  # el JSON firmado, como texto exacto u objeto
+    signature: str
+
+class ReceiptVerifyRequest(BaseModel):
+    items: list[ReceiptVerifyItem] = Field(..., min_length=1)
+
+class ReceiptVerifyResult(BaseModel):
+    valid: bool
+    error: Optional[str] = None  # bad_signature, unknown_key, malformed
+
+class ReceiptVerifyResponse(BaseModel):
+    valid: int
+    invalid: int
+    results: list[ReceiptVerifyResult]
+
+class PublicKeyResponse(BaseModel):
+    algorithm: str
+    kid: str
+    public_key: str  # clave pública en bruto, base64url
+    pem: str
+
+class ReceiptSummary(BaseModel):
+    receipt_id: str
+    status: str
+    receipt_url: Optional[str] = None
+    signature: Optional[str] = None
+    generated_at: Optional[datetime] = None
+
+class InvoiceListItem(BaseModel):
+    invoice_id: str
+    payment_hash: str
+    amount_msat: int
+    description: Optional[str] = None
+    customer_name: Optional[str] = None
+    status: str
+    created_at: datetime
+    receipt: Optional[ReceiptSummary] = None
+
+class InvoicePage(BaseModel):
+    items: list[InvoiceListItem]
+    next_cursor: Optional[str] = None  # None en la última página
+
+class ReceiptListItem(ReceiptSummary):
+    invoice_id: str
+    payment_hash: str
+    amount_msat: int
+    invoice_created_at: datetime
+
+class ReceiptPage(BaseModel):
+    items: list[ReceiptListItem]
+    next_cursor: Optional[str] = None
+
+class ReceiptBundleRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    receipt_ids: Optional[list[str]] = Field(None, min_length=1)
+    date_from: Optional[datetime] = Field(None, alias="from")  # fecha de la invoice, inclusiva
+    date_to: Optional[datetime] = Field(None, alias="to")      # exclusiva
+    format: Literal["pdf", "zip"] = "pdf"
+
+    @model_validator(mode="after")
+    def _needs_selection(self):
+        if self.receipt_ids is None and self.date_from is None and self.date_to is None:
+            raise ValueError("Indique receipt_ids o un rango de fechas (from/to)")
+        return self
+
+class BundleStatusResponse(BaseModel):
+    bundle_id: str
+    status: str  # pending, running, ready, failed
+    format: str
+    item_count: int
+    status_url: str
+    download_url: Optional[str] = None
+    error: Optional[str] = None
+
+class APIKeyRevokeRequest(BaseModel):
+    api_key: str = Field(min_length=1)
+
+class APIKeyRevokeResponse(BaseModel):
+    revoked: bool
+    # Segundos que la key puede seguir aceptándose en otros workers (TTL de su caché)
+    revocation_window: float
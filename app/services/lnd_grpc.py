@@ -1,18 +1,27 @@
+import asyncio
+import logging
 import os
+import random
+import grpc
+from typing import Optional
+from grpc import aio
 from dotenv import load_dotenv
-from lndgrpc import LNDClient
+from app.core.circuit_breaker import CircuitBreaker, CircuitOpen
+from app.core.metrics import LND_CIRCUIT_STATE, LND_ERRORS, LND_HEDGES, LND_RETRIES_TOTAL, current_plan
 
 load_dotenv()
 
-macaroon_filepath = os.getenv("LND_MACAROON_PATH")
-cert_filepath = os.getenv("LND_TLS_CERT_PATH")
-grpc_host = os.getenv("LND_GRPC_HOST")
+logger = logging.getLogger(__name__)
 
-if not all([macaroon_filepath, cert_filepath, grpc_host]):
-    raise RuntimeError("Faltan variables de entorno requeridas")
+# Canal sin TLS y macaroon opcional: sólo para el LND falso de benchmarks/
+LND_GRPC_INSECURE = os.getenv("LND_GRPC_INSECURE", "false").lower() in ("1", "true", "yes")
+
+# lndgrpc (y sus descriptores protobuf) se importa al conectar, no al importar
+# este módulo: la API y los tests arrancan sin LND configurado.
 
 class LndGrpcClient:
     def __init__(self, ip_address=None, network=None, macaroon_path=None, cert_path=None):
+        from lndgrpc import LNDClient
         self.client = LNDClient(
             ip_address=ip_address or os.getenv("LND_GRPC_HOST", "127.0.0.1:10009"),
             network=network or os.getenv("LND_NETWORK", "regtest"),
@@ -37,9 +46,346 @@ class LndGrpcClient:
         }
 
     def check_payment(self, payment_hash_hex: str) -> bool:
+        """False si la invoice no está liquidada o LND no la conoce; si LND falla, lanza LndError."""
         try:
             invoice = self.client.lookup_invoice(r_hash_str=payment_hash_hex)
             return invoice.settled
-        except Exception as e:
-            print(f"[❌] Error al verificar invoice: {e}")
+        except grpc.RpcError as e:
+            error = _translate_rpc_error(e)
+            if isinstance(error, InvoiceNotFound):
+                return False
+            logger.warning(f"Error al verificar invoice {payment_hash_hex}: {e}")
+            raise error from None
+
+
+# ---------------------------------------------------------------------------
+# Cliente asíncrono (grpc.aio) para usar desde las rutas sin bloquear el loop
+# ---------------------------------------------------------------------------
+
+# RPCs simultáneas contra LND por proceso
+LND_MAX_INFLIGHT = int(os.getenv("LND_MAX_INFLIGHT", "32"))
+# Deadline por llamada, en segundos (en LookupInvoice, el total incluidos reintentos y hedging)
+LND_RPC_TIMEOUT = float(os.getenv("LND_RPC_TIMEOUT", "5"))
+# Retry-After sugerido cuando LND no está disponible
+LND_RETRY_AFTER = int(os.getenv("LND_RETRY_AFTER", "5"))
+
+# Circuit breaker por nodo: fallos seguidos que lo abren y segundos hasta la sonda
+LND_BREAKER_FAILURES = int(os.getenv("LND_BREAKER_FAILURES", "5"))
+LND_BREAKER_RESET = float(os.getenv("LND_BREAKER_RESET", "10"))
+LND_BREAKER_HALF_OPEN_CALLS = int(os.getenv("LND_BREAKER_HALF_OPEN_CALLS", "1"))
+
+# Reintentos de LookupInvoice ante errores transitorios (backoff exponencial con jitter)
+LND_RETRIES = int(os.getenv("LND_RETRIES", "2"))
+LND_RETRY_BACKOFF = float(os.getenv("LND_RETRY_BACKOFF", "0.05"))
+LND_RETRY_MAX_BACKOFF = float(os.getenv("LND_RETRY_MAX_BACKOFF", "1.0"))
+
+# Nodo secundario para hedging: réplica que conoce las invoices del primario
+# (no el lnd2 pagador del docker-compose). Sin host, no hay hedging.
+LND_SECONDARY_GRPC_HOST = os.getenv("LND_SECONDARY_GRPC_HOST")
+LND_SECONDARY_MACAROON_PATH = os.getenv("LND_SECONDARY_MACAROON_PATH")
+LND_SECONDARY_TLS_CERT_PATH = os.getenv("LND_SECONDARY_TLS_CERT_PATH")
+# Segundos de espera al primario antes de duplicar la consulta en el secundario
+LND_HEDGE_DELAY = float(os.getenv("LND_HEDGE_DELAY", "0.2"))
+
+
+class LndError(Exception):
+    """Error genérico devuelto por LND."""
+
+
+class LndUnavailable(LndError):
+    """LND no es alcanzable o no respondió dentro del deadline."""
+
+    def __init__(self, message: str = "", retry_after: float = LND_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LndCircuitOpen(LndUnavailable):
+    """El circuit breaker del nodo está abierto: ni se intenta la llamada."""
+
+
+class InvoiceNotFound(LndError):
+    """LND no conoce la invoice (o el hash no es válido)."""
+
+
+_UNAVAILABLE_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.CANCELLED,
+}
+
+
+def _translate_rpc_error(exc: aio.AioRpcError) -> LndError:
+    code = exc.code()
+    if code in _UNAVAILABLE_CODES:
+        return LndUnavailable(f"{code.name}: {exc.details()}")
+    if code in (grpc.StatusCode.NOT_FOUND, grpc.StatusCode.INVALID_ARGUMENT) \
+            or "unable to locate invoice" in (exc.details() or ""):
+        return InvoiceNotFound(exc.details())
+    return LndError(f"{code.name}: {exc.details()}")
+
+
+_CIRCUIT_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+class AsyncLndClient:
+    """
+    Cliente LND nativo de asyncio sobre un único canal grpc.aio de larga duración.
+    Las credenciales (macaroon y TLS) se leen una sola vez, al primer uso, y el
+    nº de RPCs en vuelo está limitado por un semáforo. Las RPCs unarias pasan
+    por el circuit breaker del nodo: con LND caído fallan al instante.
+    """
+
+    def __init__(self, host=None, macaroon_path=None, cert_path=None,
+                 max_inflight: int = LND_MAX_INFLIGHT, timeout: float = LND_RPC_TIMEOUT,
+                 insecure: bool = LND_GRPC_INSECURE, name: str = "primary"):
+        self.host = host or os.getenv("LND_GRPC_HOST", "127.0.0.1:10009")
+        self.macaroon_path = macaroon_path or os.getenv("LND_MACAROON_PATH")
+        self.cert_path = cert_path or os.getenv("LND_TLS_CERT_PATH")
+        self.timeout = timeout
+        self.insecure = insecure
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=LND_BREAKER_FAILURES,
+            reset_timeout=LND_BREAKER_RESET,
+            half_open_max=LND_BREAKER_HALF_OPEN_CALLS,
+            on_change=self._on_circuit_change,
+        )
+        LND_CIRCUIT_STATE.labels(name).set(0)
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._channel = None
+        self._stub = None
+        self._metadata = None
+
+    def _connect(self) -> None:
+        from lndgrpc.common import get_cert, get_macaroon, lnrpc
+        if not self.insecure and not (self.macaroon_path and self.cert_path):
+            raise RuntimeError("Faltan variables de entorno requeridas (LND_MACAROON_PATH, LND_TLS_CERT_PATH)")
+        options = [
+            ("grpc.keepalive_time_ms", 30000),
+            ("grpc.keepalive_permit_without_calls", 1),
+        ]
+        if self.insecure:
+            if self.macaroon_path:
+                self._metadata = (("macaroon", get_macaroon(filepath=self.macaroon_path)),)
+            self._channel = aio.insecure_channel(self.host, options=options)
+        else:
+            credentials = grpc.ssl_channel_credentials(get_cert(self.cert_path))
+            self._metadata = (("macaroon", get_macaroon(filepath=self.macaroon_path)),)
+            self._channel = aio.secure_channel(self.host, credentials, options=options)
+        self._stub = lnrpc.LightningStub(self._channel)
+
+    @property
+    def stub(self):
+        if self._stub is None:
+            self._connect()
+        return self._stub
+
+    def _on_circuit_change(self, state: str) -> None:
+        LND_CIRCUIT_STATE.labels(self.name).set(_CIRCUIT_STATES[state])
+        log = logger.info if state == CircuitBreaker.CLOSED else logger.warning
+        log(f"Circuit breaker de LND {self.name} ({self.host}): {state}")
+
+    async def _call(self, method_name: str, request, timeout: float = None, count_failure: bool = True):
+        """
+        RPC unaria a través del circuit breaker. Con `count_failure=False` (un
+        intento que el llamador va a reintentar) no responder no cuenta como
+        fallo del nodo: así cada llamada lógica suma como mucho un fallo.
+        """
+        # Antes de before_call(): si conectar falla (credenciales, lndgrpc), la
+        # llamada no llega a ocupar una sonda del circuito semiabierto
+        method = getattr(self.stub, method_name)
+        try:
+            self.breaker.before_call()
+        except CircuitOpen as exc:
+            LND_ERRORS.labels(method_name, "LndCircuitOpen", current_plan.get()).inc()
+            raise LndCircuitOpen(f"LND {self.name} no disponible (circuito abierto)", exc.retry_after) from None
+        try:
+            async with self._semaphore:
+                result = await method(request, metadata=self._metadata, timeout=timeout or self.timeout)
+        except aio.AioRpcError as exc:
+            error = _translate_rpc_error(exc)
+            # Sólo cuenta como fallo del nodo no responder; un NOT_FOUND es una respuesta
+            if isinstance(error, LndUnavailable):
+                if count_failure:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release()
+            else:
+                self.breaker.record_success()
+            LND_ERRORS.labels(method_name, type(error).__name__, current_plan.get()).inc()
+            raise error from None
+        except BaseException:
+            # Cancelada (p. ej. perdió el hedging) o error local: sin veredicto sobre el nodo
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def lookup_invoice(self, r_hash_hex: str, timeout: float = None, count_failure: bool = True):
+        from lndgrpc.common import ln
+        return await self._call("LookupInvoice", ln.PaymentHash(r_hash_str=r_hash_hex), timeout, count_failure)
+
+    async def subscribe_invoices(self, add_index: int = 0, settle_index: int = 0):
+        """
+        Stream de invoices nuevas/liquidadas. Con `settle_index` > 0, LND reenvía
+        primero todas las liquidaciones posteriores a ese índice.
+        No pasa por el semáforo ni tiene deadline: es una llamada de larga duración.
+        """
+        from lndgrpc.common import ln
+        request = ln.InvoiceSubscription(add_index=add_index, settle_index=settle_index)
+        call = self.stub.SubscribeInvoices(request, metadata=self._metadata)
+        try:
+            async for invoice in call:
+                yield invoice
+        except aio.AioRpcError as exc:
+            raise _translate_rpc_error(exc) from None
+        finally:
+            call.cancel()
+
+    async def check_payment(self, payment_hash_hex: str) -> bool:
+        """
+        True si la invoice está liquidada, False si no lo está o LND no la conoce.
+        Lanza LndUnavailable / LndError si no se puede consultar.
+        """
+        try:
+            invoice = await self.lookup_invoice(payment_hash_hex)
+        except InvoiceNotFound:
+            return False
+        return invoice.settled
+
+    async def close(self) -> None:
+        if self._channel is not None:
+            await self._channel.close()
+            self._channel = None
+            self._stub = None
+
+
+def _backoff(attempt: int) -> float:
+    """Espera antes del reintento nº `attempt` (desde 0): exponencial con jitter completo."""
+    return random.uniform(0, min(LND_RETRY_BACKOFF * 2 ** attempt, LND_RETRY_MAX_BACKOFF))
+
+
+class ResilientLndClient:
+    """
+    Verificación de pagos con la latencia acotada aunque el nodo falle:
+      - cada nodo tiene su circuit breaker (AsyncLndClient),
+      - los errores transitorios se reintentan con backoff, hasta `retries` veces,
+      - si hay nodo secundario y el primario tarda más de `hedge_delay` (o falla),
+        la consulta se duplica en el secundario y gana la primera respuesta válida,
+      - todo dentro de un deadline total de `timeout` segundos.
+    Al breaker de cada nodo sólo llega el veredicto del último intento (o el
+    agotamiento del deadline): una llamada lógica suma como mucho un fallo, así
+    que LND_BREAKER_FAILURES cuenta consultas fallidas, no intentos.
+    El secundario sólo puede confirmar pagos: un "no existe" o "no liquidada"
+    suyo (réplica con retraso) no es definitivo y se sigue esperando al primario.
+    """
+
+    def __init__(self, primary: AsyncLndClient, secondary: Optional[AsyncLndClient] = None,
+                 retries: int = LND_RETRIES, hedge_delay: float = LND_HEDGE_DELAY,
+                 timeout: float = LND_RPC_TIMEOUT):
+        self.primary = primary
+        self.secondary = secondary
+        self.retries = retries
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+
+    async def lookup_invoice(self, r_hash_hex: str):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            async with asyncio.timeout_at(deadline):
+                for attempt in range(self.retries + 1):
+                    try:
+                        return await self._hedged_lookup(r_hash_hex, deadline - loop.time(), attempt == self.retries)
+                    except LndCircuitOpen:
+                        # Nodos caídos: fallar ya, sin reintentos
+                        raise
+                    except LndUnavailable:
+                        if attempt == self.retries:
+                            raise
+                    LND_RETRIES_TOTAL.labels("LookupInvoice").inc()
+                    await asyncio.sleep(_backoff(attempt))
+        except TimeoutError:
+            # El intento en vuelo se canceló sin veredicto: el fallo de la llamada se cuenta aquí
+            self.primary.breaker.record_failure()
+            raise LndUnavailable(f"LookupInvoice sin respuesta en {self.timeout:.1f}s") from None
+
+    async def _hedged_lookup(self, r_hash_hex: str, timeout: float, last: bool = True):
+        if self.secondary is None:
+            return await self.primary.lookup_invoice(r_hash_hex, timeout, count_failure=last)
+
+        primary = asyncio.create_task(self.primary.lookup_invoice(r_hash_hex, timeout, count_failure=last))
+        pending = {primary}
+        secondary = None
+        primary_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay if secondary is None else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    try:
+                        invoice = task.result()
+                    except LndUnavailable as exc:
+                        if task is primary:
+                            primary_error = exc
+                        continue
+                    except LndError:
+                        if task is primary:
+                            raise
+                        continue
+                    if task is primary or invoice.settled:
+                        if secondary is not None:
+                            LND_HEDGES.labels("primary" if task is primary else "secondary").inc()
+                        return invoice
+                # El primario tarda o ha fallado: se duplica en el secundario
+                if secondary is None:
+                    secondary = asyncio.create_task(self.secondary.lookup_invoice(r_hash_hex, timeout, count_failure=last))
+                    pending.add(secondary)
+        finally:
+            for task in pending:
+                task.cancel()
+        LND_HEDGES.labels("none").inc()
+        raise primary_error or LndUnavailable("LookupInvoice sin respuesta válida de LND")
+
+    async def check_payment(self, payment_hash_hex: str) -> bool:
+        """
+        True si la invoice está liquidada, False si no lo está o LND no la conoce.
+        Lanza LndUnavailable / LndError si no se puede consultar.
+        """
+        try:
+            invoice = await self.lookup_invoice(payment_hash_hex)
+        except InvoiceNotFound:
             return False
+        return invoice.settled
+
+    async def subscribe_invoices(self, add_index: int = 0, settle_index: int = 0):
+        # El stream (y su settle_index) es siempre el del primario
+        async for invoice in self.primary.subscribe_invoices(add_index, settle_index):
+            yield invoice
+
+    async def close(self) -> None:
+        await self.primary.close()
+        if self.secondary is not None:
+            await self.secondary.close()
+
+
+def _secondary_client() -> Optional[AsyncLndClient]:
+    if not LND_SECONDARY_GRPC_HOST:
+        return None
+    return AsyncLndClient(
+        host=LND_SECONDARY_GRPC_HOST,
+        macaroon_path=LND_SECONDARY_MACAROON_PATH,
+        cert_path=LND_SECONDARY_TLS_CERT_PATH,
+        name="secondary",
+    )
+
+
+def build_lnd_client() -> ResilientLndClient:
+    """Cliente de la API con el nodo primario y, si lo hay, el secundario. Los canales se abren en el primer uso."""
+    return ResilientLndClient(AsyncLndClient(), _secondary_client())
@@ -0,0 +1,225 @@
+# app/services/settlement.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from app.core.db import AsyncSessionLocal
+from app.core.metrics import stage
+from app.models import LndCursor
+from app.services.lnd_grpc import ResilientLndClient
+
+logger = logging.getLogger(__name__)
+
+# Activa el stream SubscribeInvoices (si no, cada verificación va a LookupInvoice)
+SETTLEMENT_WATCHER_ENABLED = os.getenv("SETTLEMENT_WATCHER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Nombre con el que se persiste el cursor del nodo
+SETTLEMENT_NODE = os.getenv("SETTLEMENT_NODE", "lnd1")
+# Nº máximo de liquidaciones recordadas en memoria
+SETTLEMENT_CACHE_SIZE = int(os.getenv("SETTLEMENT_CACHE_SIZE", "100000"))
+# Cada cuántos segundos, como mucho, se persiste el settle_index
+SETTLEMENT_CURSOR_FLUSH = float(os.getenv("SETTLEMENT_CURSOR_FLUSH", "1.0"))
+# Espera máxima entre reconexiones del stream
+SETTLEMENT_MAX_BACKOFF = float(os.getenv("SETTLEMENT_MAX_BACKOFF", "60"))
+# Segundos entre reintentos de los listeners que fallaron (p. ej. con la DB caída)
+SETTLEMENT_LISTENER_RETRY = float(os.getenv("SETTLEMENT_LISTENER_RETRY", "5"))
+
+
+class Settlement(NamedTuple):
+    amt_paid_msat: int
+    settle_date: int
+
+
+class SettlementCache:
+    """Mapa acotado (LRU) payment_hash -> Settlement, seguro entre threads."""
+
+    def __init__(self, maxsize: int = SETTLEMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Settlement]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, payment_hash: str, settlement: Settlement) -> None:
+        with self._lock:
+            self._data[payment_hash] = settlement
+            self._data.move_to_end(payment_hash)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, payment_hash: str) -> Optional[Settlement]:
+        with self._lock:
+            settlement = self._data.get(payment_hash)
+            if settlement is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return settlement
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+async def load_cursor(node: str) -> int:
+    async with AsyncSessionLocal() as db:
+        cursor = await db.get(LndCursor, node)
+        return cursor.settle_index if cursor else 0
+
+
+async def save_cursor(node: str, settle_index: int) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.merge(LndCursor(node=node, settle_index=settle_index))
+        await db.commit()
+
+
+class FailedSettlement(NamedTuple):
+    payment_hash: str
+    settlement: Settlement
+    callbacks: list  # listeners que fallaron y quedan por reintentar
+
+
+class SettlementWatcher:
+    """
+    Mantiene abierto SubscribeInvoices contra LND y alimenta `SettlementCache`
+    con cada invoice liquidada. Reanuda desde el último settle_index persistido.
+    `is_settled()` consulta ese mapa y, si no está, LND (también sin el stream
+    arrancado).
+    Si un listener falla, su liquidación se reintenta cada
+    SETTLEMENT_LISTENER_RETRY segundos y el cursor persistido no la sobrepasa:
+    tras un reinicio, el stream la vuelve a entregar. Por eso los listeners
+    deben ser idempotentes.
+    """
+
+    def __init__(self, client: ResilientLndClient, cache: Optional[SettlementCache] = None, node: str = SETTLEMENT_NODE):
+        # El stream (y su settle_index) es el del primario; las consultas, hedged
+        self.client = client
+        self.cache = cache if cache is not None else SettlementCache()
+        self.node = node
+        self.settle_index = 0
+        self._saved_index = 0
+        self._last_flush = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._retry_task: Optional[asyncio.Task] = None
+        self._listeners = []
+        # settle_index -> liquidación con listeners pendientes de reintentar
+        self._failed: dict[int, FailedSettlement] = {}
+
+    async def is_settled(self, payment_hash: str) -> bool:
+        """
+        Comprueba si una invoice está pagada: primero en el mapa alimentado por el
+        stream y, sólo si no está, con LookupInvoice contra LND.
+        """
+        with stage("lnd_check"):
+            if self.cache.get(payment_hash) is not None:
+                return True
+            return await self.client.check_payment(payment_hash)
+
+    def add_listener(self, callback) -> None:
+        """Registra `callback(payment_hash, settlement)` (async) para cada liquidación."""
+        self._listeners.append(callback)
+
+    @property
+    def cursor(self) -> int:
+        """settle_index que se puede persistir: justo antes de la primera liquidación con listeners fallidos."""
+        if self._failed:
+            return min(self._failed) - 1
+        return self.settle_index
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._retry_task = asyncio.create_task(self._retry_failed())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._retry_task.cancel()
+        await asyncio.gather(self._task, self._retry_task, return_exceptions=True)
+        self._task = self._retry_task = None
+        await self._flush(force=True)
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        cursor_loaded = False
+        while True:
+            try:
+                # Dentro del bucle: si la DB no está disponible al arrancar se
+                # reintenta con backoff en vez de matar la tarea
+                if not cursor_loaded:
+                    self.settle_index = self._saved_index = await load_cursor(self.node)
+                    cursor_loaded = True
+                logger.info(f"Suscrito a invoices de {self.node} desde settle_index={self.settle_index}")
+                async for invoice in self.client.subscribe_invoices(settle_index=self.settle_index):
+                    backoff = 1.0
+                    if invoice.settled:
+                        await self._on_settled(invoice)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                if cursor_loaded:
+                    logger.warning(f"Stream SubscribeInvoices caído ({exc}); reintento en {backoff:.0f}s")
+                else:
+                    logger.warning(f"No se pudo leer el settle_index de {self.node} ({exc}); reintento en {backoff:.0f}s")
+            await self._flush(force=True)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, SETTLEMENT_MAX_BACKOFF)
+
+    async def _on_settled(self, invoice) -> None:
+        payment_hash = invoice.r_hash.hex()
+        settlement = Settlement(invoice.amt_paid_msat, invoice.settle_date)
+        self.cache.add(payment_hash, settlement)
+        self.settle_index = max(self.settle_index, invoice.settle_index)
+        failed = await self._notify(payment_hash, settlement, self._listeners)
+        if failed:
+            self._failed[invoice.settle_index] = FailedSettlement(payment_hash, settlement, failed)
+        await self._flush()
+
+    async def _notify(self, payment_hash: str, settlement: Settlement, callbacks: list) -> list:
+        """Llama a los listeners. Devuelve los que fallaron."""
+        failed = []
+        for callback in callbacks:
+            try:
+                await callback(payment_hash, settlement)
+            except Exception:
+                logger.exception(f"Error procesando la liquidación de {payment_hash}")
+                failed.append(callback)
+        return failed
+
+    async def _retry_failed(self) -> None:
+        while True:
+            await asyncio.sleep(SETTLEMENT_LISTENER_RETRY)
+            for index in sorted(self._failed):
+                pending = self._failed[index]
+                failed = await self._notify(pending.payment_hash, pending.settlement, pending.callbacks)
+                if failed:
+                    self._failed[index] = pending._replace(callbacks=failed)
+                else:
+                    del self._failed[index]
+                    logger.info(f"Liquidación de {pending.payment_hash} procesada tras reintentar")
+            await self._flush()
+
+    async def _flush(self, force: bool = False) -> None:
+        """Persiste el cursor (como mucho cada SETTLEMENT_CURSOR_FLUSH segundos)."""
+        index = self.cursor
+        if index == self._saved_index:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < SETTLEMENT_CURSOR_FLUSH:
+            return
+        try:
+            await save_cursor(self.node, index)
+        except Exception:
+            logger.exception("No se pudo persistir el settle_index")
+            return
+        self._saved_index = index
+        self._last_flush = now
+
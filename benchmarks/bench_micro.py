@@ -0,0 +1,171 @@
+# benchmarks/bench_micro.py
+#
+# Micro-benchmarks (pytest-benchmark) de las piezas del camino caliente:
+# generación del PDF, middleware de API keys y consultas de las rutas.
+# No necesitan LND; la base de datos es BENCH_DATABASE_URL (SQLite por defecto)
+# sembrada con BENCH_ROWS invoices (10.000 por defecto).
+#
+#   pip install pytest-benchmark
+#   python -m pytest benchmarks/bench_micro.py
+#   BENCH_ROWS=1000000 BENCH_DATABASE_URL=postgresql://... python -m pytest benchmarks/bench_micro.py
+#
+# El fichero no sigue el patrón test_*.py a propósito: `pytest` a secas no lo recoge.
+
+# 1) El entorno de benchmarks antes de importar la app
+from benchmarks.settings import BENCH_API_KEY, BENCH_TENANT_ID, use_bench_env
+use_bench_env()
+
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import select
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.core.auth import invalidate_api_key, verify_api_key
+from app.core.db import AsyncSessionLocal, dispose_engines
+from app.core.pdf_generator import generate_pdf, receipt_data, renderer
+from app.core.rate_limit import build_limiter
+from app.models import Invoice
+from app.routes.invoices import _find_existing, invoice_page_stmt
+from app.routes.receipts import _get_tenant_receipt
+from benchmarks.fixtures import seed, seed_payment_hash
+
+BENCH_ROWS = int(os.getenv("BENCH_ROWS", "10000"))
+
+
+@pytest.fixture(scope="module")
+def loop():
+    # Un único loop: las conexiones del pool asíncrono quedan ligadas a él
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(dispose_engines())
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    seed(BENCH_ROWS)
+    return BENCH_ROWS
+
+
+@pytest.fixture
+def invoice():
+    return Invoice(
+        id="bench-invoice",
+        tenant_id=BENCH_TENANT_ID,
+        payment_hash=seed_payment_hash(0),
+        amount_msat=150000,
+        description="Benchmark",
+        customer_name="Cliente Benchmark",
+        status="paid",
+        created_at=datetime(2024, 1, 1),
+    )
+
+
+# --- PDF ---
+
+def test_render_html(benchmark, invoice):
+    data = receipt_data(invoice)
+    benchmark(renderer.render_html, data)
+
+
+def test_generate_pdf(benchmark, invoice):
+    renderer.warmup()
+    benchmark(generate_pdf, invoice)
+
+
+# --- Middleware de API keys ---
+
+# El middleware usa el limitador de la app (en la API lo crea el lifespan)
+_app = FastAPI()
+_app.state.rate_limiter = build_limiter()
+
+
+def _request(key: str) -> Request:
+    return Request({
+        "app": _app,
+        "type": "http",
+        "method": "GET",
+        "path": "/invoices/",
+        "headers": [(b"x-api-key", key.encode())],
+        "query_string": b"",
+    })
+
+
+async def _call_next(request):
+    return Response()
+
+
+def test_verify_api_key_cached(benchmark, loop, seeded):
+    loop.run_until_complete(verify_api_key(_request(BENCH_API_KEY), _call_next))
+
+    def run():
+        return loop.run_until_complete(verify_api_key(_request(BENCH_API_KEY), _call_next))
+
+    assert benchmark(run).status_code == 200
+
+
+def test_verify_api_key_miss(benchmark, loop, seeded):
+    # Cada ronda va a la DB: la key se saca de la caché antes de llamar
+    def run():
+        invalidate_api_key(BENCH_API_KEY)
+        return loop.run_until_complete(verify_api_key(_request(BENCH_API_KEY), _call_next))
+
+    assert benchmark(run).status_code == 200
+
+
+# --- Consultas ---
+
+def _query(loop, fn):
+    async def _run():
+        async with AsyncSessionLocal() as db:
+            return await fn(db)
+    return loop.run_until_complete(_run())
+
+
+def test_find_existing(benchmark, loop, seeded):
+    payment_hash = seed_payment_hash(seeded // 2 or 1)
+
+    async def fn(db):
+        return await _find_existing(db, payment_hash, BENCH_TENANT_ID)
+
+    invoice, _ = benchmark(_query, loop, fn)
+    assert invoice is not None
+
+
+def test_get_tenant_receipt(benchmark, loop, seeded):
+    receipt_id = f"bench-r-{(seeded // 2) | 1}"
+
+    async def fn(db):
+        return await _get_tenant_receipt(db, receipt_id, BENCH_TENANT_ID)
+
+    assert benchmark(_query, loop, fn).id == receipt_id
+
+
+async def _cursor_from_end(db, offset: int):
+    """Clave (created_at, id) de la fila `offset` empezando por el final."""
+    row = (await db.execute(
+        select(Invoice.created_at, Invoice.id)
+        .where(Invoice.tenant_id == BENCH_TENANT_ID)
+        .order_by(Invoice.created_at.desc(), Invoice.id.desc())
+        .offset(offset)
+        .limit(1)
+    )).first()
+    return (row.created_at, row.id)
+
+
+@pytest.mark.parametrize("position", ["first", "last"])
+def test_invoice_page(benchmark, loop, seeded, position):
+    # Keyset: la última página debe costar lo mismo que la primera
+    after = None
+    if position == "last":
+        after = _query(loop, lambda db: _cursor_from_end(db, 100))
+
+    async def fn(db):
+        return list((await db.execute(invoice_page_stmt(BENCH_TENANT_ID, after, 100))).scalars())
+
+    assert benchmark(_query, loop, fn)
@@ -0,0 +1,149 @@
+# benchmarks/fake_lnd.py
+#
+# Servidor gRPC local que imita lo que la API usa de LND
+# (Lightning.LookupInvoice y Lightning.SubscribeInvoices), con latencia
+# configurable. Permite medir la API sin Docker, bitcoind ni nodos reales.
+#
+#   python -m benchmarks.fake_lnd --port 10019 --latency-ms 5 --jitter-ms 2
+#
+# La API se conecta con LND_GRPC_HOST=127.0.0.1:10019 y LND_GRPC_INSECURE=true.
+#
+# Por defecto toda invoice consultada está liquidada; con --unpaid-ratio una
+# fracción (decidida por el hash, así que es estable entre llamadas) sigue
+# pendiente, y con --error-rate otra fracción de llamadas responde UNAVAILABLE.
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import logging
+import random
+import time
+
+import grpc
+from grpc import aio
+from lndgrpc.common import ln, lnrpc
+
+from benchmarks.settings import FAKE_LND_PORT
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_bytes(payment_hash: str) -> bytes:
+    try:
+        return bytes.fromhex(payment_hash)
+    except ValueError:
+        # Los hashes de prueba no siempre son hex: se derivan 32 bytes estables
+        return hashlib.sha256(payment_hash.encode()).digest()
+
+
+class FakeLightning(lnrpc.LightningServicer):
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, unpaid_ratio: float = 0.0,
+                 error_rate: float = 0.0, amount_msat: int = 1000):
+        self.latency = latency
+        self.jitter = jitter
+        self.unpaid_ratio = unpaid_ratio
+        self.error_rate = error_rate
+        self.amount_msat = amount_msat
+        self.lookups = 0
+        self._settle_index = itertools.count(1)
+        self._subscribers: set[asyncio.Queue] = set()
+
+    async def _delay(self) -> None:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def is_paid(self, r_hash: bytes) -> bool:
+        # Reparto estable por hash: la misma invoice siempre responde igual
+        return int.from_bytes(r_hash[:4], "big") / 2**32 >= self.unpaid_ratio
+
+    def _invoice(self, r_hash: bytes, settled: bool) -> ln.Invoice:
+        invoice = ln.Invoice(r_hash=r_hash, memo="fake", settled=settled)
+        if settled:
+            invoice.amt_paid_msat = self.amount_msat
+            invoice.settle_date = int(time.time())
+            invoice.settle_index = next(self._settle_index)
+        return invoice
+
+    async def LookupInvoice(self, request, context):
+        self.lookups += 1
+        await self._delay()
+        if self.error_rate and random.random() < self.error_rate:
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "fake lnd: error inyectado")
+        r_hash = request.r_hash or _hash_bytes(request.r_hash_str)
+        return self._invoice(r_hash, self.is_paid(r_hash))
+
+    async def SubscribeInvoices(self, request, context):
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers.discard(queue)
+
+    def settle(self, payment_hash: str) -> None:
+        """Publica la liquidación de `payment_hash` en todos los streams abiertos."""
+        invoice = self._invoice(_hash_bytes(payment_hash), True)
+        for queue in self._subscribers:
+            queue.put_nowait(invoice)
+
+
+class FakeLndServer:
+    """Servidor grpc.aio con un FakeLightning; `port=0` elige un puerto libre."""
+
+    def __init__(self, servicer: FakeLightning = None, host: str = "127.0.0.1", port: int = FAKE_LND_PORT):
+        self.servicer = servicer or FakeLightning()
+        self.host = host
+        self.port = port
+        self._server = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    async def start(self) -> str:
+        self._server = aio.server()
+        lnrpc.add_LightningServicer_to_server(self.servicer, self._server)
+        self.port = self._server.add_insecure_port(f"{self.host}:{self.port}")
+        await self._server.start()
+        logger.info(f"LND falso escuchando en {self.address}")
+        return self.address
+
+    async def stop(self, grace: float = 0) -> None:
+        if self._server is not None:
+            await self._server.stop(grace)
+            self._server = None
+
+
+async def serve(args) -> None:
+    servicer = FakeLightning(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        unpaid_ratio=args.unpaid_ratio,
+        error_rate=args.error_rate,
+    )
+    server = FakeLndServer(servicer, args.host, args.port)
+    print(f"⚡ LND falso en {await server.start()} (latencia {args.latency_ms}±{args.jitter_ms} ms)")
+    await server._server.wait_for_termination()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="LND falso (LookupInvoice / SubscribeInvoices) para benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=FAKE_LND_PORT)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--unpaid-ratio", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
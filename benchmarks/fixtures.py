@@ -0,0 +1,131 @@
+# benchmarks/fixtures.py
+#
+# Siembra la base de datos de benchmarks (BENCH_DATABASE_URL: SQLite por
+# defecto, o PostgreSQL) con un tenant, su API key y N invoices con recibo.
+# Es incremental: volver a llamarlo con más filas sólo inserta las que faltan,
+# así que el millón de invoices se siembra una vez y se reutiliza.
+#
+#   python -m benchmarks.fixtures --rows 10000
+#   BENCH_DATABASE_URL=postgresql://... python -m benchmarks.fixtures --rows 1000000
+
+# 1) El entorno de benchmarks antes de importar la app
+from benchmarks.settings import BENCH_API_KEY, BENCH_TENANT_ID, use_bench_env
+use_bench_env()
+
+import argparse
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+from app.core.db import get_engine, init_db
+from app.core.storage import get_receipt_store
+from app.models import APIKey, Invoice, Receipt, Tenant
+
+SEED_CHUNK = 10_000
+SEED_START = datetime(2024, 1, 1)
+# PDFs distintos en el almacenamiento (con claves ab/cd/<sha256>.pdf) que
+# comparten las invoices sembradas, y su tamaño (el de un recibo típico)
+SEED_PDF_VARIANTS = 64
+SEED_PDF_SIZE = 30 * 1024
+
+
+def seed_payment_hash(n: int) -> str:
+    return hashlib.sha256(f"bench-{n}".encode()).hexdigest()
+
+
+def seed_pdf(n: int) -> bytes:
+    """Contenido de la variante `n`: la ruta de descarga no interpreta el PDF, sólo lo sirve."""
+    line = f"% bench seed {n}\n".encode()
+    body = line * ((SEED_PDF_SIZE - 16) // len(line))
+    return b"%PDF-1.4\n" + body + b"%%EOF\n"
+
+
+def seed_pdf_keys() -> list[str]:
+    """Guarda las variantes en el almacenamiento de recibos (idempotente) y devuelve sus claves."""
+    store = get_receipt_store()
+    return [store.put(seed_pdf(n)) for n in range(SEED_PDF_VARIANTS)]
+
+
+def _invoice_rows(start: int, stop: int, pdf_keys: list[str]) -> tuple[list[dict], list[dict]]:
+    invoices, receipts = [], []
+    for n in range(start, stop):
+        # Una de cada 20 queda pendiente y sin recibo, como en producción
+        paid = n % 20 != 0
+        invoices.append({
+            "id": f"bench-i-{n}",
+            "tenant_id": BENCH_TENANT_ID,
+            "payment_hash": seed_payment_hash(n),
+            "amount_msat": 1000 + n % 100_000,
+            "description": "seed",
+            "customer_name": None,
+            "status": "paid" if paid else "pending",
+            "created_at": SEED_START + timedelta(seconds=n),
+        })
+        if paid:
+            receipts.append({
+                "id": f"bench-r-{n}",
+                "invoice_id": f"bench-i-{n}",
+                "pdf_url": pdf_keys[n % len(pdf_keys)],
+                "signature": "seed",
+                "status": "ready",
+                "generated_at": SEED_START + timedelta(seconds=n),
+            })
+    return invoices, receipts
+
+
+def ensure_tenant(conn) -> None:
+    if conn.execute(select(Tenant.id).where(Tenant.id == BENCH_TENANT_ID)).first():
+        return
+    conn.execute(insert(Tenant).values(
+        id=BENCH_TENANT_ID, name="Benchmark", email="bench@example.com",
+        plan="monthly", is_active=True, created_at=datetime.utcnow(),
+    ))
+    conn.execute(insert(APIKey).values(
+        tenant_id=BENCH_TENANT_ID, key_hash=BENCH_API_KEY, is_active=True, created_at=datetime.utcnow(),
+    ))
+
+
+def seeded_rows() -> int:
+    with get_engine().connect() as conn:
+        return conn.execute(
+            select(func.count()).select_from(Invoice).where(Invoice.tenant_id == BENCH_TENANT_ID)
+        ).scalar_one()
+
+
+def seed(rows: int, chunk: int = SEED_CHUNK, verbose: bool = False) -> int:
+    """Deja al tenant de benchmarks con al menos `rows` invoices. Devuelve cuántas insertó."""
+    init_db()
+    with get_engine().begin() as conn:
+        ensure_tenant(conn)
+    # Claves reales del almacenamiento: las descargas recorren el camino de producción
+    pdf_keys = seed_pdf_keys()
+    # Las filas se numeran desde 1; las sembradas siempre son un prefijo continuo
+    start = seeded_rows() + 1
+    began = time.perf_counter()
+    for first in range(start, rows + 1, chunk):
+        invoices, receipts = _invoice_rows(first, min(first + chunk, rows + 1), pdf_keys)
+        with get_engine().begin() as conn:
+            conn.execute(insert(Invoice), invoices)
+            if receipts:
+                conn.execute(insert(Receipt), receipts)
+        if verbose:
+            print(f"   {first + len(invoices) - 1}/{rows} invoices")
+    inserted = max(rows - start + 1, 0)
+    if verbose and inserted:
+        print(f"✅ {inserted} invoices sembradas en {time.perf_counter() - began:.1f}s")
+    return inserted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Siembra la base de datos de benchmarks")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--chunk", type=int, default=SEED_CHUNK)
+    args = parser.parse_args()
+    print(f"⚙ Sembrando {get_engine().url.render_as_string(hide_password=True)} hasta {args.rows} invoices...")
+    seed(args.rows, args.chunk, verbose=True)
+
+
+if __name__ == "__main__":
+    main()
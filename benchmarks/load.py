@@ -0,0 +1,199 @@
+# benchmarks/load.py
+#
+# Driver de carga end-to-end: mide latencia (p50/p90/p99) y throughput de
+# POST /invoices y GET /receipts/{id} contra la API real servida por uvicorn.
+#
+# Sin --url, el propio driver lo monta todo en local: siembra la base de datos
+# de benchmarks, arranca el LND falso y lanza uvicorn en un subproceso con el
+# entorno de benchmarks/settings.py.
+#
+#   python -m benchmarks.load --requests 2000 --concurrency 32 --lnd-latency-ms 5
+#   python -m benchmarks.load --url http://127.0.0.1:8000 --api-key test-key-123
+#
+# Cada POST usa un payment_hash nuevo (el LND falso lo da por pagado), así que
+# genera un recibo de verdad; los GET recorren los recibos creados por los POST.
+
+# 1) El entorno de benchmarks antes de importar la app
+from benchmarks.settings import BENCH_API_KEY, FAKE_LND_PORT, bench_env, use_bench_env
+use_bench_env()
+
+import argparse
+import asyncio
+import itertools
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import NamedTuple, Optional
+
+import httpx
+
+from benchmarks.fake_lnd import FakeLightning, FakeLndServer
+from benchmarks.fixtures import seed
+
+
+class PhaseResult(NamedTuple):
+    name: str
+    latencies: list  # segundos, sólo respuestas 2xx
+    statuses: Counter
+    elapsed: float
+
+    @property
+    def ok(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def errors(self) -> int:
+        return sum(self.statuses.values()) - self.ok
+
+    def percentile(self, p: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100)[p - 1]
+
+    def report(self) -> str:
+        throughput = self.ok / self.elapsed if self.elapsed else 0.0
+        ms = lambda seconds: f"{seconds * 1000:8.1f}"
+        return (
+            f"{self.name:<24} {self.ok:>7} {self.errors:>6} {throughput:>9.1f} "
+            f"{ms(self.percentile(50))} {ms(self.percentile(90))} {ms(self.percentile(99))} "
+            f"{ms(max(self.latencies, default=0.0))}"
+        )
+
+
+REPORT_HEADER = (
+    f"{'endpoint':<24} {'ok':>7} {'error':>6} {'req/s':>9} "
+    f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+)
+
+
+async def run_phase(name: str, requests: int, concurrency: int, send) -> PhaseResult:
+    """Lanza `requests` llamadas a `send(i)` con `concurrency` en vuelo a la vez."""
+    counter = itertools.count()
+    latencies, statuses = [], Counter()
+
+    async def worker():
+        while (i := next(counter)) < requests:
+            start = time.perf_counter()
+            try:
+                response = await send(i)
+            except httpx.HTTPError as exc:
+                statuses[type(exc).__name__] += 1
+                continue
+            statuses[response.status_code] += 1
+            if response.is_success:
+                latencies.append(time.perf_counter() - start)
+
+    began = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return PhaseResult(name, latencies, statuses, time.perf_counter() - began)
+
+
+async def drive(url: str, api_key: str, requests: int, concurrency: int) -> list[PhaseResult]:
+    headers = {"x-api-key": api_key}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    receipt_ids = []
+
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=60) as client:
+        async def create(i):
+            response = await client.post("/invoices/", json={
+                "payment_hash": secrets.token_hex(32),
+                "amount_msat": 1000 + i,
+                "description": f"load {i}",
+                "customer_name": "Benchmark",
+            })
+            if response.is_success:
+                receipt_ids.append(response.json()["receipt_id"])
+            return response
+
+        async def download(i):
+            return await client.get(f"/receipts/{receipt_ids[i % len(receipt_ids)]}")
+
+        results = [await run_phase("POST /invoices", requests, concurrency, create)]
+        if receipt_ids:
+            results.append(await run_phase("GET /receipts/{id}", requests, concurrency, download))
+    return results
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn terminó al arrancar (código {process.returncode})")
+            try:
+                if (await client.get("/openapi.json")).is_success:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"La API no respondió en {timeout:.0f}s")
+
+
+async def run_local(args) -> list[PhaseResult]:
+    print(f"⚙ Sembrando {args.seed_rows} invoices...")
+    seed(args.seed_rows)
+
+    lnd = FakeLndServer(FakeLightning(latency=args.lnd_latency_ms / 1000, jitter=args.lnd_jitter_ms / 1000),
+                        port=args.lnd_port)
+    await lnd.start()
+    env = {**os.environ, **bench_env(LND_GRPC_HOST=lnd.address,
+                                     SETTLEMENT_WATCHER_ENABLED=str(args.watcher).lower())}
+    url = f"http://127.0.0.1:{args.port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        await wait_ready(url, process)
+        print(f"🚀 API en {url} ({args.workers} workers), LND falso en {lnd.address}")
+        return await drive(url, BENCH_API_KEY, args.requests, args.concurrency)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        await lnd.stop()
+        print(f"   LookupInvoice atendidas por el LND falso: {lnd.servicer.lookups}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Carga end-to-end de POST /invoices y GET /receipts/{id}")
+    parser.add_argument("--url", help="API ya arrancada; sin ella se levanta una local con el LND falso")
+    parser.add_argument("--api-key", default=BENCH_API_KEY)
+    parser.add_argument("--requests", type=int, default=1000, help="peticiones por endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--workers", type=int, default=1, help="workers de uvicorn")
+    parser.add_argument("--seed-rows", type=int, default=10_000)
+    parser.add_argument("--lnd-port", type=int, default=FAKE_LND_PORT)
+    parser.add_argument("--lnd-latency-ms", type=float, default=5.0)
+    parser.add_argument("--lnd-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--watcher", action="store_true", help="activa SubscribeInvoices en la API")
+    parser.add_argument("--max-p99-ms", type=float, help="falla si el p99 de algún endpoint lo supera")
+    args = parser.parse_args()
+
+    if args.url:
+        results = asyncio.run(drive(args.url, args.api_key, args.requests, args.concurrency))
+    else:
+        results = asyncio.run(run_local(args))
+
+    print(REPORT_HEADER)
+    for result in results:
+        print(result.report())
+        if result.errors:
+            print(f"   respuestas: {dict(result.statuses)}")
+
+    failed = not results or any(not result.ok for result in results)
+    if args.max_p99_ms is not None:
+        slow = [r.name for r in results if r.percentile(99) * 1000 > args.max_p99_ms]
+        if slow:
+            print(f"❌ p99 por encima de {args.max_p99_ms} ms: {', '.join(slow)}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
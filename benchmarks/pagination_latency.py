@@ -0,0 +1,129 @@
+# benchmarks/pagination_latency.py
+#
+# Comprueba que la latencia de GET /invoices no crece con el número de página.
+# Siembra un tenant con un millón de invoices (y sus recibos) dentro de una
+# transacción que se deshace al final, y mide la consulta de la ruta
+# (invoice_page_stmt) en las páginas 1, 10, 100, 1.000 y 10.000.
+# Como contraste mide también la misma página con OFFSET.
+#
+#   python -m benchmarks.pagination_latency --rows 1000000 --limit 100
+#
+#   BENCH_DATABASE_URL=postgresql://... python -m benchmarks.pagination_latency
+#
+# Requiere PostgreSQL (BENCH_DATABASE_URL, nunca la del .env) con el esquema
+# al día (alembic upgrade head).
+
+# 1) El entorno de benchmarks antes de importar la app
+from benchmarks.settings import BENCH_TENANT_ID, use_bench_env
+use_bench_env()
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from sqlalchemy import select, text
+
+from app.core.db import AsyncSessionLocal, get_async_engine
+from app.models import Invoice
+from app.routes.invoices import invoice_page_stmt
+
+# Tenant propio: no se mezcla con el que siembra benchmarks/fixtures.py
+TENANT_ID = f"{BENCH_TENANT_ID}-pagination"
+PAGES = [1, 10, 100, 1000, 10000]
+
+
+async def seed(db, rows: int) -> None:
+    await db.execute(text("""
+        INSERT INTO tenants (id, name, email, plan, is_active, created_at)
+        VALUES (:tenant, 'Benchmark', 'bench@example.com', 'monthly', true, now())
+    """), {"tenant": TENANT_ID})
+    await db.execute(text("""
+        INSERT INTO invoices (id, tenant_id, payment_hash, amount_msat, description, status, created_at)
+        SELECT 'bench-i-' || g, :tenant, md5('bench' || g), 1000 + g % 100000, 'seed',
+               CASE WHEN g % 20 = 0 THEN 'pending' ELSE 'paid' END,
+               timestamp '2024-01-01' + (g || ' seconds')::interval
+        FROM generate_series(1, :rows) g
+    """), {"tenant": TENANT_ID, "rows": rows})
+    await db.execute(text("""
+        INSERT INTO receipts (id, invoice_id, pdf_url, signature, status, generated_at)
+        SELECT 'bench-r-' || g, 'bench-i-' || g, 'bench-' || g || '.pdf', 'seed', 'ready', now()
+        FROM generate_series(1, :rows) g
+        WHERE g % 20 <> 0
+    """), {"rows": rows})
+    await db.execute(text("ANALYZE invoices, receipts"))
+
+
+async def cursor_for_page(db, page: int, limit: int):
+    """Clave de la última fila de la página anterior (fuera de la medición)."""
+    if page == 1:
+        return None
+    row = (await db.execute(
+        select(Invoice.created_at, Invoice.id)
+        .where(Invoice.tenant_id == TENANT_ID)
+        .order_by(Invoice.created_at, Invoice.id)
+        .offset((page - 1) * limit - 1)
+        .limit(1)
+    )).first()
+    return (row.created_at, row.id)
+
+
+async def timed(db, stmt, repeat: int) -> float:
+    """Mediana en milisegundos de `repeat` ejecuciones, incluida la carga de recibos."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        invoices = list((await db.execute(stmt)).scalars())
+        samples.append((time.perf_counter() - start) * 1000)
+        db.expunge_all()
+    assert invoices, "página vacía: ¿hay filas suficientes para --rows / --limit?"
+    return statistics.median(samples)
+
+
+async def run(rows: int, limit: int, repeat: int, max_ratio: float) -> int:
+    if get_async_engine().dialect.name != "postgresql":
+        print("❌ pagination_latency.py necesita PostgreSQL (BENCH_DATABASE_URL)")
+        return 2
+
+    pages = [p for p in PAGES if (p - 1) * limit < rows]
+    async with AsyncSessionLocal() as db:
+        try:
+            print(f"⚙ Sembrando {rows} invoices en {TENANT_ID}...")
+            await seed(db, rows)
+            results = {}
+            print(f"{'página':>8} {'keyset ms':>10} {'offset ms':>10}")
+            for page in pages:
+                after = await cursor_for_page(db, page, limit)
+                keyset_ms = await timed(db, invoice_page_stmt(TENANT_ID, after, limit), repeat)
+                offset_ms = await timed(
+                    db,
+                    invoice_page_stmt(TENANT_ID, None, limit).offset((page - 1) * limit),
+                    repeat,
+                )
+                results[page] = keyset_ms
+                print(f"{page:>8} {keyset_ms:>10.2f} {offset_ms:>10.2f}")
+        finally:
+            # Nada de lo sembrado llega a persistirse
+            await db.rollback()
+
+    ratio = results[pages[-1]] / results[pages[0]]
+    if ratio > max_ratio:
+        print(f"❌ La página {pages[-1]} es {ratio:.1f}x más lenta que la primera (máximo {max_ratio}x)")
+        return 1
+    print(f"✅ Latencia plana: página {pages[-1]} / página 1 = {ratio:.2f}x")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Latencia de GET /invoices por número de página")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-ratio", type=float, default=3.0)
+    args = parser.parse_args()
+    return asyncio.run(run(args.rows, args.limit, args.repeat, args.max_ratio))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# benchmarks/settings.py
+#
+# Entorno común de los benchmarks. Se llama antes de importar `app`: los
+# módulos de la app leen su configuración (DATABASE_URL, LND_*) al importarse.
+#
+# La base de datos de los benchmarks es BENCH_DATABASE_URL y nunca la del .env,
+# para no sembrar un millón de invoices en la de desarrollo por descuido.
+
+import os
+import tempfile
+
+# Puerto por defecto del LND falso (benchmarks/fake_lnd.py)
+FAKE_LND_PORT = int(os.getenv("FAKE_LND_PORT", "10019"))
+BENCH_DIR = os.getenv("BENCH_DIR", os.path.join(tempfile.gettempdir(), "lightpen-bench"))
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}")
+
+# Tenant y API key que siembran los fixtures y usan el driver de carga
+BENCH_TENANT_ID = "bench-tenant"
+BENCH_API_KEY = "bench-key"
+
+
+def bench_signing_key() -> str:
+    """Clave Ed25519 de los benchmarks, generada una vez y compartida por todos los workers."""
+    path = os.path.join(BENCH_DIR, "receipt_signing.pem")
+    if not os.path.exists(path):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+        pem = Ed25519PrivateKey.generate().private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        with open(path, "wb") as f:
+            f.write(pem)
+    return path
+
+
+def bench_env(**overrides) -> dict:
+    """Variables de entorno de la app bajo benchmark (también para el subproceso de uvicorn)."""
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    env = {
+        "RECEIPT_SIGNING_KEY_PATH": bench_signing_key(),
+        "DATABASE_URL": BENCH_DATABASE_URL,
+        "LND_GRPC_HOST": f"127.0.0.1:{FAKE_LND_PORT}",
+        "LND_GRPC_INSECURE": "true",
+        "RECEIPT_STORE": "local",
+        "RECEIPT_STORE_DIR": os.path.join(BENCH_DIR, "receipts"),
+        # Se mide la API, no el limitador: con él activo el tenant de prueba recibiría 429
+        "RATE_LIMIT_ENABLED": "false",
+    }
+    env.update({key: str(value) for key, value in overrides.items()})
+    return env
+
+
+def use_bench_env(**overrides) -> None:
+    """Aplica bench_env() a este proceso. Llamar antes de cualquier `import app...`."""
+    os.environ.update(bench_env(**overrides))
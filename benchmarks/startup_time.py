@@ -0,0 +1,95 @@
+# benchmarks/startup_time.py
+#
+# Mide el arranque en frío de un worker: `import main` más el lifespan
+# (init_db, recibos, render pool, workers), cada vez en un proceso nuevo. Falla
+# si la mediana supera STARTUP_BUDGET o si importar main carga módulos pesados
+# o crea recursos que deberían crearse en el primer uso (WeasyPrint, lndgrpc,
+# drivers de DB, el almacenamiento de recibos o la clave de firma).
+#
+#   python -m benchmarks.startup_time --repeat 5
+#   RENDER_POOL_WORKERS=4 python -m benchmarks.startup_time --budget 8
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.settings import bench_env
+
+# Módulos que `import main` no debe cargar
+LAZY_MODULES = ("weasyprint", "lndgrpc", "asyncpg", "psycopg2", "aiosqlite", "boto3", "redis", "pyinstrument")
+# Recursos perezosos (módulo, global) que `import main` no debe crear
+LAZY_RESOURCES = (
+    ("app.core.db", "_engine"),
+    ("app.core.db", "_async_engine"),
+    ("app.core.storage", "_receipt_store"),
+    ("app.core.signing", "_receipt_signer"),
+)
+
+_CHILD = f"""
+import asyncio, json, sys, time
+started = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - started
+loaded = [name for name in {LAZY_MODULES!r} if name in sys.modules]
+created = [f"{{module}}.{{attr}}" for module, attr in {LAZY_RESOURCES!r}
+           if getattr(sys.modules[module], attr) is not None]
+
+async def lifespan():
+    async with main.app.router.lifespan_context(main.app):
+        return main.app.state.startup
+
+timer = asyncio.run(lifespan())
+print(json.dumps({{"import": import_seconds, "steps": timer.steps, "total": timer.total,
+                  "budget": timer.budget, "loaded": loaded, "created": created}}))
+"""
+
+
+def cold_start(env: dict) -> dict:
+    result = subprocess.run([sys.executable, "-c", _CHILD], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise RuntimeError(f"El arranque falló (código {result.returncode})")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Tiempo de arranque en frío de la API")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, help="segundos (por defecto, STARTUP_BUDGET de la app)")
+    args = parser.parse_args()
+
+    env = {**os.environ, **bench_env(SETTLEMENT_WATCHER_ENABLED="false")}
+    if args.budget is not None:
+        env["STARTUP_BUDGET"] = str(args.budget)
+
+    runs = [cold_start(env) for _ in range(args.repeat)]
+    steps = {name: statistics.median(run["steps"][name] for run in runs) for name in runs[0]["steps"]}
+    total = statistics.median(run["total"] for run in runs)
+    budget = runs[0]["budget"]
+
+    for name, seconds in steps.items():
+        print(f"{name:>12} {seconds * 1000:8.1f} ms")
+    print(f"{'total':>12} {total * 1000:8.1f} ms (mediana de {args.repeat}, presupuesto {budget * 1000:.0f} ms)")
+
+    failed = False
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+    if loaded:
+        print(f"❌ `import main` carga módulos que deberían ser perezosos: {', '.join(loaded)}")
+        failed = True
+    created = sorted({name for run in runs for name in run["created"]})
+    if created:
+        print(f"❌ `import main` crea recursos que deberían crearse en el lifespan: {', '.join(created)}")
+        failed = True
+    if budget > 0 and total > budget:
+        print(f"❌ El arranque supera el presupuesto de {budget:.2f}s")
+        failed = True
+    if not failed:
+        print("✅ Arranque dentro del presupuesto")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+# check_query_plans.py
+#
+# Comprueba con EXPLAIN que las consultas de las rutas usan índices.
+# Siembra datos a escala dentro de una transacción (que se deshace al final),
+# ejecuta ANALYZE y falla si algún plan recurre a un Seq Scan.
+#
+#   python check_query_plans.py --invoices 200000
+#
+# Requiere PostgreSQL con el esquema al día (alembic upgrade head).
+
+# 1) Cargamos .env para que DATABASE_URL esté disponible antes de cualquier import
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import json
+import sys
+
+from sqlalchemy import and_, or_, select, text, true
+from sqlalchemy.dialects import postgresql
+
+from app.core.db import get_engine
+from app.core.pagination import keyset_after
+from app.models import APIKey, Invoice, Receipt, ReceiptJob, Tenant
+from app.routes.invoices import invoice_page_stmt
+from app.routes.receipts import receipt_page_stmt
+
+# Tablas en las que un Seq Scan se considera un fallo
+CHECKED_TABLES = {"invoices", "receipts", "api_keys", "receipt_jobs"}
+
+
+def seed(conn, tenants: int, invoices: int) -> None:
+    """Inserta tenants, keys, invoices, receipts y jobs con generate_series."""
+    conn.execute(text("""
+        INSERT INTO tenants (id, name, email, plan, is_active, created_at)
+        SELECT 'qp-t-' || g, 'Tenant ' || g, 'qp' || g || '@example.com', 'monthly', true, now()
+        FROM generate_series(1, :tenants) g
+    """), {"tenants": tenants})
+    conn.execute(text("""
+        INSERT INTO api_keys (id, tenant_id, key_hash, is_active, created_at)
+        SELECT 'qp-k-' || g, 'qp-t-' || (g % :tenants + 1), 'qp-key-' || g, g % 10 <> 0, now()
+        FROM generate_series(1, :tenants * 5) g
+    """), {"tenants": tenants})
+    conn.execute(text("""
+        INSERT INTO invoices (id, tenant_id, payment_hash, amount_msat, description, status, created_at)
+        SELECT 'qp-i-' || g, 'qp-t-' || (g % :tenants + 1), md5('qp' || g), 1000 + g, 'seed',
+               CASE WHEN g % 20 = 0 THEN 'pending' ELSE 'paid' END,
+               now() - (g || ' seconds')::interval
+        FROM generate_series(1, :invoices) g
+    """), {"tenants": tenants, "invoices": invoices})
+    conn.execute(text("""
+        INSERT INTO receipts (id, invoice_id, pdf_url, signature, status, generated_at)
+        SELECT 'qp-r-' || g, 'qp-i-' || g, 'qp-' || g || '.pdf', 'seed',
+               CASE WHEN g % 50 = 0 THEN 'pending' ELSE 'ready' END, now()
+        FROM generate_series(1, :invoices) g
+        WHERE g % 20 <> 0
+    """), {"invoices": invoices})
+    conn.execute(text("""
+        INSERT INTO receipt_jobs (id, receipt_id, status, attempts, created_at, updated_at)
+        SELECT 'qp-j-' || g, 'qp-r-' || g, CASE WHEN g % 1000 = 0 THEN 'pending' ELSE 'done' END, 0, now(), now()
+        FROM generate_series(1, :invoices) g
+        WHERE g % 20 <> 0 AND g % 2 = 0
+    """), {"invoices": invoices})
+    conn.execute(text("ANALYZE tenants, api_keys, invoices, receipts, receipt_jobs"))
+
+
+def route_queries() -> dict:
+    """Las consultas del camino caliente, tal y como las construyen las rutas."""
+    tenant_id, payment_hash = "qp-t-8", "qp-key-hash"
+    # Clave (created_at, id) de la última fila de la página anterior
+    after = (text("now() - interval '1 day'"), "qp-i-5")
+    return {
+        "auth: api key activa": (
+            select(APIKey.tenant_id, APIKey.expires_at, Tenant.plan)
+            .join(Tenant, Tenant.id == APIKey.tenant_id)
+            .where(APIKey.key_hash == "qp-key-42", APIKey.is_active == true())
+        ),
+        "POST /invoices: invoice + recibo": (
+            select(Invoice, Receipt)
+            .outerjoin(Receipt, Receipt.invoice_id == Invoice.id)
+            .where(Invoice.payment_hash == payment_hash, Invoice.tenant_id == tenant_id)
+        ),
+        "POST /invoices/batch: dedupe IN": (
+            select(Invoice, Receipt)
+            .outerjoin(Receipt, Receipt.invoice_id == Invoice.id)
+            .where(Invoice.payment_hash.in_([f"qp-hash-{i}" for i in range(200)]))
+        ),
+        "GET /receipts/{id}": (
+            select(Receipt)
+            .join(Invoice, Invoice.id == Receipt.invoice_id)
+            .where(Receipt.id == "qp-r-1234", Invoice.tenant_id == tenant_id)
+        ),
+        "GET /invoices: primera página": invoice_page_stmt(tenant_id, None, 100),
+        "GET /invoices: página keyset": invoice_page_stmt(tenant_id, after, 100),
+        "GET /invoices: recibos de la página (selectinload)": (
+            select(Receipt)
+            .where(Receipt.invoice_id.in_([f"qp-i-{i}" for i in range(8, 808, 8)]))
+        ),
+        "GET /receipts: primera página": receipt_page_stmt(tenant_id, None, 100),
+        "GET /receipts: página keyset": receipt_page_stmt(tenant_id, after, 100),
+        "GET /invoices/export: página keyset": (
+            select(Invoice, Receipt)
+            .outerjoin(Receipt, Receipt.invoice_id == Invoice.id)
+            .where(
+                Invoice.tenant_id == tenant_id,
+                keyset_after([Invoice.created_at, Invoice.id], after),
+            )
+            .order_by(Invoice.created_at, Invoice.id)
+            .limit(5000)
+        ),
+        "push: invoice pendiente por hash": (
+            select(Invoice)
+            .where(Invoice.payment_hash == payment_hash, Invoice.status == "pending")
+        ),
+        "worker: reclamar trabajos": (
+            select(ReceiptJob.id)
+            .where(or_(
+                ReceiptJob.status == "pending",
+                and_(ReceiptJob.status == "running", ReceiptJob.updated_at < text("now() - interval '5 minutes'")),
+            ))
+            .order_by(ReceiptJob.created_at)
+            .limit(16)
+        ),
+        "worker: datos de los trabajos": (
+            select(Receipt.id, Invoice)
+            .join(Invoice, Invoice.id == Receipt.invoice_id)
+            .where(Receipt.id.in_([f"qp-r-{i}" for i in range(2, 34, 2)]))
+        ),
+    }
+
+
+def seq_scans(plan: dict) -> list[str]:
+    """Relaciones leídas con Seq Scan en cualquier nodo del plan."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in CHECKED_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Falla si alguna consulta de las rutas hace Seq Scan")
+    parser.add_argument("--tenants", type=int, default=200)
+    parser.add_argument("--invoices", type=int, default=100000)
+    args = parser.parse_args()
+
+    if get_engine().dialect.name != "postgresql":
+        print("❌ check_query_plans.py necesita PostgreSQL (DATABASE_URL)")
+        return 2
+
+    failures = 0
+    with get_engine().connect() as conn:
+        trans = conn.begin()
+        try:
+            print(f"⚙ Sembrando {args.tenants} tenants y {args.invoices} invoices...")
+            seed(conn, args.tenants, args.invoices)
+            for name, stmt in route_queries().items():
+                sql = stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scans = seq_scans(plan[0]["Plan"])
+                if scans:
+                    failures += 1
+                    print(f"❌ {name}: Seq Scan en {', '.join(sorted(set(scans)))}")
+                else:
+                    print(f"✅ {name}")
+        finally:
+            # Nada de lo sembrado llega a persistirse
+            trans.rollback()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,168 @@
 # main.py
 
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 # 1) Lo primero: cargar el .env
 from app.core.config import load_config
 load_config()
 
-# 2) Ahora importamos el resto con la certeza de que DATABASE_URL existe
-from fastapi import FastAPI
-from app.routes import invoices, receipts
-from app.core.auth import verify_api_key
-from app.core.db import init_db
+# 2) Ahora importamos el resto. Importar no abre conexiones ni carga WeasyPrint
+#    o lndgrpc: la DB, el render, LND, la clave de firma y el almacenamiento de
+#    recibos se inicializan en el lifespan o al primer uso.
+import math
+import os
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import State
+from app.routes import admin, api_keys, downloads, invoices, receipts
+from app.core import metrics
+from app.core.auth import require_admin, verify_api_key
+from app.core.bundles import BundleRunner
+from app.core.idempotency import purge_expired
+from app.core.profiling import request_profiler
+from app.core.rate_limit import build_limiter
+from app.core.db import dispose_engines, init_db
+from app.core.render_pool import RenderPool, RenderQueueFull
+from app.core.receipt_queue import RECEIPT_PUSH_ENABLED, ReceiptWorker
+from app.core.signing import get_receipt_signer
+from app.core.startup import StartupTimer
+from app.core.storage import get_receipt_store
+from app.services.lnd_grpc import LndError, LndUnavailable, build_lnd_client
+from app.services.settlement import SETTLEMENT_WATCHER_ENABLED, SettlementWatcher
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("app")
 
-# 3) Inicializar la base de datos (create_all o migraciones)
-init_db()
+# create_all al arrancar (útil en development; con migraciones, DB_CREATE_ALL=false)
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "true").lower() in ("1", "true", "yes")
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+
+def build_resources(state: State) -> None:
+    """
+    Crea los recursos con estado de una app y los guarda en `app.state`: cada
+    app de create_app() tiene los suyos. Sólo construye objetos; los procesos,
+    tareas y conexiones se abren al arrancarlos (o en su primer uso).
+    """
+    state.lnd_client = build_lnd_client()
+    state.settlement_watcher = SettlementWatcher(state.lnd_client)
+    state.rate_limiter = build_limiter()
+    state.render_pool = RenderPool()
+    metrics.track_render_pool(state.render_pool)
+    state.receipt_worker = ReceiptWorker(state.render_pool)
+    state.bundle_runner = BundleRunner(state.render_pool)
+
 
-app = FastAPI(
-    title="Generador de Recibo Lightning",
-    version="0.1.0"
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timer = StartupTimer()
+    timer.mark("import", IMPORT_SECONDS)
+    state = app.state
+    build_resources(state)
 
-@app.on_event("startup")
-async def startup_event():
+    # 3) Inicializar la base de datos (create_all o migraciones)
+    if DB_CREATE_ALL:
+        with timer.step("init_db"):
+            await run_in_threadpool(init_db)
+    # Clave de firma y almacenamiento de recibos: sin clave la API no arranca
+    with timer.step("receipts"):
+        get_receipt_signer()
+        await run_in_threadpool(get_receipt_store)
+    # Arrancamos (y pre-calentamos) los procesos de render de PDFs
+    with timer.step("render_pool"):
+        await run_in_threadpool(state.render_pool.start)
+    with timer.step("workers"):
+        # Tareas que drenan la cola de recibos asíncronos
+        state.receipt_worker.start()
+        # Bundles en segundo plano que quedaron a medias
+        await state.bundle_runner.resume()
+        # Respuestas de Idempotency-Key ya caducadas
+        purged = await purge_expired()
+        if purged:
+            logger.info(f"{purged} registros de idempotencia caducados borrados")
+    # Stream de liquidaciones de LND: evita LookupInvoice en el camino caliente
+    if SETTLEMENT_WATCHER_ENABLED:
+        # Modo push: cada liquidación de una invoice pre-registrada encola su recibo
+        if RECEIPT_PUSH_ENABLED:
+            state.settlement_watcher.add_listener(state.receipt_worker.push_on_settlement)
+        state.settlement_watcher.start()
+    timer.finish()
+    state.startup = timer
     logger.info("🚀 App arrancada, ready to receive requests")
 
-# Middleware para API Key (usamos el verify_api_key que retorna call_next)
-app.middleware("http")(verify_api_key)
+    yield
+
+    await state.settlement_watcher.stop()
+    await state.receipt_worker.stop()
+    await state.bundle_runner.stop()
+    state.render_pool.shutdown()
+    await state.lnd_client.close()
+    await state.rate_limiter.close()
+    await dispose_engines()
+
+
+async def render_queue_full_handler(request: Request, exc: RenderQueueFull):
+    # Backpressure: la cola de PDFs está llena, el cliente debe reintentar
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Render queue full, retry later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def lnd_unavailable_handler(request: Request, exc: LndUnavailable):
+    # LND no responde (o su circuito está abierto): no es que el pago no esté confirmado
+    logger.error(f"LND no disponible: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Lightning node unavailable, retry later"},
+        headers={"Retry-After": str(max(math.ceil(exc.retry_after), 1))},
+    )
+
+
+async def lnd_error_handler(request: Request, exc: LndError):
+    logger.error(f"Error de LND: {exc}")
+    return JSONResponse(status_code=502, content={"error": "Lightning node error"})
+
+
+def create_app() -> FastAPI:
+    """
+    Factoría de la aplicación (uvicorn --factory main:create_app). Sólo
+    registra rutas, middlewares y handlers; los recursos se crean en el
+    lifespan y viven en `app.state`, así que dos apps no comparten ninguno.
+    """
+    app = FastAPI(
+        title="Generador de Recibo Lightning",
+        version="0.1.0",
+        lifespan=lifespan,
+    )
+
+    app.add_exception_handler(RenderQueueFull, render_queue_full_handler)
+    app.add_exception_handler(LndUnavailable, lnd_unavailable_handler)
+    app.add_exception_handler(LndError, lnd_error_handler)
+
+    # Middleware para API Key (usamos el verify_api_key que retorna call_next)
+    app.middleware("http")(verify_api_key)
+    # Perfilado de requests (PROFILE_SAMPLE_RATE / X-Profile). Va por fuera de la
+    # auth para incluirla en el perfil; sin configurar, ni se registra.
+    if request_profiler.enabled:
+        app.middleware("http")(request_profiler)
+
+    # Rutas principales
+    app.include_router(invoices.router, prefix="/invoices", tags=["Invoices"])
+    app.include_router(receipts.router, prefix="/receipts", tags=["Receipts"])
+    app.include_router(downloads.router, prefix="/downloads", tags=["Receipts"])
+    app.include_router(api_keys.router, prefix="/admin/api-keys", tags=["Admin"])
+    app.include_router(admin.router, prefix="/admin", tags=["Admin"])
+    app.include_router(metrics.router, dependencies=[Depends(require_admin)])
+    return app
+
 
-# Rutas principales
-app.include_router(invoices.router, prefix="/invoices", tags=["Invoices"])
-app.include_router(receipts.router, prefix="/receipts", tags=["Receipts"])
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
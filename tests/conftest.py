@@ -0,0 +1,45 @@
+# tests/conftest.py
+#
+# Entorno de los tests. Se fija antes de importar `app`: los módulos de la app
+# leen su configuración (DATABASE_URL, RECEIPT_*, LND_*) al importarse, y
+# load_dotenv() no pisa lo que ya está en el entorno.
+#
+#   pip install -r requirements-test.txt
+#   python -m pytest
+
+import os
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="lightpen-tests-")
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}",
+    "RECEIPT_STORE": "local",
+    "RECEIPT_STORE_DIR": os.path.join(TEST_DIR, "receipts"),
+    "RECEIPT_SIGNING_EPHEMERAL": "true",
+    "RENDER_POOL_WORKERS": "0",
+    "SETTLEMENT_WATCHER_ENABLED": "false",
+    # lndgrpc trae stubs generados con un protobuf antiguo
+    "PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION": "python",
+})
+
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db_tables():
+    """Esquema creado en el SQLite de los tests y vaciado al terminar cada test."""
+    from app.core.db import Base, dispose_engines, get_engine, init_db
+
+    init_db()
+    yield
+    # Las conexiones del pool asíncrono quedan ligadas al loop de cada test
+    await dispose_engines()
+    with get_engine().begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
@@ -0,0 +1,223 @@
+# tests/test_idempotency.py
+
+import asyncio
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from fastapi import HTTPException, Response
+
+import app.core.signed_urls as signed_urls
+import app.routes.invoices as invoices
+from app.core.cache import SingleFlight
+from app.core.db import AsyncSessionLocal
+from app.core.idempotency import release_key, request_fingerprint, reserve_key, save_response
+from app.models import IdempotencyRecord, Invoice, Receipt
+from app.schemas import InvoiceCreate, InvoiceResponse
+
+pytestmark = pytest.mark.anyio
+
+TENANT = "tenant-1"
+PAYLOAD = InvoiceCreate(payment_hash="hash-1", amount_msat=1000, description="d")
+
+
+class FakeCreate:
+    """Sustituye a _create_invoice_once: cuenta ejecuciones y espera a `release`."""
+
+    def __init__(self, result=None, exc=None):
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.result = result or InvoiceResponse(
+            invoice_id="inv-1", status="paid", receipt_id="rec-1",
+            receipt_url="ab/cd/x.pdf", receipt_status="ready",
+        )
+        self.exc = exc
+
+    async def __call__(self, payload, async_receipt, tenant_id, state):
+        self.calls += 1
+        self.started.set()
+        await self.release.wait()
+        if self.exc:
+            raise self.exc
+        return 200, self.result
+
+
+@pytest.fixture
+def fake_create(monkeypatch, db_tables):
+    fake = FakeCreate()
+    monkeypatch.setattr(invoices, "_create_invoice_once", fake)
+    return fake
+
+
+async def post(payload=PAYLOAD, key="key-1", response=None):
+    response = response if response is not None else Response()
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace()))
+    return await invoices.create_invoice(
+        payload, request, response, async_receipt=False, idempotency_key=key, tenant_id=TENANT,
+    )
+
+
+async def get_record(key="key-1"):
+    async with AsyncSessionLocal() as db:
+        return await db.get(IdempotencyRecord, (TENANT, key))
+
+
+# --- Reservas ---
+
+async def test_reserve_key_race_has_a_single_winner(db_tables):
+    results = await asyncio.gather(*[reserve_key(TENANT, "race", "h") for _ in range(8)])
+    assert results.count(None) == 1
+    assert all(r.pending for r in results if r is not None)
+
+
+async def test_released_key_can_be_reserved_again(db_tables):
+    assert await reserve_key(TENANT, "k", "h") is None
+    await release_key(TENANT, "k", "h")
+    assert await reserve_key(TENANT, "k", "h") is None
+
+
+async def test_saved_response_is_not_released(db_tables):
+    assert await reserve_key(TENANT, "k", "h") is None
+    await save_response(TENANT, "k", "h", 200, "{}")
+    await release_key(TENANT, "k", "h")
+    stored = await reserve_key(TENANT, "k", "h")
+    assert stored.status_code == 200 and not stored.pending
+
+
+# --- POST /invoices con Idempotency-Key ---
+
+async def test_concurrent_duplicate_waits_for_the_original(fake_create):
+    first = asyncio.create_task(post())
+    await fake_create.started.wait()
+    duplicate_response = Response()
+    duplicate = asyncio.create_task(post(response=duplicate_response))
+    await asyncio.sleep(0.05)
+    assert not duplicate.done()
+
+    fake_create.release.set()
+    results = await asyncio.gather(first, duplicate)
+    assert results[0] == results[1] == fake_create.result
+    assert fake_create.calls == 1
+    assert duplicate_response.headers["Idempotent-Replayed"] == "true"
+
+
+async def test_concurrent_duplicate_with_other_payload_is_rejected(fake_create):
+    first = asyncio.create_task(post())
+    await fake_create.started.wait()
+    with pytest.raises(HTTPException) as exc:
+        await post(PAYLOAD.model_copy(update={"amount_msat": 2000}))
+    assert exc.value.status_code == 422
+    fake_create.release.set()
+    await first
+
+
+async def test_pending_reservation_of_another_process_gets_409(fake_create):
+    request_hash = request_fingerprint(PAYLOAD.model_dump(), False)
+    assert await reserve_key(TENANT, "key-1", request_hash) is None
+    with pytest.raises(HTTPException) as exc:
+        await post()
+    assert exc.value.status_code == 409
+    assert exc.value.headers["Retry-After"] == "1"
+    assert fake_create.calls == 0
+
+
+async def test_client_cancellation_still_saves_the_response(fake_create):
+    first = asyncio.create_task(post())
+    await fake_create.started.wait()
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+    fake_create.release.set()
+    while len(invoices.idempotent_requests):
+        await asyncio.sleep(0.01)
+    record = await get_record()
+    assert record.status_code == 200
+
+    response = Response()
+    assert await post(response=response) == fake_create.result.model_copy(update={"receipt_url": None})
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert fake_create.calls == 1
+
+
+@pytest.mark.parametrize("exc", [HTTPException(status_code=400), asyncio.CancelledError()])
+async def test_failed_request_releases_the_reservation(fake_create, exc):
+    fake_create.exc = exc
+    fake_create.release.set()
+    with pytest.raises(type(exc)):
+        await post()
+    assert await get_record() is None
+
+    fake_create.exc = None
+    await post()
+    assert fake_create.calls == 2
+
+
+async def test_replay_signs_receipt_url_again(fake_create, monkeypatch):
+    monkeypatch.setattr(signed_urls, "DOWNLOAD_URL_SECRET", "secret")
+    key = "ab/cd/" + "0" * 64 + ".pdf"
+    async with AsyncSessionLocal() as db:
+        db.add(Invoice(id="inv-1", tenant_id=TENANT, payment_hash="hash-1", amount_msat=1000, status="paid"))
+        db.add(Receipt(id="rec-1", invoice_id="inv-1", pdf_url=key, status="ready"))
+        await db.commit()
+    # URL de la respuesta original, ya caducada cuando llega el reintento
+    fake_create.result.receipt_url = signed_urls.sign_download_url(key, TENANT, "rec-1", ttl=-1)
+    fake_create.release.set()
+    await post()
+
+    record = await get_record()
+    assert "receipt_url" not in record.response_body
+
+    replayed = await post()
+    query = parse_qs(urlparse(replayed.receipt_url).query)
+    assert urlparse(replayed.receipt_url).path == f"/downloads/{key}"
+    assert signed_urls.verify_download(key, TENANT, "rec-1", int(query["exp"][0]), query["sig"][0])
+
+
+# --- SingleFlight ---
+
+async def test_single_flight_shares_result():
+    flights = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    results = await asyncio.gather(*[flights.do("k", work) for _ in range(5)])
+    assert results == [1] * 5
+    assert calls == 1 and flights.shared == 4
+    assert "k" not in flights
+
+
+async def test_single_flight_shares_exceptions():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*[flights.do("k", work) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+async def test_single_flight_survives_first_caller_cancellation():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        return "done"
+
+    first = asyncio.create_task(flights.do("k", work))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(flights.do("k", work))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    assert await second == "done"
+    with pytest.raises(asyncio.CancelledError):
+        await first
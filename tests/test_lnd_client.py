@@ -0,0 +1,276 @@
+# tests/test_lnd_client.py
+
+import asyncio
+from types import SimpleNamespace
+
+import grpc
+import pytest
+from grpc import aio
+
+from app.core.circuit_breaker import CircuitBreaker, CircuitOpen
+from app.services.lnd_grpc import (
+    AsyncLndClient,
+    InvoiceNotFound,
+    LndCircuitOpen,
+    LndUnavailable,
+    ResilientLndClient,
+)
+
+pytestmark = pytest.mark.anyio
+
+CLOSED, HALF_OPEN, OPEN = CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def rpc_error(code: grpc.StatusCode) -> aio.AioRpcError:
+    return aio.AioRpcError(code, aio.Metadata(), aio.Metadata(), details=code.name)
+
+
+def invoice(settled: bool = True):
+    return SimpleNamespace(settled=settled)
+
+
+class FakeStub:
+    """LightningStub falso: cada LookupInvoice consume la siguiente respuesta del guion."""
+
+    def __init__(self, *responses, delay: float = 0.0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.calls = 0
+
+    async def LookupInvoice(self, request, metadata=None, timeout=None):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+
+def lnd_client(stub: FakeStub, name: str = "primary", failures: int = 3, clock=None) -> AsyncLndClient:
+    client = AsyncLndClient(host="fake:10009", name=name)
+    client.breaker = CircuitBreaker(
+        name, failure_threshold=failures, reset_timeout=10.0, half_open_max=1,
+        clock=clock or FakeClock(),
+    )
+    client._stub = stub
+    return client
+
+
+def resilient(primary, secondary=None, retries: int = 2, hedge_delay: float = 0.05, timeout: float = 2.0):
+    return ResilientLndClient(primary, secondary, retries=retries, hedge_delay=hedge_delay, timeout=timeout)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("app.services.lnd_grpc._backoff", lambda attempt: 0)
+
+
+# --- CircuitBreaker ---
+
+def test_breaker_opens_after_threshold():
+    changes = []
+    breaker = CircuitBreaker("lnd", failure_threshold=3, clock=FakeClock(), on_change=changes.append)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert changes == [OPEN]
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker("lnd", failure_threshold=2, clock=FakeClock())
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_breaker_open_rejects_with_retry_after():
+    clock = FakeClock()
+    breaker = CircuitBreaker("lnd", failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 4.0
+    with pytest.raises(CircuitOpen) as exc:
+        breaker.before_call()
+    assert exc.value.retry_after == pytest.approx(6.0)
+
+
+def test_breaker_half_open_probe_closes_on_success():
+    clock = FakeClock()
+    changes = []
+    breaker = CircuitBreaker("lnd", failure_threshold=1, reset_timeout=10.0, clock=clock, on_change=changes.append)
+    breaker.record_failure()
+    clock.now = 10.0
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
+    # Una sola sonda a la vez
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert changes == [OPEN, HALF_OPEN, CLOSED]
+
+
+def test_breaker_half_open_probe_reopens_on_failure():
+    clock = FakeClock()
+    breaker = CircuitBreaker("lnd", failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 10.0
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == pytest.approx(10.0)
+
+
+def test_breaker_release_frees_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker("lnd", failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 10.0
+    breaker.before_call()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
+
+
+# --- AsyncLndClient ---
+
+async def test_client_unavailable_counts_failure():
+    client = lnd_client(FakeStub(rpc_error(grpc.StatusCode.UNAVAILABLE)), failures=2)
+    for _ in range(2):
+        with pytest.raises(LndUnavailable):
+            await client.lookup_invoice("ab")
+    with pytest.raises(LndCircuitOpen):
+        await client.lookup_invoice("ab")
+    assert client.stub.calls == 2
+
+
+async def test_client_not_found_is_an_answer():
+    client = lnd_client(FakeStub(rpc_error(grpc.StatusCode.NOT_FOUND)), failures=1)
+    with pytest.raises(InvoiceNotFound):
+        await client.lookup_invoice("ab")
+    assert client.breaker.state == CLOSED
+
+
+async def test_client_retried_attempt_does_not_count():
+    client = lnd_client(FakeStub(rpc_error(grpc.StatusCode.UNAVAILABLE)), failures=1)
+    with pytest.raises(LndUnavailable):
+        await client.lookup_invoice("ab", count_failure=False)
+    assert client.breaker.state == CLOSED
+
+
+async def test_client_half_open_recovery():
+    clock = FakeClock()
+    stub = FakeStub(rpc_error(grpc.StatusCode.UNAVAILABLE), invoice())
+    client = lnd_client(stub, failures=1, clock=clock)
+    with pytest.raises(LndUnavailable):
+        await client.lookup_invoice("ab")
+    with pytest.raises(LndCircuitOpen):
+        await client.lookup_invoice("ab")
+    clock.now = 10.0
+    assert (await client.lookup_invoice("ab")).settled
+    assert client.breaker.state == CLOSED
+
+
+async def test_client_connect_error_keeps_probe_free(monkeypatch):
+    clock = FakeClock()
+    client = lnd_client(FakeStub(invoice()), failures=1, clock=clock)
+    client.breaker.record_failure()
+    clock.now = 10.0
+    client._stub = None
+
+    def broken_connect():
+        raise RuntimeError("sin credenciales")
+
+    monkeypatch.setattr(client, "_connect", broken_connect)
+    with pytest.raises(RuntimeError):
+        await client.lookup_invoice("ab")
+    assert client.breaker._probes == 0
+    assert client.breaker.state == HALF_OPEN
+
+
+# --- ResilientLndClient: reintentos ---
+
+async def test_retries_recover_without_failures():
+    stub = FakeStub(rpc_error(grpc.StatusCode.UNAVAILABLE), rpc_error(grpc.StatusCode.UNAVAILABLE), invoice())
+    lnd = resilient(lnd_client(stub, failures=1))
+    assert (await lnd.lookup_invoice("ab")).settled
+    assert stub.calls == 3
+    assert lnd.primary.breaker.state == CLOSED
+
+
+async def test_retries_count_one_failure_per_call():
+    stub = FakeStub(rpc_error(grpc.StatusCode.UNAVAILABLE))
+    lnd = resilient(lnd_client(stub, failures=3), retries=2)
+    with pytest.raises(LndUnavailable):
+        await lnd.lookup_invoice("ab")
+    assert stub.calls == 3
+    assert lnd.primary.breaker._failures == 1
+    assert lnd.primary.breaker.state == CLOSED
+
+    for _ in range(2):
+        with pytest.raises(LndUnavailable):
+            await lnd.lookup_invoice("ab")
+    assert lnd.primary.breaker.state == OPEN
+    with pytest.raises(LndCircuitOpen):
+        await lnd.lookup_invoice("ab")
+    assert stub.calls == 9
+
+
+async def test_deadline_counts_one_failure():
+    stub = FakeStub(invoice(), delay=1.0)
+    lnd = resilient(lnd_client(stub, failures=3), timeout=0.1)
+    with pytest.raises(LndUnavailable):
+        await lnd.lookup_invoice("ab")
+    assert lnd.primary.breaker._failures == 1
+
+
+# --- ResilientLndClient: hedging ---
+
+async def test_hedge_settled_secondary_wins():
+    primary = lnd_client(FakeStub(invoice(), delay=1.0))
+    secondary = lnd_client(FakeStub(invoice(settled=True)), name="secondary")
+    lnd = resilient(primary, secondary, timeout=0.5)
+    assert (await lnd.lookup_invoice("ab")).settled
+    # El primario perdedor se cancela sin veredicto
+    assert primary.breaker._failures == 0
+
+
+async def test_hedge_unsettled_secondary_waits_for_primary():
+    primary = lnd_client(FakeStub(invoice(settled=False), delay=0.2))
+    secondary = lnd_client(FakeStub(invoice(settled=False)), name="secondary")
+    lnd = resilient(primary, secondary)
+    assert not (await lnd.lookup_invoice("ab")).settled
+    assert primary.stub.calls == 1
+
+
+async def test_hedge_primary_down_secondary_confirms():
+    primary = lnd_client(FakeStub(rpc_error(grpc.StatusCode.UNAVAILABLE)))
+    secondary = lnd_client(FakeStub(invoice(settled=True)), name="secondary")
+    lnd = resilient(primary, secondary)
+    assert (await lnd.lookup_invoice("ab")).settled
+    assert primary.stub.calls == 1
+    assert primary.breaker._failures == 0
+
+
+async def test_hedge_secondary_not_found_is_not_final():
+    primary = lnd_client(FakeStub(rpc_error(grpc.StatusCode.UNAVAILABLE)))
+    secondary = lnd_client(FakeStub(rpc_error(grpc.StatusCode.NOT_FOUND)), name="secondary")
+    lnd = resilient(primary, secondary, retries=1)
+    with pytest.raises(LndUnavailable):
+        await lnd.lookup_invoice("ab")
+    assert primary.stub.calls == 2
+    assert primary.breaker._failures == 1
+    assert secondary.breaker._failures == 0
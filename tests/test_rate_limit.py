@@ -0,0 +1,101 @@
+# tests/test_rate_limit.py
+
+import asyncio
+
+import pytest
+
+import app.core.rate_limit as rate_limit
+from app.core.rate_limit import MemoryBucketStore, PlanLimit, RateLimiter, RedisBucketStore
+
+pytestmark = pytest.mark.anyio
+
+# 3 peticiones de golpe y 3 tokens por segundo
+LIMITS = {"free": PlanLimit(3, 1), "monthly": PlanLimit(0, 60)}
+
+
+@pytest.fixture
+def memory_limiter():
+    return RateLimiter(MemoryBucketStore(), limits=LIMITS, enabled=True)
+
+
+@pytest.fixture
+async def redis_limiter():
+    fakeredis = pytest.importorskip("fakeredis")
+    limiter = RateLimiter(RedisBucketStore(client=fakeredis.FakeAsyncRedis()), limits=LIMITS, enabled=True)
+    yield limiter
+    await limiter.close()
+
+
+@pytest.fixture(params=["memory", "redis"])
+def limiter(request):
+    return request.getfixturevalue(f"{request.param}_limiter")
+
+
+async def test_burst_then_429_with_retry_after(limiter):
+    decisions = [await limiter.hit("t1", "free") for _ in range(4)]
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert [d.remaining for d in decisions] == [2, 1, 0, 0]
+    rejected = decisions[-1]
+    assert rejected.retry_after == 1
+    assert rejected.headers()["Retry-After"] == "1"
+    assert rejected.headers()["RateLimit-Policy"] == "3;w=1"
+    assert "Retry-After" not in decisions[0].headers()
+
+
+async def test_bucket_refills_over_time(limiter):
+    for _ in range(3):
+        assert (await limiter.hit("t1", "free")).allowed
+    assert not (await limiter.hit("t1", "free")).allowed
+    # 0,7 s a 3 tokens/s: dos tokens de vuelta
+    await asyncio.sleep(0.7)
+    assert [(await limiter.hit("t1", "free")).allowed for _ in range(3)] == [True, True, False]
+
+
+async def test_retry_after_grows_with_cost(limiter):
+    await limiter.hit("t1", "free", cost=3)
+    decision = await limiter.hit("t1", "free", cost=3)
+    assert not decision.allowed
+    assert decision.retry_after == 1
+    assert decision.reset == 1
+
+
+async def test_buckets_are_per_tenant(limiter):
+    await limiter.hit("t1", "free", cost=3)
+    assert not (await limiter.hit("t1", "free")).allowed
+    assert (await limiter.hit("t2", "free")).allowed
+
+
+async def test_unlimited_plan_and_unknown_plan(limiter):
+    assert await limiter.hit("t1", "monthly") is None
+    assert (await limiter.hit("t1", "enterprise")).limit == 3
+
+
+async def test_memory_and_redis_agree(memory_limiter, redis_limiter):
+    sequence = [1, 1, 2, 1, 1, 3]
+    for cost in sequence:
+        memory = await memory_limiter.hit("t1", "free", cost=cost)
+        redis = await redis_limiter.hit("t1", "free", cost=cost)
+        assert (memory.allowed, memory.remaining, memory.reset, memory.retry_after) == (
+            redis.allowed, redis.remaining, redis.reset, redis.retry_after,
+        )
+
+
+async def test_backend_failure_lets_requests_through():
+    class Down:
+        async def take(self, *args):
+            raise ConnectionError("redis caído")
+
+    limiter = RateLimiter(Down(), limits=LIMITS, enabled=True)
+    assert await limiter.hit("t1", "free") is None
+
+
+async def test_memory_store_is_bounded():
+    store = MemoryBucketStore(maxsize=2)
+    for tenant in ("a", "b", "c"):
+        await store.take(tenant, 3, 1.0, 1)
+    assert list(store._buckets) == ["b", "c"]
+
+
+def test_build_limiter_rejects_unknown_backend():
+    with pytest.raises(RuntimeError):
+        rate_limit.build_limiter("memcached")
@@ -0,0 +1,95 @@
+# tests/test_storage.py
+
+import pytest
+
+from app.core.storage import (
+    InvalidRange,
+    LocalReceiptStore,
+    ReceiptNotStored,
+    S3ReceiptStore,
+    content_key,
+)
+
+PDF = b"%PDF-1.7\n" + bytes(range(256)) * 600  # ~150 KB: más de un trozo
+
+
+@pytest.fixture
+def s3_store(monkeypatch):
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        store = S3ReceiptStore(bucket="receipts", prefix="tests", endpoint_url=None, region="us-east-1")
+        store.client.create_bucket(Bucket="receipts")
+        yield store
+
+
+@pytest.fixture
+def local_store(tmp_path):
+    return LocalReceiptStore(tmp_path / "receipts")
+
+
+@pytest.fixture(params=["local", "s3"])
+def store(request):
+    return request.getfixturevalue(f"{request.param}_store")
+
+
+def test_put_is_content_addressed(store):
+    key = store.put(PDF)
+    assert key == content_key(PDF)
+    assert store.exists(key)
+    assert store.put(PDF) == key
+
+
+def test_get_and_stream(store):
+    key = store.put(PDF)
+    assert store.get(key) == PDF
+    chunks = list(store.stream(key, chunk_size=64 * 1024))
+    assert len(chunks) > 1
+    assert b"".join(chunks) == PDF
+
+
+def test_missing_key(store):
+    key = content_key(b"no guardado")
+    assert not store.exists(key)
+    with pytest.raises(ReceiptNotStored):
+        store.open(key)
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=1000-", 1000, len(PDF) - 1),
+    ("bytes=-500", len(PDF) - 500, len(PDF) - 1),
+])
+def test_range(store, header, start, end):
+    key = store.put(PDF)
+    obj = store.open(key, byte_range=header)
+    assert obj.length == end - start + 1
+    assert obj.content_range == f"bytes {start}-{end}/{len(PDF)}"
+    assert b"".join(obj.chunks) == PDF[start:end + 1]
+
+
+def test_unsatisfiable_range(store):
+    key = store.put(PDF)
+    with pytest.raises(InvalidRange):
+        store.open(key, byte_range=f"bytes={len(PDF) + 10}-")
+
+
+def test_put_file_consumes_source(store, tmp_path):
+    source = tmp_path / "bundle.zip"
+    source.write_bytes(b"PK\x03\x04" + PDF)
+    key = store.put_file(source, ".zip")
+    assert key.endswith(".zip")
+    assert not source.exists()
+    assert store.get(key) == b"PK\x03\x04" + PDF
+
+
+def test_s3_content_type_follows_key(s3_store, tmp_path):
+    pdf_key = s3_store.put(PDF)
+    source = tmp_path / "bundle.zip"
+    source.write_bytes(b"PK\x03\x04")
+    zip_key = s3_store.put_file(source, ".zip")
+
+    head = s3_store.client.head_object
+    assert head(Bucket="receipts", Key="tests/" + pdf_key)["ContentType"] == "application/pdf"
+    assert head(Bucket="receipts", Key="tests/" + zip_key)["ContentType"] == "application/zip"